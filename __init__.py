@@ -9,7 +9,7 @@ Description:
 Copyright (c) 2024 by sineom, All Rights Reserved. 
 '''
 
-from .revocation import Revocation
+from .revocation import RevocationAndLogger
 
 def get_class():
-    return Revocation 
\ No newline at end of file
+    return RevocationAndLogger
\ No newline at end of file
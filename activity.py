@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import json
+import os
+import threading
+from array import array
+from datetime import date, datetime
+
+from common.log import logger
+
+from .striped_lock import StripedLock
+
+HOURS = 168  # 小时环长度 (最近 7 天); 必须是 24 的倍数, 这样槽位 h % HOURS 对应的钟点始终是 h % 24
+
+
+def hour_index(value):
+    # 本地时间 -> 自公元 1 年起的小时序号; 接受 datetime 或日志里的 "YYYY-MM-DD HH:MM" 字符串 (比 strptime 快得多)
+    if isinstance(value, datetime): return value.toordinal() * 24 + value.hour
+    return date(int(value[0:4]), int(value[5:7]), int(value[8:10])).toordinal() * 24 + int(value[11:13])
+
+
+def _ring(size):
+    return array('I', bytes(4 * size))
+
+
+class GroupActivity:
+    # 一个群聊的滚动计数, 全部是定长的 array 环形缓冲, 占用与历史长短无关:
+    #   hours           最近 HOURS 小时每小时的消息数
+    #   daily           最近 days 天每天的消息数
+    #   members / kinds 每个成员 / 每种消息类型最近 days 天每天的消息数
+    # 同时维护窗口内的合计 (按钟点、按成员、按类型), 时间前进清空旧槽位时减掉, 查询不用遍历环
+    __slots__ = ("days", "hour_head", "day_head", "hours", "daily", "hour_of_day", "total", "members", "member_totals", "kinds", "kind_totals")
+
+    def __init__(self, days=30):
+        self.days = max(1, int(days))
+        self.hour_head = self.day_head = None  # 已经前进到的小时 / 天
+        self.hours = _ring(HOURS); self.daily = _ring(self.days); self.hour_of_day = [0] * 24; self.total = 0
+        self.members = {}; self.member_totals = {}
+        self.kinds = {}; self.kind_totals = {}
+
+    def advance(self, hour):
+        # 前进到 hour, 清空滑出窗口的槽位; 最多清空一整圈, 与间隔多久无关
+        day = hour // 24
+        if self.hour_head is None: self.hour_head = hour; self.day_head = day; return
+        if hour > self.hour_head:
+            for h in range(max(self.hour_head + 1, hour - HOURS + 1), hour + 1):
+                slot = h % HOURS; self.hour_of_day[h % 24] -= self.hours[slot]; self.hours[slot] = 0
+            self.hour_head = hour
+        if day > self.day_head:
+            for d in range(max(self.day_head + 1, day - self.days + 1), day + 1):
+                slot = d % self.days; self.total -= self.daily[slot]; self.daily[slot] = 0
+                for rings, totals in ((self.members, self.member_totals), (self.kinds, self.kind_totals)):
+                    for key, ring in rings.items():
+                        if ring[slot]: totals[key] -= ring[slot]; ring[slot] = 0
+            for rings, totals in ((self.members, self.member_totals), (self.kinds, self.kind_totals)):
+                for key in [k for k, n in totals.items() if not n]: del rings[key]; del totals[key]  # 窗口内已没有消息的成员不再保留
+            self.day_head = day
+
+    def add(self, hour, member=None, kind=None, count=1):
+        self.advance(hour)
+        if hour > self.hour_head - HOURS: self.hours[hour % HOURS] += count; self.hour_of_day[hour % 24] += count
+        day = hour // 24
+        if day <= self.day_head - self.days: return  # 迟到太久的消息, 已在窗口之外
+        slot = day % self.days; self.daily[slot] += count; self.total += count
+        if member:
+            ring = self.members.get(member)
+            if ring is None: ring = self.members[member] = _ring(self.days)
+            ring[slot] += count; self.member_totals[member] = self.member_totals.get(member, 0) + count
+        if kind:
+            ring = self.kinds.get(kind)
+            if ring is None: ring = self.kinds[kind] = _ring(self.days)
+            ring[slot] += count; self.kind_totals[kind] = self.kind_totals.get(kind, 0) + count
+
+    def summary(self, now_hour, top=10):
+        self.advance(now_hour)
+        today = now_hour // 24
+        return {"days": self.days, "total": self.total, "today": self.daily[today % self.days] if self.day_head == today else 0,
+                "last_24h": sum(self.hours[h % HOURS] for h in range(now_hour - 23, now_hour + 1)),
+                "last_7d": sum(self.hour_of_day),
+                "busiest_hours": sorted(((h, n) for h, n in enumerate(self.hour_of_day) if n), key=lambda x: -x[1]),
+                "top_members": heapq.nlargest(top, self.member_totals.items(), key=lambda x: x[1]),
+                "members": len(self.member_totals),
+                "kinds": sorted(self.kind_totals.items(), key=lambda x: -x[1])}
+
+    def to_dict(self):
+        return {"version": 1, "days": self.days, "hour_head": self.hour_head, "day_head": self.day_head,
+                "hours": self.hours.tolist(), "daily": self.daily.tolist(),
+                "members": {k: v.tolist() for k, v in self.members.items()}, "kinds": {k: v.tolist() for k, v in self.kinds.items()}}
+
+    @classmethod
+    def from_dict(cls, data, days=30):
+        activity = cls(days)
+        hour_head, day_head = data.get("hour_head"), data.get("day_head")
+        if hour_head is None or day_head is None: return activity
+        activity.hour_head, activity.day_head = hour_head, day_head
+        for slot, n in enumerate(data.get("hours", [])[:HOURS]):
+            if n: activity.hours[slot] = n; activity.hour_of_day[slot % 24] += n
+        saved_days = max(1, int(data.get("days", days)))
+
+        def by_day(values):
+            # 保存时的槽位 -> 当前窗口的槽位; 配置的 days 变小时滑出窗口的天数丢弃
+            for slot, n in enumerate(values[:saved_days]):
+                day = day_head - (day_head - slot) % saved_days
+                if n and day > day_head - activity.days: yield day % activity.days, n
+
+        for slot, n in by_day(data.get("daily", [])): activity.daily[slot] += n; activity.total += n
+        for key, rings, totals in (("members", activity.members, activity.member_totals), ("kinds", activity.kinds, activity.kind_totals)):
+            for name, values in data.get(key, {}).items():
+                ring = _ring(activity.days)
+                for slot, n in by_day(values): ring[slot] += n; totals[name] = totals.get(name, 0) + n
+                if totals.get(name): rings[name] = ring
+        return activity
+
+
+class ActivityIndex:
+    # 所有群聊的 GroupActivity, 首次访问时从 <群聊>.json 加载, snapshot() 时只写回有变动的群聊 (写临时文件再 rename)
+    # 每个群聊只在自己的分段锁内读写, 全局锁只保护待写回的群聊集合
+    def __init__(self, path_fn, days=30, stripes=64):
+        self._path_fn = path_fn
+        self.days = max(1, int(days))
+        self._groups = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._group_locks = StripedLock(stripes)
+        self._snapshot_lock = threading.Lock()
+
+    def _load(self, group_id):
+        # 调用方持有 group_id 的分段锁
+        activity = self._groups.get(group_id)
+        if activity is not None: return activity
+        file_path = self._path_fn(group_id)
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f: activity = GroupActivity.from_dict(json.load(f), self.days)
+        except FileNotFoundError: activity = GroupActivity(self.days)
+        except (IOError, OSError, ValueError, TypeError, AttributeError) as e:
+            logger.error(f"[RevocationAndLogger] 读取群活跃统计失败, 重新开始统计 (File: {file_path}): {e}"); activity = GroupActivity(self.days)
+        self._groups[group_id] = activity
+        return activity
+
+    def record(self, group_id, hour, member=None, kind=None):
+        with self._group_locks(group_id): self._load(group_id).add(hour, member, kind)
+        with self._lock: self._dirty.add(group_id)
+
+    def summary(self, group_id, now_hour, top=10):
+        # 群聊没有任何统计时返回 None
+        with self._group_locks(group_id):
+            activity = self._load(group_id)
+            if activity.hour_head is None: return None
+            return activity.summary(now_hour, top)
+
+    def snapshot(self):
+        with self._snapshot_lock:
+            with self._lock: dirty = self._dirty; self._dirty = set()
+            pending = []
+            for gid in dirty:
+                with self._group_locks(gid): pending.append((gid, json.dumps(self._groups[gid].to_dict(), ensure_ascii=False, separators=(',', ':'))))
+            written = 0
+            for group_id, content in pending:
+                file_path = self._path_fn(group_id); tmp_path = f"{file_path}.tmp"
+                try:
+                    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                    with open(tmp_path, 'w', encoding='utf-8') as f: f.write(content)
+                    os.replace(tmp_path, file_path); written += 1
+                except (IOError, OSError) as e:
+                    logger.error(f"[RevocationAndLogger] 写入群活跃统计失败 (File: {file_path}): {e}")
+                    with self._lock: self._dirty.add(group_id)
+            return written
+
+    def stats(self):
+        groups = list(self._groups.values())
+        with self._lock: dirty = len(self._dirty)
+        return {"groups": len(groups), "members": sum(len(g.member_totals) for g in groups), "dirty_groups": dirty}
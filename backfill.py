@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+# 历史聊天记录批量转换: 把 chat_logs 下的文本记录 (含按日期分区和压缩后的文件) 转为列式文件或导入 SQLite 存储, 并可重建最后发言记录
+# 用法: python plugins/RevocationAndLogger/backfill.py chat_logs [--format columnar|sqlite|none] [--jobs N] [--last-spoken]
+# 每个群聊由进程池中的一个进程处理; 文本文件用 mmap 逐行读取, 按字节解析, 只在需要时解码
+# 导入 SQLite 或重建最后发言时请先停止插件, 否则插件会用内存中的数据覆盖
+
+import argparse
+import gzip
+import io
+import json
+import mmap
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+
+try:
+    from common.log import logger
+except ImportError:  # 作为脚本单独运行时
+    import logging
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    logger = logging.getLogger("RevocationAndLogger.backfill")
+
+try:
+    from .log_archive import zstandard
+    from .search_index import find_log_files
+except ImportError:
+    from log_archive import zstandard
+    from search_index import find_log_files
+
+RECORD_MARK = " 【".encode('utf-8')
+NAME_END = "】".encode('utf-8')
+HEADER_GROUP_NAME = "# 群聊名称: ".encode('utf-8')
+COLUMNAR_MAGIC = b"RLCOL1\n"
+COLUMNAR_SUFFIX = ".rlc"
+BATCH_SIZE = 5000
+
+# 与 storage.SQLiteStorage.SCHEMA 相同; 本脚本需要在没有 dify-on-wechat 环境时也能运行, 不导入 storage
+SQLITE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS groups (
+        group_id TEXT PRIMARY KEY,
+        group_name TEXT,
+        created_at TEXT
+    );
+    CREATE TABLE IF NOT EXISTS chat_log (
+        id INTEGER PRIMARY KEY,
+        group_id TEXT NOT NULL,
+        timestamp TEXT NOT NULL,
+        sender TEXT NOT NULL,
+        content TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_chat_log_group_ts ON chat_log (group_id, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_chat_log_group_sender ON chat_log (group_id, sender);
+    CREATE TABLE IF NOT EXISTS last_spoken (
+        group_id TEXT NOT NULL,
+        sender TEXT NOT NULL,
+        timestamp TEXT NOT NULL,
+        UNIQUE (group_id, sender)
+    );
+    CREATE INDEX IF NOT EXISTS idx_last_spoken_group_ts ON last_spoken (group_id, timestamp);
+"""
+
+
+def iter_raw_lines(path):
+    # 逐行返回 bytes; 未压缩文件用 mmap, 不经过 Python 层的缓冲和解码
+    if path.endswith(".gz"):
+        with gzip.open(path, 'rb') as f: yield from f
+    elif path.endswith(".zst"):
+        if zstandard is None: raise OSError(f"未安装 zstandard, 无法读取 {path}")
+        with open(path, 'rb') as raw, io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)) as f: yield from f
+    else:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0: return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm: yield from iter(mm.readline, b"")
+
+
+def parse_line(line):
+    # b"YYYY-MM-DD HH:MM 【昵称】内容\n" -> (时间, 昵称, 内容), 均为 bytes; 不是记录行 (文件头等) 时返回 None
+    if len(line) < 21 or line[16:20] != RECORD_MARK or line[4] != 45 or line[13] != 58: return None
+    end = line.find(NAME_END, 20)
+    if end < 0: return None
+    return line[:16], line[20:end], line[end + 3:].rstrip(b"\r\n")
+
+
+class ColumnarWriter:
+    # 列式文件, 布局类似 Parquet, 内容列边读边写, 其余列和元数据放在文件尾:
+    #   MAGIC | 内容 (utf-8 拼接) | minute (uint32, 自公元 1 年起的分钟数) | sender (uint32, 昵称表下标) | offsets (uint64, 行数+1)
+    #   | 元数据 JSON | 元数据长度 (uint32) | MAGIC
+    # 数值列为小端序
+    def __init__(self, path, group_id, group_name=None):
+        self.path = path; self.group_id = group_id; self.group_name = group_name
+        self._tmp_path = f"{path}.part"; self._f = open(self._tmp_path, 'wb'); self._f.write(COLUMNAR_MAGIC)
+        self.minutes = array('I'); self.sender_ids = array('I'); self.offsets = array('Q', [0])
+        self.senders = {}; self._days = {}; self._size = 0
+
+    def add(self, ts, sender, content):
+        day = self._days.get(ts[:10])
+        if day is None: day = self._days[ts[:10]] = date(int(ts[0:4]), int(ts[5:7]), int(ts[8:10])).toordinal() * 1440
+        self.minutes.append(day + int(ts[11:13]) * 60 + int(ts[14:16]))
+        sender_id = self.senders.get(sender)
+        if sender_id is None: sender_id = self.senders[sender] = len(self.senders)
+        self.sender_ids.append(sender_id)
+        self._f.write(content); self._size += len(content); self.offsets.append(self._size)
+
+    def close(self):
+        columns = []; position = len(COLUMNAR_MAGIC) + self._size
+        columns.append({"name": "content", "type": "utf8", "offset": len(COLUMNAR_MAGIC), "length": self._size})
+        for name, values in (("minute", self.minutes), ("sender", self.sender_ids), ("offsets", self.offsets)):
+            if sys.byteorder == "big": values = array(values.typecode, values); values.byteswap()
+            data = values.tobytes(); self._f.write(data)
+            columns.append({"name": name, "type": {"I": "uint32", "Q": "uint64"}[values.typecode], "offset": position, "length": len(data)}); position += len(data)
+        footer = json.dumps({"version": 1, "group_id": self.group_id, "group_name": self.group_name, "rows": len(self.minutes),
+                             "senders": [s.decode('utf-8', 'replace') for s in self.senders], "columns": columns}, ensure_ascii=False).encode('utf-8')
+        self._f.write(footer); self._f.write(len(footer).to_bytes(4, "little")); self._f.write(COLUMNAR_MAGIC); self._f.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._f.close()
+        try: os.remove(self._tmp_path)
+        except OSError: pass
+
+
+def read_columnar(path):
+    # 返回 (元数据, {列名: array 或 bytes}); 供其他工具读取列式文件
+    with open(path, 'rb') as f: data = f.read()
+    if not data.startswith(COLUMNAR_MAGIC) or not data.endswith(COLUMNAR_MAGIC): raise ValueError(f"不是列式聊天记录文件: {path}")
+    end = len(data) - len(COLUMNAR_MAGIC); footer_length = int.from_bytes(data[end - 4:end], "little")
+    meta = json.loads(data[end - 4 - footer_length:end - 4].decode('utf-8')); columns = {}
+    for column in meta["columns"]:
+        raw = data[column["offset"]:column["offset"] + column["length"]]
+        if column["type"] == "utf8": columns[column["name"]] = raw; continue
+        values = array({"uint32": "I", "uint64": "Q"}[column["type"]]); values.frombytes(raw)
+        if sys.byteorder == "big": values.byteswap()
+        columns[column["name"]] = values
+    return meta, columns
+
+
+def iter_columnar(path):
+    # 逐行返回 (时间 "YYYY-MM-DD HH:MM", 昵称, 内容)
+    meta, columns = read_columnar(path); senders = meta["senders"]; content = columns["content"]; offsets = columns["offsets"]
+    for i, (minute, sender_id) in enumerate(zip(columns["minute"], columns["sender"])):
+        day, rest = divmod(minute, 1440)
+        yield f"{date.fromordinal(day).isoformat()} {rest // 60:02d}:{rest % 60:02d}", senders[sender_id], content[offsets[i]:offsets[i + 1]].decode('utf-8', 'replace')
+
+
+def convert_group(task):
+    # 在进程池中运行: 解析一个群的全部文件, 写列式文件或临时 SQLite 分片, 返回统计和每人最后发言时间
+    group_id, name, paths, fmt, target, cutoff = task
+    started = time.perf_counter(); cpu_started = time.process_time()
+    lines = records = skipped = 0; group_name = None; spoken = {}; part = writer = None; batch = []
+    if fmt == "columnar": writer = ColumnarWriter(target, group_id)
+    elif fmt == "sqlite":
+        part = sqlite3.connect(target, isolation_level=None)
+        part.execute("PRAGMA journal_mode=OFF"); part.execute("PRAGMA synchronous=OFF")
+        part.execute("CREATE TABLE chat_log (timestamp TEXT, sender TEXT, content TEXT)"); part.execute("BEGIN")
+    cutoff = cutoff.encode('ascii') if cutoff else None
+    try:
+        for path in paths:
+            for line in iter_raw_lines(path):
+                lines += 1
+                row = parse_line(line)
+                if row is None:
+                    if group_name is None and line.startswith(HEADER_GROUP_NAME): group_name = line[len(HEADER_GROUP_NAME):].strip().decode('utf-8', 'replace')
+                    continue
+                ts, sender, content = row; records += 1
+                if ts > spoken.get(sender, b""): spoken[sender] = ts
+                if writer is not None: writer.add(ts, sender, content)
+                elif part is not None:
+                    if cutoff and ts >= cutoff: skipped += 1; continue
+                    batch.append((ts.decode('ascii'), sender.decode('utf-8', 'replace'), content.decode('utf-8', 'replace')))
+                    if len(batch) >= BATCH_SIZE: part.executemany("INSERT INTO chat_log VALUES (?, ?, ?)", batch); batch = []
+        if writer is not None: writer.group_name = group_name; writer.close()
+        if part is not None:
+            if batch: part.executemany("INSERT INTO chat_log VALUES (?, ?, ?)", batch)
+            part.execute("COMMIT"); part.close()
+    except BaseException:
+        if writer is not None: writer.abort()
+        if part is not None: part.close()
+        raise
+    return {"group_id": group_id, "name": name, "group_name": group_name, "files": len(paths), "bytes": sum(os.path.getsize(p) for p in paths),
+            "lines": lines, "records": records, "skipped": skipped, "target": target,
+            "spoken": {s.decode('utf-8', 'replace'): ts.decode('ascii') for s, ts in spoken.items()},
+            "seconds": time.perf_counter() - started, "cpu": time.process_time() - cpu_started}
+
+
+def file_name(log_dir, paths):
+    # 群聊记录的文件名 (插件里 sanitize_filename 后的群聊ID): chat_logs/<名称>.txt 或 chat_logs/<名称>/<分区>.txt
+    parent = os.path.dirname(os.path.abspath(paths[0]))
+    return os.path.basename(parent) if parent != os.path.abspath(log_dir) else os.path.basename(paths[0])[:-4]
+
+
+def merge_last_spoken(path, spoken):
+    # 与已有的最后发言文件合并, 每人取较新的时间; 保持文件原有顺序, 新增的人按时间排在后面
+    members = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.rstrip('\n'); end = line.rfind('】')
+                if line.startswith('【') and end >= 0: members[line[1:end]] = line[end + 1:]
+    except FileNotFoundError: pass
+    changed = 0
+    for nickname, ts in sorted(spoken.items(), key=lambda x: x[1]):
+        if ts > members.get(nickname, ""): members[nickname] = ts; changed += 1
+    if not changed: return 0
+    os.makedirs(os.path.dirname(path), exist_ok=True); tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f: f.write(''.join(f"【{n}】{t}\n" for n, t in members.items()))
+    os.replace(tmp_path, path)
+    return changed
+
+
+def open_database(db_path):
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL"); conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SQLITE_SCHEMA)
+    return conn
+
+
+def load_part(conn, result):
+    # 把一个群的临时分片并入主库, 一个事务内完成, 中途失败不会留下半个群
+    conn.execute("ATTACH DATABASE ? AS part", (result["target"],))
+    try:
+        conn.execute("BEGIN")
+        conn.execute("INSERT INTO chat_log (group_id, timestamp, sender, content) SELECT ?, timestamp, sender, content FROM part.chat_log ORDER BY rowid", (result["group_id"],))
+        conn.execute("INSERT OR IGNORE INTO groups (group_id, group_name, created_at) VALUES (?, ?, ?)",
+                     (result["group_id"], result["group_name"], datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        conn.executemany("INSERT INTO last_spoken (group_id, sender, timestamp) VALUES (?, ?, ?) "
+                         "ON CONFLICT (group_id, sender) DO UPDATE SET timestamp = max(timestamp, excluded.timestamp)",
+                         [(result["group_id"], sender, ts) for sender, ts in result["spoken"].items()])
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        conn.execute("ROLLBACK"); raise
+    finally: conn.execute("DETACH DATABASE part")
+
+
+def run(log_dir, fmt="columnar", out_dir=None, db_path=None, jobs=None, last_spoken=False, progress_interval=2.0):
+    # 返回汇总统计; fmt 为 none 时只解析 (配合 last_spoken 重建最后发言, 或测量解析速度)
+    groups = find_log_files(log_dir)
+    jobs = max(1, jobs or os.cpu_count() or 1)
+    out_dir = out_dir or os.path.join(log_dir, "columnar"); db_path = db_path or os.path.join(log_dir, "chat_logs.db")
+    conn = work_dir = None; cutoffs = {}
+    if fmt == "columnar": os.makedirs(out_dir, exist_ok=True)
+    elif fmt == "sqlite":
+        # 只导入早于库中该群最早一条记录的行, 重复运行或插件已在写 SQLite 时不会重复导入
+        conn = open_database(db_path); cutoffs = dict(conn.execute("SELECT group_id, MIN(timestamp) FROM chat_log GROUP BY group_id").fetchall())
+        work_dir = tempfile.mkdtemp(prefix=".backfill_", dir=os.path.dirname(os.path.abspath(db_path)))
+    tasks = []
+    for group_id, paths in groups.items():
+        name = file_name(log_dir, paths)
+        target = os.path.join(out_dir, f"{name}{COLUMNAR_SUFFIX}") if fmt == "columnar" else os.path.join(work_dir, f"{len(tasks)}.db") if fmt == "sqlite" else None
+        tasks.append((group_id, name, paths, fmt, target, cutoffs.get(group_id)))
+    total_bytes = sum(os.path.getsize(p) for task in tasks for p in task[2])
+    summary = {"groups": len(tasks), "jobs": jobs, "files": 0, "bytes": 0, "lines": 0, "records": 0, "skipped": 0, "cpu": 0.0, "failed": 0, "last_spoken_updated": 0}
+    logger.info(f"[RevocationAndLogger] 开始转换 {len(tasks)} 个群聊, {sum(len(t[2]) for t in tasks)} 个文件, {total_bytes / 1048576:.1f}MB, 格式 {fmt}, {jobs} 个进程")
+    started = time.perf_counter(); reported = started; done = 0
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(convert_group, task): task for task in sorted(tasks, key=lambda t: -sum(os.path.getsize(p) for p in t[2]))}  # 大群先开始, 减少最后只剩一个进程在跑的时间
+            for future in as_completed(futures):
+                group_id = futures[future][0]
+                try:
+                    result = future.result()
+                    if conn is not None: load_part(conn, result); os.remove(result["target"])
+                    if last_spoken and fmt != "sqlite": summary["last_spoken_updated"] += merge_last_spoken(os.path.join(log_dir, "last_spoken", f"{result['name']}-最后发言.txt"), result["spoken"])
+                except Exception as e:
+                    summary["failed"] += 1; logger.error(f"[RevocationAndLogger] 转换群聊记录失败 ({group_id}): {e}"); continue
+                finally: done += 1
+                for key in ("files", "bytes", "lines", "records", "skipped", "cpu"): summary[key] += result[key]
+                now = time.perf_counter()
+                if now - reported >= progress_interval or done == len(tasks):
+                    reported = now; elapsed = now - started
+                    logger.info(f"[RevocationAndLogger] 进度 {done}/{len(tasks)} 个群聊, {summary['bytes'] / total_bytes * 100 if total_bytes else 100:.1f}% "
+                                f"({summary['bytes'] / 1048576:.1f}/{total_bytes / 1048576:.1f}MB), {summary['records']} 条, {summary['records'] / elapsed:.0f} 条/秒")
+                logger.debug(f"[RevocationAndLogger] {group_id}: {result['records']} 条, {result['seconds']:.2f}s")
+    finally:
+        if conn is not None: conn.close()
+        if work_dir: shutil.rmtree(work_dir, ignore_errors=True)
+    summary["seconds"] = time.perf_counter() - started
+    summary["lines_per_second"] = summary["lines"] / summary["seconds"] if summary["seconds"] else 0
+    summary["lines_per_core_second"] = summary["lines"] / summary["cpu"] if summary["cpu"] else 0  # 按各进程的 CPU 时间计算
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量转换历史群聊记录: 列式文件 / 导入 SQLite / 重建最后发言记录")
+    parser.add_argument("log_dir", help="聊天记录目录, 如 dify-on-wechat/chat_logs")
+    parser.add_argument("--format", choices=("columnar", "sqlite", "none"), default="columnar",
+                        help="columnar: 每个群一个 .rlc 列式文件; sqlite: 导入 storage_engine=sqlite 使用的数据库 (同时更新其中的最后发言); none: 只解析")
+    parser.add_argument("--out", help="列式文件输出目录, 默认为 <log_dir>/columnar")
+    parser.add_argument("--db", help="SQLite 数据库, 默认为 <log_dir>/chat_logs.db")
+    parser.add_argument("--jobs", type=int, help="进程数, 默认为 CPU 核数")
+    parser.add_argument("--last-spoken", action="store_true", help="按记录重建 <log_dir>/last_spoken 下的最后发言文件 (与已有文件合并, 取较新的时间)")
+    args = parser.parse_args()
+    summary = run(args.log_dir, args.format, args.out, args.db, args.jobs, args.last_spoken)
+    logger.info(f"[RevocationAndLogger] 转换完成: {summary['groups']} 个群聊, {summary['records']} 条记录 ({summary['lines']} 行, 跳过已导入 {summary['skipped']} 条), "
+                f"{summary['bytes'] / 1048576:.1f}MB, 用时 {summary['seconds']:.1f}s, {summary['lines_per_second']:.0f} 行/秒, "
+                f"每核 {summary['lines_per_core_second']:.0f} 行/秒 ({summary['jobs']} 个进程)"
+                + (f", 更新最后发言 {summary['last_spoken_updated']} 人" if args.last_spoken and args.format != "sqlite" else "")
+                + (f", {summary['failed']} 个群聊失败" if summary["failed"] else ""))
+    sys.exit(1 if summary["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# 历史记录批量转换 (backfill.py) 的吞吐测试: 生成多个群的合成聊天记录 (部分按日期分区并 gzip 压缩),
+# 分别用 1 个进程和 --jobs 个进程转换, 报告 行/秒 与 每核 行/秒 (按各进程的 CPU 时间), 并抽查转换结果与原文一致
+# 用法: python bench/bench_backfill.py [--groups 8] [--lines 200000] [--jobs N] [--format columnar|sqlite|none] [--gzip-ratio 0.25]
+
+import argparse
+import gzip
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backfill
+
+WORDS = ["今天", "晚上", "吃饭", "火锅", "开会", "好的", "收到", "哈哈哈", "明天见", "[图片]", "[语音]", "[链接/卡片: 周末活动报名]",
+         "ok", "thanks", "我觉得可以", "[引用消息 「张三」] 同意", "有人在吗", "这个问题我看一下", "[拍了拍]", "👍"]
+
+
+def generate(log_dir, args):
+    # 返回生成的记录条数; 每 gzip_ratio 比例的群按日期分区, 除最后一天外都压缩
+    rnd = random.Random(args.seed); total = 0; start = datetime(2024, 1, 1)
+    for g in range(args.groups):
+        group_id = f"{40000000 + g}@chatroom"; partitioned = g < args.groups * args.gzip_ratio
+        header = f"# 群聊名称: 测试群{g}\n# 群聊 ID: {group_id}\n# 文件创建时间: {start:%Y-%m-%d %H:%M:%S}\n---\n"
+        files = {}; ts = start
+        for _ in range(args.lines):
+            ts += timedelta(seconds=rnd.randrange(1, 120))
+            line = f"{ts:%Y-%m-%d %H:%M} 【成员{rnd.randrange(args.members)}】{' '.join(rnd.choices(WORDS, k=rnd.randrange(1, 8)))}\n"
+            key = f"{ts:%Y-%m-%d}" if partitioned else None
+            if key not in files: files[key] = [header]
+            files[key].append(line)
+        total += args.lines
+        if not partitioned:
+            with open(os.path.join(log_dir, f"{group_id}.txt"), 'w', encoding='utf-8') as f: f.writelines(files[None])
+            continue
+        os.makedirs(os.path.join(log_dir, group_id))
+        keys = sorted(files)
+        for key in keys:
+            path = os.path.join(log_dir, group_id, f"{key}.txt")
+            if key != keys[-1]:
+                with gzip.open(path + ".gz", 'wt', encoding='utf-8', compresslevel=1) as f: f.writelines(files[key])
+            else:
+                with open(path, 'w', encoding='utf-8') as f: f.writelines(files[key])
+    return total
+
+
+def verify(log_dir, out_dir, db_path, fmt, expected):
+    # 抽查: 转换后的总条数等于生成的条数, 且第一个群的内容与原文逐行一致
+    groups = backfill.find_log_files(log_dir); group_id, paths = sorted(groups.items())[0]
+    original = [tuple(x.decode('utf-8') for x in row) for path in paths for row in map(backfill.parse_line, backfill.iter_raw_lines(path)) if row]
+    if fmt == "columnar":
+        converted = list(backfill.iter_columnar(os.path.join(out_dir, f"{backfill.file_name(log_dir, paths)}{backfill.COLUMNAR_SUFFIX}")))
+        total = sum(backfill.read_columnar(os.path.join(out_dir, name))[0]["rows"] for name in os.listdir(out_dir) if name.endswith(backfill.COLUMNAR_SUFFIX))
+    else:
+        with sqlite3.connect(db_path) as conn:
+            converted = conn.execute("SELECT timestamp, sender, content FROM chat_log WHERE group_id = ? ORDER BY id", (group_id,)).fetchall()
+            total = conn.execute("SELECT COUNT(*) FROM chat_log").fetchone()[0]
+    problems = []
+    if total != expected: problems.append(f"转换后共 {total} 条, 应为 {expected} 条")
+    if converted != original: problems.append(f"{group_id} 的内容与原文不一致 ({len(converted)}/{len(original)} 条)")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="backfill.py 吞吐测试")
+    parser.add_argument("--groups", type=int, default=8)
+    parser.add_argument("--lines", type=int, default=200000, help="每个群的记录条数")
+    parser.add_argument("--members", type=int, default=300)
+    parser.add_argument("--gzip-ratio", type=float, default=0.25, help="按日期分区并压缩的群所占比例")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--format", choices=("columnar", "sqlite", "none"), default="columnar")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="保留生成的数据目录")
+    args = parser.parse_args()
+    backfill.logger.setLevel(logging.WARNING)
+
+    workdir = tempfile.mkdtemp(prefix="revocation_backfill_"); log_dir = os.path.join(workdir, "chat_logs"); os.makedirs(log_dir)
+    try:
+        started = time.perf_counter(); expected = generate(log_dir, args)
+        size = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(log_dir) for f in files)
+        print(f"生成 {args.groups} 个群 x {args.lines} 条 = {expected} 条, {size / 1048576:.1f}MB (磁盘上), 用时 {time.perf_counter() - started:.1f}s")
+        print(f"\n{'进程':>4}{'用时(s)':>10}{'行/秒':>12}{'每核 行/秒':>14}{'加速比':>8}  检查")
+        baseline = None
+        for jobs in sorted({1, max(1, args.jobs)}):
+            out_dir = os.path.join(workdir, f"columnar_{jobs}"); db_path = os.path.join(workdir, f"chat_logs_{jobs}.db")
+            summary = backfill.run(log_dir, args.format, out_dir, db_path, jobs, progress_interval=3600)
+            problems = ["有群聊转换失败"] if summary["failed"] else []
+            if args.format != "none" and not problems: problems = verify(log_dir, out_dir, db_path, args.format, expected)
+            baseline = baseline or summary["seconds"]
+            print(f"{jobs:>6}{summary['seconds']:>12.2f}{summary['lines_per_second']:>14.0f}{summary['lines_per_core_second']:>16.0f}{baseline / summary['seconds']:>10.2f}  "
+                  + ("通过" if not problems else "; ".join(problems)))
+        if args.format == "columnar":
+            print(f"\n列式文件 {sum(os.path.getsize(os.path.join(out_dir, f)) for f in os.listdir(out_dir)) / 1048576:.1f}MB")
+    finally:
+        if args.keep: print(f"数据目录: {workdir}")
+        else: shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# 缓存每条消息占用的内存: 保存完整 ChatMessage (旧做法) 与 CachedMessage 快照 (现做法) 对比
+# 用法: python bench/bench_cache_memory.py [条数]
+
+import copy
+import enum
+import importlib.util
+import os
+import sys
+import time
+import tracemalloc
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_module(name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(PLUGIN_DIR, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec); spec.loader.exec_module(module)
+    return module
+
+
+CachedMessage = load_module("revoke_cache").CachedMessage
+
+
+class ContextType(enum.Enum):
+    TEXT = 1
+    IMAGE = 3
+
+
+class FakeChatMessage:
+    # 仿照 gewechat 回调生成的消息对象: 原始回调 dict、msg_data、XML 内容与 channel/client 引用
+    def __init__(self, i, ctype, client):
+        xml_source = f'<msgsource><atuserlist></atuserlist><silence>1</silence><membercount>{300 + i % 200}</membercount>' \
+                     f'<signature>V1_{"x" * 32}|v1_{"y" * 32}</signature><tmp_node><publisher-id></publisher-id></tmp_node></msgsource>'
+        if ctype == ContextType.TEXT:
+            text = f"第{i}条测试消息，内容长度和真实群聊里的普通发言差不多。"
+            payload = {"MsgId": 100000 + i, "FromUserName": {"string": "12345678@chatroom"}, "ToUserName": {"string": "wxid_bot"},
+                       "MsgType": 1, "Content": {"string": f"wxid_member{i % 500}:\n{text}"}, "Status": 3, "ImgStatus": 1,
+                       "CreateTime": int(time.time()), "MsgSource": xml_source, "PushContent": f"成员{i % 500} : {text}", "NewMsgId": 7000000000000000000 + i}
+            self.content = text
+        else:
+            img_xml = f'<?xml version="1.0"?><msg><img aeskey="{"a" * 32}" encryver="1" cdnthumbaeskey="{"b" * 32}" cdnthumburl="{"c" * 180}" ' \
+                      f'cdnthumblength="4523" cdnthumbheight="120" cdnthumbwidth="90" cdnmidheight="0" cdnmidwidth="0" cdnhdheight="0" ' \
+                      f'cdnhdwidth="0" cdnmidimgurl="{"d" * 180}" length="{80000 + i}" md5="{"e" * 32}" hevc_mid_size="{60000 + i}" /></msg>'
+            payload = {"MsgId": 100000 + i, "FromUserName": {"string": "12345678@chatroom"}, "ToUserName": {"string": "wxid_bot"},
+                       "MsgType": 3, "Content": {"string": f"wxid_member{i % 500}:\n{img_xml}"}, "Status": 3, "ImgStatus": 2,
+                       "ImgBuf": {"iLen": 0}, "CreateTime": int(time.time()), "MsgSource": xml_source, "NewMsgId": 7000000000000000000 + i}
+            self.content = f"/app/tmp/{payload['NewMsgId']}.png"
+        self.msg = {"TypeName": "AddMsg", "Appid": "wx_app", "Wxid": "wxid_bot", "Data": payload}
+        self.msg_data = payload
+        self.msg_id = payload["NewMsgId"]; self.create_time = payload["CreateTime"]; self.ctype = ctype
+        self.from_user_id = "12345678@chatroom"; self.from_user_nickname = "测试群"; self.to_user_id = "wxid_bot"; self.to_user_nickname = "bot"
+        self.other_user_id = self.from_user_id; self.other_user_nickname = self.from_user_nickname; self.my_msg = False
+        self.self_display_name = ""; self.is_group = True; self.is_at = False
+        self.actual_user_id = f"wxid_member{i % 500}"; self.actual_user_nickname = f"成员{i % 500}"
+        self.at_list = []; self.client = client; self._prepare_fn = None; self._prepared = True; self._rawmsg = self.msg
+
+
+def measure(build, count):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = [build(i) for i in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del kept
+    return total / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    client = object()
+    rows = []
+    for ctype in (ContextType.TEXT, ContextType.IMAGE):
+        # 旧做法: 文本直接缓存 ChatMessage; 媒体缓存 (copy.copy(msg), tmp_path)
+        def old(i, ctype=ctype):
+            msg = FakeChatMessage(i, ctype, client)
+            if ctype == ContextType.TEXT: return msg
+            msg_copy = copy.copy(msg); tmp_path = f"/app/tmp/{msg.msg_id}_{i:08x}.png"; msg_copy.content = tmp_path
+            return (msg_copy, tmp_path)
+
+        def new(i, ctype=ctype):
+            msg = FakeChatMessage(i, ctype, client)
+            if ctype == ContextType.TEXT: return CachedMessage.from_msg(msg, float(msg.create_time))
+            tmp_path = f"/app/tmp/{msg.msg_id}_{i:08x}.png"
+            return CachedMessage.from_msg(msg, float(msg.create_time), content=tmp_path, tmp_path=tmp_path)
+
+        rows.append((ctype.name, measure(old, count), measure(new, count)))
+
+    print(f"每条缓存消息占用内存 (tracemalloc, {count} 条):")
+    print(f"{'类型':<8}{'ChatMessage':>14}{'CachedMessage':>16}{'节省':>10}")
+    for name, old_bytes, new_bytes in rows:
+        print(f"{name:<8}{old_bytes:>12.0f} B{new_bytes:>14.0f} B{(1 - new_bytes / old_bytes) * 100:>9.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# 启动时重放撤回缓存日志的耗时: 写入 N 条记录 (部分已过期), 再重放到 RevokeCache
+# 用法: python bench/bench_journal_replay.py [过期比例, 默认 0.5]
+
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_module(name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(PLUGIN_DIR, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec); spec.loader.exec_module(module)
+    return module
+
+
+revoke_cache = load_module("revoke_cache")
+revoke_journal = load_module("revoke_journal")
+
+SIZES = (1000, 10000, 100000)
+
+
+def row(i, now):
+    # 与插件写入的记录格式相同: [keys, msg_id, ctype, content, from_user_id, actual_user_id, actual_user_nickname, create_time, tmp_path, size]
+    msg_id = str(7000000000000000000 + i)
+    if i % 5 == 0:
+        return [[msg_id, str(100000 + i)], msg_id, "IMAGE", "", "12345678@chatroom", f"wxid_member{i % 500}", f"成员{i % 500}", now,
+                f"/app/tmp/blob_{i:032x}.jpg", 80000]
+    text = f"第{i}条测试消息，内容长度和真实群聊里的普通发言差不多。"
+    return [[msg_id, str(100000 + i)], msg_id, "TEXT", text, "12345678@chatroom", f"wxid_member{i % 500}", f"成员{i % 500}", now, None, len(text.encode("utf-8"))]
+
+
+def main():
+    expired_ratio = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+    print(f"撤回缓存日志重放耗时 (过期比例 {expired_ratio:.0%}):")
+    print(f"{'记录数':>8}{'日志大小':>12}{'段数':>6}{'写入':>10}{'重放':>10}{'恢复条数':>10}{'条/秒':>12}")
+    for size in SIZES:
+        directory = tempfile.mkdtemp(prefix="revoke_journal_")
+        try:
+            now = time.time(); expired = int(size * expired_ratio)
+            journal = revoke_journal.RevokeJournal(directory, segment_bytes=4 * 1024 * 1024, segment_seconds=3600)
+            started = time.perf_counter()
+            for i in range(size): journal.append(now - 10 if i < expired else now + 120, row(i, now))
+            journal.close(); write_ms = (time.perf_counter() - started) * 1000
+            total_bytes = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory))
+
+            # 相当于插件启动: 新建日志对象与缓存, 重放全部段
+            started = time.perf_counter()
+            journal = revoke_journal.RevokeJournal(directory)
+            cache = revoke_cache.RevokeCache(max_entries=size * 2, max_bytes=1 << 40)
+            for expire_at, record in journal.replay():
+                keys, msg_id, ctype, content, from_user_id, actual_user_id, actual_user_nickname, create_time, tmp_path, nbytes = record
+                cache.put(keys, revoke_cache.CachedMessage(msg_id, ctype, content, from_user_id, actual_user_id, actual_user_nickname, create_time, tmp_path), expire_at, nbytes)
+            replay_s = time.perf_counter() - started
+            journal.close()
+            print(f"{size:>10}{total_bytes / 1024 / 1024:>10.1f}MB{len(os.listdir(directory)):>6}{write_ms:>8.0f}ms{replay_s * 1000:>8.0f}ms"
+                  f"{len(cache):>10}{size / replay_s:>12.0f}")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+# 负载测试: 用桩模块加载插件, 按目标速率向 on_receive_message / on_handle_context 投递合成消息
+# (N 个群、每群 M 个成员, 文本/图片/文件/语音/链接等混合, 按比例撤回和发命令),
+# 报告吞吐、每条消息的 p50/p99 延迟、各热点方法的耗时、内存与文件描述符占用
+# 用法: python bench/bench_load.py [--messages 20000] [--rate 0] [--groups 20] [--members 50] [--revoke-ratio 0.05]
+#       [--api-latency 0.05] [--api-failure 0.1] [key=value ...]   (key=value 覆盖插件配置, value 按 JSON 解析)
+
+import argparse
+import atexit
+import collections
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import stubs
+
+# 计时的插件方法: 群聊记录分为 build_log_record 和 write_log_record 两步 (写入在写入队列线程里执行),
+# handle_msg 的耗时包含其中调用的 handle_revoke
+TIMED_METHODS = ("on_receive_message", "on_handle_context", "build_log_record", "write_log_record",
+                 "update_last_spoken_time", "record_activity", "handle_msg", "handle_revoke")
+MEDIA_TYPES = (stubs.ContextType.IMAGE, stubs.ContextType.FILE, stubs.ContextType.VOICE, stubs.ContextType.VIDEO)
+OTHER_TYPES = (stubs.ContextType.SHARING, stubs.ContextType.CARD, stubs.ContextType.PATPAT)
+
+
+class MessageGenerator:
+    # 生成 (kind, ChatMessage) 序列; 撤回只针对最近 expire 秒内发出的消息, 与真实撤回的时间窗口一致
+    def __init__(self, groups, members, revoke_ratio, media_ratio, command_ratio, private_ratio, media_files, triggers, seed=None, expire=120):
+        self.random = random.Random(seed)
+        self.groups = [f"{20000000 + i}@chatroom" for i in range(groups)]
+        self.members = [[(f"wxid_g{g}m{m}", f"成员{g}-{m}") for m in range(members)] for g in range(groups)]
+        self.friends = [(f"wxid_friend{i}", f"好友{i}") for i in range(max(1, members))]
+        self.revoke_ratio = revoke_ratio; self.media_ratio = media_ratio; self.command_ratio = command_ratio; self.private_ratio = private_ratio
+        self.media_files = media_files; self.triggers = triggers; self.expire = expire
+        self.recent = collections.deque()  # (发送时间, msg)
+        self.seq = 0
+
+    def next(self):
+        self.seq += 1; r = self.random.random(); now = time.time()
+        while self.recent and self.recent[0][0] < now - self.expire: self.recent.popleft()
+        if r < self.revoke_ratio and self.recent: return "revoke", self.revoke(self.random.choice(self.recent)[1], now)
+        if r < self.revoke_ratio + self.command_ratio: return "command", self.command(now)
+        msg = self.message(now); self.recent.append((now, msg))
+        return ("media" if msg.ctype in MEDIA_TYPES else "message"), msg
+
+    def sender(self):
+        if self.random.random() < self.private_ratio:
+            wxid, nickname = self.random.choice(self.friends)
+            return dict(from_user_id=wxid, from_user_nickname=nickname, is_group=False)
+        g = self.random.randrange(len(self.groups)); wxid, nickname = self.random.choice(self.members[g])
+        return dict(from_user_id=self.groups[g], is_group=True, actual_user_id=wxid, actual_user_nickname=nickname)
+
+    def message(self, now):
+        msg_id = 7000000000000000000 + self.seq
+        fields = dict(msg_id=msg_id, create_time=now, msg_data={"MsgId": 100000 + self.seq, "NewMsgId": msg_id}, **self.sender())
+        r = self.random.random()
+        if r < self.media_ratio:
+            ctype = self.random.choice(MEDIA_TYPES)
+            return stubs.ChatMessage(ctype=ctype, content=self.random.choice(self.media_files), **fields)
+        if r < self.media_ratio + 0.05:
+            ctype = self.random.choice(OTHER_TYPES)
+            content = f"<msg><appmsg><title>分享链接{self.seq}</title></appmsg></msg>" if ctype == stubs.ContextType.SHARING else f'<msg nickname="名片{self.seq}"/>'
+            return stubs.ChatMessage(ctype=ctype, content=content, **fields)
+        if r < self.media_ratio + 0.1:
+            content = f"「成员: <msg>引用的原消息</msg>」\n- - - - - - - - - - - - - - -\n回复第{self.seq}条"
+        else: content = f"第{self.seq}条消息，" + "普通群聊发言内容" * self.random.randint(1, 8)
+        return stubs.ChatMessage(ctype=stubs.ContextType.TEXT, content=content, **fields)
+
+    def revoke(self, original, now):
+        nickname = original.actual_user_nickname if original.is_group else original.from_user_nickname
+        xml = f'<sysmsg type="revokemsg"><revokemsg><session>{original.from_user_id}</session><msgid>{original.msg_data["MsgId"]}</msgid>' \
+              f'<newmsgid>{original.msg_id}</newmsgid><replacemsg><![CDATA["{nickname}" 撤回了一条消息]]></replacemsg></revokemsg></sysmsg>'
+        return stubs.ChatMessage(msg_id=8000000000000000000 + self.seq, create_time=now, ctype=stubs.ContextType.REVOKE, content=xml,
+                                 from_user_id=original.from_user_id, is_group=original.is_group,
+                                 actual_user_id=original.actual_user_id, actual_user_nickname=original.actual_user_nickname)
+
+    def command(self, now):
+        fields = self.sender()
+        while not fields["is_group"]: fields = self.sender()
+        trigger, search = self.triggers
+        content = self.random.choice([trigger, f"{trigger} 前10", f"{trigger} 最新", f"{search} 普通", f"{search} 消息 第2页"])
+        return stubs.ChatMessage(msg_id=9000000000000000000 + self.seq, create_time=now, ctype=stubs.ContextType.TEXT, content=content, **fields)
+
+
+class Timings:
+    # 各方法的耗时样本 (毫秒); 写入队列/通知线程里也会调用, list.append 本身是线程安全的
+    def __init__(self):
+        self.samples = collections.defaultdict(list)
+
+    def wrap(self, plugin, name):
+        fn = getattr(plugin, name); samples = self.samples[name]
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try: return fn(*args, **kwargs)
+            finally: samples.append((time.perf_counter() - started) * 1000)
+        setattr(plugin, name, timed)
+
+
+def percentiles(samples):
+    s = sorted(samples)
+    if not s: return 0, 0, 0, 0
+    return len(s), s[len(s) // 2], s[min(len(s) - 1, int(len(s) * 0.99))], s[-1]
+
+
+def process_usage():
+    usage = {"rss_mb": 0.0, "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, "fds": -1, "threads": threading.active_count()}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"): usage["rss_mb"] = int(line.split()[1]) / 1024
+                elif line.startswith("VmHWM:"): usage["peak_rss_mb"] = int(line.split()[1]) / 1024
+        usage["fds"] = len(os.listdir("/proc/self/fd"))
+    except OSError: pass
+    return usage
+
+
+def parse_overrides(items):
+    config = {}
+    for item in items:
+        key, _, value = item.partition("=")
+        try: config[key] = json.loads(value)
+        except ValueError: config[key] = value
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RevocationAndLogger 负载测试")
+    parser.add_argument("--messages", type=int, default=20000, help="投递的消息总数")
+    parser.add_argument("--rate", type=float, default=0, help="目标速率 (条/秒), 0 表示不限速")
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--members", type=int, default=50, help="每个群的成员数")
+    parser.add_argument("--revoke-ratio", type=float, default=0.05)
+    parser.add_argument("--command-ratio", type=float, default=0.002)
+    parser.add_argument("--media-ratio", type=float, default=0.1)
+    parser.add_argument("--private-ratio", type=float, default=0.1)
+    parser.add_argument("--media-kb", type=int, default=64, help="模拟媒体文件的大小")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="假 gewechat 接口每次调用的耗时 (秒)")
+    parser.add_argument("--api-failure", type=float, default=0.0, help="假 gewechat 接口返回失败的概率")
+    parser.add_argument("--drain-timeout", type=float, default=10, help="投递结束后等待队列清空的最长时间 (秒)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="保留临时工作目录")
+    parser.add_argument("config", nargs="*", help="插件配置覆盖, 如 storage_engine=sqlite notify_rate=50")
+    args = parser.parse_args()
+
+    # 插件在当前目录下创建 tmp/ 与 chat_logs/, 放到临时目录里; atexit 后进先出, 这里先注册保证最后清理
+    workdir = tempfile.mkdtemp(prefix="revocation_bench_"); os.chdir(workdir)
+    if not args.keep: atexit.register(shutil.rmtree, workdir, True)
+    config = {"receiver": {"name": "wxid_bench_receiver"}, **parse_overrides(args.config)}
+    client = stubs.FakeGewechatClient(latency=args.api_latency, failure_rate=args.api_failure, seed=args.seed)
+    revocation = stubs.install(config, client=client, global_config={"gewechat_callback_url": "http://127.0.0.1:9919/v2/api/callback/collect"})
+
+    os.makedirs("incoming")
+    media_files = []
+    for i in range(16):
+        path = os.path.join(workdir, "incoming", f"media_{i}.jpg")
+        with open(path, "wb") as f: f.write(os.urandom(args.media_kb * 1024))
+        media_files.append(path)
+
+    before = process_usage()
+    started = time.perf_counter()
+    plugin = revocation.RevocationAndLogger()
+    init_ms = (time.perf_counter() - started) * 1000
+    timings = Timings()
+    for name in TIMED_METHODS: timings.wrap(plugin, name)
+    generator = MessageGenerator(args.groups, args.members, args.revoke_ratio, args.media_ratio, args.command_ratio, args.private_ratio,
+                                 media_files, (plugin.command_trigger, plugin.search_trigger), seed=args.seed,
+                                 expire=plugin.config.get("message_expire_time", 120))
+    channel = stubs.RecordingChannel()
+    per_kind = collections.defaultdict(list); peak_fds = before["fds"]; lag = 0.0
+
+    print(f"工作目录: {workdir}  插件初始化 {init_ms:.0f}ms")
+    print(f"投递 {args.messages} 条消息 ({args.groups} 群 x {args.members} 成员, 速率 {args.rate or '不限'}, 接口延迟 {args.api_latency * 1000:.0f}ms, 失败率 {args.api_failure:.0%})...")
+    started = time.perf_counter()
+    for i in range(args.messages):
+        if args.rate:
+            # 开环: 按计划时间投递, 处理跟不上时不降速, 记录最大落后时间
+            delay = started + i / args.rate - time.perf_counter()
+            if delay > 0: time.sleep(delay)
+            else: lag = max(lag, -delay)
+        kind, msg = generator.next()
+        context = stubs.Context(msg.ctype, msg.content, {"msg": msg, "isgroup": msg.is_group})
+        t0 = time.perf_counter()
+        plugin.on_receive_message(stubs.EventContext(stubs.Event.ON_RECEIVE_MESSAGE, {"context": context}))
+        if msg.ctype == stubs.ContextType.TEXT:
+            plugin.on_handle_context(stubs.EventContext(stubs.Event.ON_HANDLE_CONTEXT, {"context": context, "channel": channel}))
+        per_kind[kind].append((time.perf_counter() - t0) * 1000)
+        if i % 500 == 0: peak_fds = max(peak_fds, process_usage()["fds"])
+    elapsed = time.perf_counter() - started
+    loaded = process_usage()
+
+    # 等待写入队列、媒体预取和通知队列处理完
+    drain_started = time.perf_counter()
+    plugin.writer_queue.flush()
+    deadline = time.time() + args.drain_timeout
+    while time.time() < deadline:
+        notify = plugin.notifier.stats()
+        if not notify["depth"] and not notify["busy"] and not notify["pending_digests"]: break
+        time.sleep(0.05)
+    drain_ms = (time.perf_counter() - drain_started) * 1000
+    drained = process_usage()
+
+    total = sum(len(v) for v in per_kind.values())
+    print(f"\n吞吐: {total / elapsed:.0f} 条/秒 (耗时 {elapsed:.2f}s" + (f", 最大落后计划 {lag * 1000:.0f}ms" if args.rate else "") + f"), 队列清空 {drain_ms:.0f}ms")
+    print(f"\n{'每条消息 (ms)':<22}{'条数':>8}{'p50':>10}{'p99':>10}{'max':>10}")
+    for kind in ("message", "media", "revoke", "command"):
+        count, p50, p99, worst = percentiles(per_kind[kind])
+        if count: print(f"{kind:<24}{count:>8}{p50:>10.3f}{p99:>10.3f}{worst:>10.1f}")
+    count, p50, p99, worst = percentiles([x for v in per_kind.values() for x in v])
+    print(f"{'全部':<22}{count:>8}{p50:>10.3f}{p99:>10.3f}{worst:>10.1f}")
+    print(f"\n{'方法 (ms)':<22}{'调用':>8}{'p50':>10}{'p99':>10}{'max':>10}")
+    for name in TIMED_METHODS:
+        count, p50, p99, worst = percentiles(timings.samples[name])
+        print(f"{name:<24}{count:>8}{p50:>10.3f}{p99:>10.3f}{worst:>10.1f}")
+
+    print(f"\n{'资源':<12}{'RSS(MB)':>10}{'峰值(MB)':>10}{'fd':>6}{'线程':>6}")
+    for label, usage in (("启动前", before), ("投递结束", loaded), ("队列清空", drained)):
+        print(f"{label:<10}{usage['rss_mb']:>12.1f}{usage['peak_rss_mb']:>10.1f}{usage['fds']:>6}{usage['threads']:>6}")
+    print(f"{'投递中 fd 峰值':<10}{peak_fds:>28}")
+
+    print(f"\n接口调用: {dict(sorted(client.counts.items()))}  命令回复: {len(channel.sent)} 条")
+    print(f"撤回缓存: {plugin.msg_cache.stats()}")
+    print(f"写入队列: {plugin.writer_queue.stats()}")
+    print(f"通知队列: {plugin.notifier.stats()}")
+    print(f"名称解析: {plugin.resolver.stats()}")
+    print("周期任务: " + ", ".join(f"{name} {job['runs']}次/{job['avg_ms']}ms" + (f"/失败{job['failures']}" if job["failures"] else "") for name, job in plugin.scheduler.stats().items()))
+
+
+if __name__ == "__main__":
+    main()
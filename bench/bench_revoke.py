@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# 撤回处理的查找延迟与缓存大小的关系: 旧做法 (三次 re.search + INFO 日志输出全部缓存 key) 与
+# 现做法 (一次扫描的 revoke_parser + RevokeCache 别名索引) 对比
+# 用法: python bench/bench_revoke.py [每种规模的撤回次数]
+
+import importlib.util
+import os
+import re
+import statistics
+import sys
+import time
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_module(name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(PLUGIN_DIR, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec); spec.loader.exec_module(module)
+    return module
+
+
+revoke_cache = load_module("revoke_cache")
+revoke_parser = load_module("revoke_parser")
+
+SIZES = (1000, 10000, 100000)
+
+
+def revoke_xml(i):
+    return f'<sysmsg type="revokemsg"><revokemsg><session>12345678@chatroom</session><msgid>{100000 + i}</msgid>' \
+           f'<newmsgid>{7000000000000000000 + i}</newmsgid><replacemsg><![CDATA["成员{i % 500}" 撤回了一条消息]]></replacemsg>' \
+           f'<announcement_id><![CDATA[]]></announcement_id></revokemsg></sysmsg>'
+
+
+def old_handle(xml, cache):
+    # 改动前 handle_revoke 的取 id 与查找部分
+    possible_ids = []
+    msgid_match = re.search(r"<msgid>(.*?)</msgid>", xml); msgid_xml = str(msgid_match.group(1)) if msgid_match else None
+    newmsgid_match = re.search(r"<newmsgid>(.*?)</newmsgid>", xml); newmsgid_xml = str(newmsgid_match.group(1)) if newmsgid_match else None
+    if newmsgid_xml and newmsgid_xml not in possible_ids: possible_ids.append(newmsgid_xml)
+    if msgid_xml and msgid_xml not in possible_ids: possible_ids.append(msgid_xml)
+    log_line = f"Possible revoked IDs: {possible_ids}. Cache keys: {cache.keys()}"  # 相当于 logger.info 的格式化开销
+    found = cache.find(possible_ids)
+    nick = re.search(r'<!\[CDATA\["([^"]+)"\s+撤回了一条消息\]\]>', xml, re.IGNORECASE)
+    return found, nick, log_line
+
+
+def new_handle(xml, cache):
+    notice = revoke_parser.parse_revoke(xml)
+    possible_ids = revoke_parser.candidate_ids(notice)
+    log_line = f"Possible revoked IDs: {possible_ids}"
+    return cache.find(possible_ids), notice.nickname, log_line
+
+
+def measure(fn, xmls, cache):
+    samples = []
+    for xml in xmls:
+        start = time.perf_counter(); fn(xml, cache); samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return statistics.mean(samples), samples[len(samples) // 2], samples[int(len(samples) * 0.99) - 1]
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(f"撤回处理延迟 (微秒, 每种规模 {rounds} 次, 一半命中一半未命中):")
+    print(f"{'缓存条数':>8} {'做法':<6}{'平均':>10}{'p50':>10}{'p99':>10}")
+    for size in SIZES:
+        cache = revoke_cache.RevokeCache(max_entries=size * 2, max_bytes=1 << 40)
+        expire_at = time.time() + 3600
+        for i in range(size):
+            cache.put([str(7000000000000000000 + i), str(100000 + i)], object(), expire_at)
+        xmls = [revoke_xml((i * 7919) % (size * 2)) for i in range(rounds)]
+        for name, fn in (("旧", old_handle), ("新", new_handle)):
+            mean, p50, p99 = measure(fn, xmls, cache)
+            print(f"{size:>10} {name:<6}{mean:>10.1f}{p50:>10.1f}{p99:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
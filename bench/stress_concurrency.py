@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# 并发压力测试: 多个线程同时调用 on_receive_message (同时有线程发查询命令, 周期任务照常运行),
+# 结束后检查没有丢失的聊天记录、最后发言时间没有被旧值覆盖、文件头只出现在第一行、撤回缓存能找到每条消息、没有异常
+# 分两种模式各跑一次: queue (默认, 写入经写入队列) 与 direct (关闭写入队列, 在调用线程里直接写, 直接考验存储层的锁)
+# 用法: python bench/stress_concurrency.py [--threads 16] [--groups 8] [--members 48] [--messages 400] [key=value ...]
+# 有检查失败时退出码为 1
+
+import argparse
+import atexit
+import collections
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import stubs
+
+# 小缓冲、少量句柄、短清理间隔: 让刷新、句柄淘汰和快照在压测期间频繁与写入交错
+STRESS_CONFIG = {"receiver": {"name": "wxid_stress_receiver"}, "writer_threads": 4, "log_flush_lines": 7, "log_flush_interval": 0.05,
+                 "log_max_open_files": 3, "cleanup_interval": 0.2, "last_spoken_snapshot_interval": 0, "cache_max_entries": 10 ** 6,
+                 "message_expire_time": 3600, "notify_rate": 1000, "notify_burst": 1000}
+
+
+def run(revocation, mode, args, workdir):
+    os.makedirs(os.path.join(workdir, mode)); os.chdir(os.path.join(workdir, mode))
+    plugin = revocation.RevocationAndLogger()
+    if mode == "direct": plugin.writer_queue.shutdown()
+    channel = stubs.RecordingChannel()
+    groups = [f"{30000000 + g}@chatroom" for g in range(args.groups)]
+    expected_lines = collections.Counter(); expected_spoken = {}; msg_ids = []; errors = []
+    record_lock = threading.Lock(); barrier = threading.Barrier(args.threads + 2); done = threading.Event()
+    base = int(time.time() // 60 * 60) + 60
+
+    def sender(t):
+        # 每个成员只由一个线程发言, 且时间单调递增: 最后发言时间必须等于该线程最后一次发言的时间
+        rnd = random.Random(args.seed * 1000 + t); owned = [m for m in range(args.members) if m % args.threads == t]
+        lines = collections.Counter(); spoken = {}; ids = []
+        try:
+            barrier.wait()
+            for i in range(args.messages):
+                g = rnd.randrange(len(groups)); m = rnd.choice(owned); ts = base + i * 60
+                msg_id = 7000000000000000000 + t * 10 ** 7 + i
+                msg = stubs.ChatMessage(msg_id=msg_id, create_time=ts, ctype=stubs.ContextType.TEXT, content=f"线程{t}的第{i}条消息",
+                                        from_user_id=groups[g], is_group=True, actual_user_id=f"wxid_m{m}", actual_user_nickname=f"成员{m}",
+                                        msg_data={"MsgId": 100000 + t * 10 ** 7 + i})
+                context = stubs.Context(msg.ctype, msg.content, {"msg": msg, "isgroup": True})
+                plugin.on_receive_message(stubs.EventContext(stubs.Event.ON_RECEIVE_MESSAGE, {"context": context}))
+                lines[groups[g]] += 1; spoken[(groups[g], f"成员{m}")] = datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M"); ids.append(str(msg_id))
+        except Exception as e: errors.append(f"发送线程 {t}: {e!r}")
+        with record_lock: expected_lines.update(lines); expected_spoken.update(spoken); msg_ids.extend(ids)
+
+    def querier():
+        rnd = random.Random(args.seed)
+        barrier.wait()
+        while not done.is_set():
+            content = rnd.choice([plugin.command_trigger, f"{plugin.command_trigger} 最新", f"{plugin.search_trigger} 消息"])
+            msg = stubs.ChatMessage(msg_id=0, create_time=time.time(), ctype=stubs.ContextType.TEXT, content=content,
+                                    from_user_id=rnd.choice(groups), is_group=True, actual_user_id="wxid_query", actual_user_nickname="查询者")
+            context = stubs.Context(msg.ctype, msg.content, {"msg": msg, "isgroup": True})
+            try: plugin.on_handle_context(stubs.EventContext(stubs.Event.ON_HANDLE_CONTEXT, {"context": context, "channel": channel}))
+            except Exception as e: errors.append(f"查询线程: {e!r}")
+
+    threads = [threading.Thread(target=sender, args=(t,)) for t in range(args.threads)] + [threading.Thread(target=querier)]
+    for t in threads: t.start()
+    started = time.perf_counter(); barrier.wait()
+    for t in threads[:-1]: t.join()
+    elapsed = time.perf_counter() - started; done.set(); threads[-1].join()
+    plugin.writer_queue.flush(); plugin.storage.snapshot()
+
+    failures = list(errors)
+    for group_id in groups:
+        rows = plugin.storage.query_logs(group_id, limit=10 ** 9)
+        if len(rows) != expected_lines[group_id]: failures.append(f"{group_id}: 聊天记录 {len(rows)} 条, 应为 {expected_lines[group_id]} 条")
+        _, spoken = plugin.storage.query_last_spoken(group_id)
+        for nickname, ts in spoken:
+            if expected_spoken.get((group_id, nickname)) != ts: failures.append(f"{group_id} {nickname}: 最后发言 {ts}, 应为 {expected_spoken.get((group_id, nickname))}")
+        if len(spoken) != sum(1 for gid, _ in expected_spoken if gid == group_id): failures.append(f"{group_id}: 最后发言 {len(spoken)} 人, 与发言人数不符")
+        if plugin.storage.name == "text" and plugin.storage.archive is None and os.path.exists(plugin.storage.log_file_path(group_id)):
+            with open(plugin.storage.log_file_path(group_id), encoding="utf-8") as f: text = f.read()
+            if not text.startswith("# 群聊名称") or text.count("# 群聊名称") != 1: failures.append(f"{group_id}: 文件头不在第一行或出现多次")
+    missing = sum(1 for msg_id in msg_ids if plugin.msg_cache.get(msg_id) is None)
+    if missing: failures.append(f"撤回缓存中缺少 {missing} 条消息")
+    counters = plugin.metrics.snapshot()[1]
+    logged_errors = sum(v for (name, labels), v in counters.items() if name == "errors" or (name == "log_messages" and ("level", "error") in labels))
+    if logged_errors: failures.append(f"插件记录了 {logged_errors} 次错误/异常")
+
+    total = args.threads * args.messages
+    print(f"[{mode:<6}] {args.threads} 线程 x {args.messages} 条 = {total} 条, {elapsed:.2f}s ({total / elapsed:.0f} 条/秒), 查询回复 {len(channel.sent)} 条, "
+          + ("通过" if not failures else f"失败 {len(failures)} 项"))
+    for failure in failures[:20]: print(f"    {failure}")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RevocationAndLogger 并发压力测试")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--groups", type=int, default=8)
+    parser.add_argument("--members", type=int, default=48, help="成员总数, 按线程划分, 需不少于线程数")
+    parser.add_argument("--messages", type=int, default=400, help="每个线程发送的消息数")
+    parser.add_argument("--mode", choices=("queue", "direct", "both"), default="both")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("config", nargs="*", help="插件配置覆盖, 如 storage_engine=sqlite")
+    args = parser.parse_args()
+    if args.members < args.threads: parser.error("--members 不能少于 --threads")
+
+    config = dict(STRESS_CONFIG)
+    for item in args.config:
+        key, _, value = item.partition("=")
+        try: config[key] = json.loads(value)
+        except ValueError: config[key] = value
+    # 插件的 atexit 任务 (关闭存储等) 还会写工作目录, 先注册清理, 后进先出保证最后执行
+    workdir = tempfile.mkdtemp(prefix="revocation_stress_"); atexit.register(shutil.rmtree, workdir, True)
+    revocation = stubs.install(config, log_level=logging.ERROR)
+    sys.setswitchinterval(1e-5)  # 线程切换更频繁, 更容易暴露竞争
+    ok = all([run(revocation, mode, args, workdir) for mode in (("queue", "direct") if args.mode == "both" else (args.mode,))])
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
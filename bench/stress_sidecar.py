@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+# 多进程共用缓存守护进程 (sidecar.py) 的测试: 启动一个本地守护进程和多个插件进程, 所有进程按相同顺序收到同一批群聊消息
+# (模拟同在一个群里的多个账号), 每个进程另有只属于自己的好友消息; 之后每个进程都收到同一批撤回通知
+# 检查: 每条群聊消息在聊天记录中恰好一行、没有交错或残缺的行、文件头只在第一行,
+#      最后发言的成员齐全 (不同进程的写入先后不定, 时间只要求是该成员某条消息的时间)、重复消息都被去重、撤回缓存条数正确、相同内容的媒体文件只保留一份, 每个进程都能找到被撤回的消息 (包括别的进程缓存的) 并发出通知
+# --autostart: 不预先启动守护进程, 由插件进程按配置自动启动 (python -m RevocationAndLogger.sidecar, 经过插件包真实的 __init__), 同时启动的多余守护进程应自行退出
+# 用法: python bench/stress_sidecar.py [--processes 4] [--groups 4] [--messages 300] [--private 20] [--autostart] [key=value ...]
+# 有检查失败时退出码为 1
+
+import argparse
+import collections
+import fcntl
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import stubs
+
+SOCKET = os.path.join("tmp", "sidecar.sock")
+SIDECAR_CONFIG = {"receiver": {"name": "wxid_sidecar_receiver"}, "sidecar_socket": SOCKET, "sidecar_autostart": False, "writer_threads": 2,
+                  "log_flush_lines": 7, "log_flush_interval": 0.05, "log_max_open_files": 3, "cleanup_interval": 0.2, "last_spoken_snapshot_interval": 0,
+                  "cache_max_entries": 10 ** 6, "message_expire_time": 3600, "notify_rate": 1000, "notify_burst": 1000, "notify_digest_threshold": 10 ** 6}
+GLOBAL_CONFIG = {"gewechat_callback_url": "http://127.0.0.1:9919/v2/api/callback/collect"}
+MEDIA_CONTENTS = 3  # 图片消息只有这几种内容, 守护进程应按内容去重
+
+
+def group_messages(args):
+    # 所有进程共用的群聊消息: (msg_id, 群, 成员, 时间, 类型, 内容)
+    rnd = random.Random(args.seed); base = args.base; messages = []
+    for i in range(args.groups * args.messages):
+        group_id = f"{50000000 + i % args.groups}@chatroom"; member = rnd.randrange(args.members)
+        ctype = "IMAGE" if i % args.image_every == 0 else "TEXT"
+        content = f"media_{i % MEDIA_CONTENTS}.jpg" if ctype == "IMAGE" else f"第{i}条群消息"
+        messages.append((str(8000000000000000000 + i), group_id, member, base + i * 60, ctype, content))
+    return messages
+
+
+def send(plugin, msg):
+    context = stubs.Context(msg.ctype, msg.content, {"msg": msg, "isgroup": msg.is_group})
+    plugin.on_receive_message(stubs.EventContext(stubs.Event.ON_RECEIVE_MESSAGE, {"context": context}))
+
+
+def revoke_msg(msg_id, group_id, n):
+    xml = f'<sysmsg type="revokemsg"><revokemsg><session>{group_id}</session><newmsgid>{msg_id}</newmsgid>' \
+          f'<replacemsg><![CDATA["成员" 撤回了一条消息]]></replacemsg></revokemsg></sysmsg>'
+    return stubs.ChatMessage(msg_id=f"revoke_{n}", create_time=time.time(), ctype=stubs.ContextType.REVOKE, content=xml, from_user_id=group_id, is_group=True)
+
+
+def run_daemon(workdir):
+    os.chdir(workdir)
+    daemon = importlib.import_module(f"{stubs.PACKAGE_NAME}.sidecar").SidecarDaemon(SOCKET)
+    signal.signal(signal.SIGTERM, lambda *_: daemon.shutdown())
+    daemon.serve_forever()
+
+
+def run_client(p, args, workdir, revocation, barrier, results):
+    # 每个进程把媒体文件 "下载" 到自己的目录; 结束时通过 results 报告撤回通知和错误
+    os.chdir(workdir); errors = []
+    try:
+        downloads = os.path.join(workdir, f"downloads_{p}"); os.makedirs(downloads)
+        for k in range(MEDIA_CONTENTS):
+            with open(os.path.join(downloads, f"media_{k}.jpg"), 'wb') as f: f.write(bytes([k]) * (4096 + k))
+        plugin = revocation.RevocationAndLogger()
+        if not plugin.sidecar: raise RuntimeError("没有连接到缓存守护进程")
+        messages = group_messages(args)
+        barrier.wait()
+        for msg_id, group_id, member, ts, ctype, content in messages:
+            send(plugin, stubs.ChatMessage(msg_id=msg_id, create_time=ts, ctype=stubs.ContextType[ctype], is_group=True, from_user_id=group_id,
+                                           content=os.path.join(downloads, content) if ctype == "IMAGE" else content,
+                                           actual_user_id=f"wxid_m{member}", actual_user_nickname=f"成员{member}", msg_data={"MsgId": int(msg_id) % 10 ** 6}))
+        for i in range(args.private):
+            send(plugin, stubs.ChatMessage(msg_id=f"{p}{i:06d}", create_time=time.time(), ctype=stubs.ContextType.TEXT, content=f"进程{p}的好友消息{i}",
+                                           from_user_id=f"wxid_friend{p}", is_group=False))
+        plugin.writer_queue.flush()
+        deadline = time.time() + 30
+        while plugin.msg_cache.stats()["pending"] and time.time() < deadline: time.sleep(0.01)  # 等待媒体文件缓存完成
+        barrier.wait()  # 所有进程都缓存完成后再撤回, 被撤回的消息大多由别的进程缓存
+
+        revoked = group_messages(args)[::args.revoke_every]
+        for n, (msg_id, group_id, *_) in enumerate(revoked): send(plugin, revoke_msg(msg_id, group_id, n))
+        client = stubs.FakeGeWeChatChannel.client; deadline = time.time() + 30
+        while plugin.notifier.stats()["depth"] and time.time() < deadline: time.sleep(0.01)
+        plugin.notifier.shutdown(); plugin.scheduler.shutdown(); plugin.sidecar.call("stats")  # 同一连接按顺序处理, 之前发送的写入都已完成
+        texts = [call[2] for call in client.calls if call[0] == "post_text"]
+        counters = plugin.metrics.snapshot()[1]
+        logged_errors = sum(v for (name, labels), v in counters.items() if name == "errors" or (name == "log_messages" and ("level", "error") in labels))
+        results.put({"process": p, "errors": errors, "logged_errors": logged_errors, "revoked": len(revoked),
+                     "notified_text": sum(1 for text in texts if "撤回了一条消息" in text), "notified_image": sum(1 for text in texts if "撤回了一个图片" in text),
+                     "images_sent": sum(1 for call in client.calls if call[0] == "post_image"),
+                     "duplicates": sum(v for (name, _), v in counters.items() if name == "sidecar_duplicates")})
+    except Exception as e:
+        results.put({"process": p, "errors": [f"进程 {p}: {e!r}"]}); barrier.abort()
+
+
+def stop_daemon(pid, socket_path, timeout=10):
+    # 自动启动的守护进程不是本进程的子进程: 发送 SIGTERM 后等它释放锁文件 (存储已关闭)
+    os.kill(pid, signal.SIGTERM); deadline = time.time() + timeout
+    with open(f"{socket_path}.lock", 'a') as f:
+        while True:
+            try: fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB); return
+            except BlockingIOError:
+                if time.time() > deadline: raise RuntimeError(f"守护进程 (PID {pid}) 没有在 {timeout}s 内退出")
+                time.sleep(0.05)
+
+
+def check(args, workdir, results, daemon_stats):
+    failures = []; messages = group_messages(args); log_dir = os.path.join(workdir, "chat_logs")
+    for result in results: failures += result["errors"]
+    expected = collections.defaultdict(collections.Counter); spoken = {}
+    for msg_id, group_id, member, ts, ctype, content in messages:
+        expected[group_id]["[图片]" if ctype == "IMAGE" else content] += 1
+        spoken.setdefault((group_id, f"成员{member}"), set()).add(datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M"))
+    for group_id, counts in expected.items():
+        with open(os.path.join(log_dir, f"{group_id}.txt"), encoding="utf-8") as f: lines = f.read().splitlines()
+        header = [line for line in lines if line.startswith("#")]
+        if not lines[0].startswith("# 群聊名称") or len(header) != 3: failures.append(f"{group_id}: 文件头不在开头或出现多次")
+        body = lines[lines.index("---") + 1:] if "---" in lines else lines
+        broken = [line for line in body if not line[:16].replace("-", "").replace(":", "").replace(" ", "").isdigit() or line[16:18] != " 【" or "】" not in line]
+        if broken: failures.append(f"{group_id}: {len(broken)} 行格式错误 (交错或残缺), 如 {broken[0]!r}")
+        got = collections.Counter(line[line.index("】") + 1:] for line in body if "】" in line)
+        if got != counts:
+            extra = sum((got - counts).values()); missing = sum((counts - got).values())
+            failures.append(f"{group_id}: 聊天记录 {sum(got.values())} 行, 应为 {sum(counts.values())} 行 (多 {extra} 行, 少 {missing} 行)")
+        spoken_file = os.path.join(log_dir, "last_spoken", f"{group_id}-最后发言.txt")
+        with open(spoken_file, encoding="utf-8") as f: got_spoken = {line[1:line.rindex("】")]: line[line.rindex("】") + 1:].rstrip("\n") for line in f if line.startswith("【")}
+        want_spoken = {member: times for (gid, member), times in spoken.items() if gid == group_id}
+        if set(got_spoken) != set(want_spoken): failures.append(f"{group_id}: 最后发言 {len(got_spoken)} 人, 应为 {len(want_spoken)} 人")
+        wrong = [member for member, ts in got_spoken.items() if ts not in want_spoken.get(member, ())]
+        if wrong: failures.append(f"{group_id}: {len(wrong)} 人的最后发言时间不是其发过的消息的时间")
+
+    claims = daemon_stats["claims"]; shared = len(messages); private = args.processes * args.private
+    if claims["duplicates"] != (args.processes - 1) * shared: failures.append(f"守护进程去重 {claims['duplicates']} 条, 应为 {(args.processes - 1) * shared} 条")
+    if sum(r.get("duplicates", 0) for r in results) != claims["duplicates"]: failures.append("各进程跳过的重复消息数与守护进程的去重数不一致")
+    if daemon_stats["cache"]["entries"] != shared + private: failures.append(f"撤回缓存 {daemon_stats['cache']['entries']} 条, 应为 {shared + private} 条")
+    store = daemon_stats["store"]
+    if store["blobs"] != MEDIA_CONTENTS: failures.append(f"tmp 中有 {store['blobs']} 个媒体文件, 应为 {MEDIA_CONTENTS} 个")
+    if daemon_stats["errors"]: failures.append(f"守护进程处理请求出错 {daemon_stats['errors']} 次")
+    revoked = messages[::args.revoke_every]; images = sum(1 for m in revoked if m[4] == "IMAGE")
+    for result in results:
+        if "revoked" not in result: continue
+        if result["notified_text"] != len(revoked) - images or result["notified_image"] != images or result["images_sent"] != images:
+            failures.append(f"进程 {result['process']}: 撤回 {len(revoked)} 条, 文字通知 {result['notified_text']} 条, 图片通知 {result['notified_image']} 条, "
+                            f"发送图片 {result['images_sent']} 张 (应为 {len(revoked) - images}/{images}/{images})")
+        if result["logged_errors"]: failures.append(f"进程 {result['process']}: 插件记录了 {result['logged_errors']} 次错误/异常")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RevocationAndLogger 多进程共用缓存守护进程测试")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--groups", type=int, default=4)
+    parser.add_argument("--members", type=int, default=40)
+    parser.add_argument("--messages", type=int, default=300, help="每个群的消息数 (所有进程都会收到)")
+    parser.add_argument("--private", type=int, default=20, help="每个进程独有的好友消息数")
+    parser.add_argument("--image-every", type=int, default=10, help="每隔多少条群消息有一条图片")
+    parser.add_argument("--revoke-every", type=int, default=25, help="每隔多少条群消息撤回一条")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--autostart", action="store_true", help="由插件进程自动启动守护进程")
+    parser.add_argument("config", nargs="*", help="插件配置覆盖, 如 storage_engine=sqlite (检查按文本存储的文件进行)")
+    args = parser.parse_args()
+    args.base = int(time.time() // 60 * 60) + 60  # 各进程和检查用同一个起始时间, 不受跨分钟的影响
+
+    config = dict(SIDECAR_CONFIG)
+    for item in args.config:
+        key, _, value = item.partition("=")
+        try: config[key] = json.loads(value)
+        except ValueError: config[key] = value
+    workdir = tempfile.mkdtemp(prefix="revocation_sidecar_"); package_root = None
+    if args.autostart:
+        # 自动启动的守护进程继承 PYTHONPATH, 通过 sitecustomize 加载桩模块后按真实的包路径导入
+        config.update(sidecar_autostart=True, sidecar_timeout=max(config.get("sidecar_timeout", 5), 15))
+        package_root = stubs.make_package_root(os.path.join(workdir, "packages"))
+        os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [package_root, os.environ.get("PYTHONPATH")]))
+    revocation = stubs.install(config, global_config=GLOBAL_CONFIG, log_level=logging.ERROR, package_root=package_root)
+    sidecar = importlib.import_module(f"{stubs.PACKAGE_NAME}.sidecar")
+    ctx = multiprocessing.get_context("fork"); results = ctx.Queue(); barrier = ctx.Barrier(args.processes + 1)
+    daemon = ctx.Process(target=run_daemon, args=(workdir,)); daemon_pid = None
+    try:
+        if not args.autostart:
+            daemon.start(); deadline = time.time() + 10
+            while not os.path.exists(os.path.join(workdir, SOCKET)) and time.time() < deadline: time.sleep(0.01)
+        clients = [ctx.Process(target=run_client, args=(p, args, workdir, revocation, barrier, results)) for p in range(args.processes)]
+        for c in clients: c.start()
+        barrier.wait(timeout=60); started = time.perf_counter()
+        barrier.wait(timeout=120); elapsed = time.perf_counter() - started
+        collected = [results.get(timeout=120) for _ in clients]
+        for c in clients: c.join()
+        monitor = sidecar.SidecarClient(os.path.join(workdir, SOCKET), config, {"log_dir": os.path.join(workdir, "chat_logs"), "tmp_dir": os.path.join(workdir, "tmp")})
+        daemon_stats = monitor.call("stats"); daemon_pid = monitor.server_info["pid"]; monitor.close()
+        if args.autostart: stop_daemon(daemon_pid, os.path.join(workdir, SOCKET))
+        else: daemon.terminate(); daemon.join(10)  # SIGTERM: 守护进程刷新并关闭存储后退出
+        failures = check(args, workdir, collected, daemon_stats)
+    finally:
+        if daemon.is_alive(): daemon.kill()
+        if args.autostart and daemon_pid:
+            try: os.kill(daemon_pid, signal.SIGKILL)
+            except ProcessLookupError: pass
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    total = args.processes * (args.groups * args.messages + args.private)
+    print(f"{args.processes} 个进程 x {args.groups * args.messages} 条群消息 (+ 各 {args.private} 条好友消息) = {total} 条, {elapsed:.2f}s ({total / elapsed:.0f} 条/秒), "
+          f"去重 {daemon_stats['claims']['duplicates']} 条, 守护进程请求 {daemon_stats['requests']} 个, 媒体去重 {daemon_stats['store']['dedup_hits']} 次, "
+          + ("通过" if not failures else f"失败 {len(failures)} 项"))
+    for failure in failures[:20]: print(f"    {failure}")
+    sys.exit(0 if not failures else 1)
+
+
+if __name__ == "__main__":
+    main()
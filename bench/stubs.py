@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# 在没有 dify-on-wechat 的环境里加载插件: 为 bridge / channel / plugins / common / config 提供最小实现,
+# 并提供一个记录调用、可配置延迟和失败率的假 gewechat client
+# 用法: stubs.install(config) 返回 revocation 模块, 需在导入插件前调用; 子进程需要按真实包路径导入插件时用 make_package_root
+
+import enum
+import importlib
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import types
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_NAME = "RevocationAndLogger"
+
+
+class ContextType(enum.Enum):
+    TEXT = 1
+    VOICE = 2
+    IMAGE = 3
+    FILE = 4
+    VIDEO = 5
+    SHARING = 6
+    IMAGE_CREATE = 10
+    ACCEPT_FRIEND = 19
+    JOIN_GROUP = 20
+    PATPAT = 21
+    FUNCTION = 22
+    EXIT_GROUP = 23
+    CARD = 24
+    REVOKE = 25
+    SYSTEM = 26
+
+
+class Context:
+    def __init__(self, type=None, content=None, kwargs=None):
+        self.type = type; self.content = content; self.kwargs = kwargs or {}
+
+    def get(self, key, default=None): return self.kwargs.get(key, default)
+
+    def __getitem__(self, key): return self.kwargs[key]
+
+    def __setitem__(self, key, value): self.kwargs[key] = value
+
+
+class ReplyType(enum.Enum):
+    TEXT = 1
+    ERROR = 3
+    INFO = 9
+
+
+class Reply:
+    def __init__(self, type=None, content=None): self.type = type; self.content = content
+
+
+class ChatMessage:
+    def __init__(self, **kwargs):
+        self.msg_id = None; self.create_time = None; self.ctype = None; self.content = None
+        self.from_user_id = None; self.from_user_nickname = None; self.to_user_id = None; self.to_user_nickname = None
+        self.other_user_id = None; self.other_user_nickname = None; self.is_group = False; self.is_at = False
+        self.actual_user_id = None; self.actual_user_nickname = None; self.msg_data = {}
+        self.__dict__.update(kwargs)
+
+
+class Event(enum.Enum):
+    ON_RECEIVE_MESSAGE = 1
+    ON_HANDLE_CONTEXT = 2
+    ON_DECORATE_REPLY = 3
+    ON_SEND_REPLY = 4
+
+
+class EventAction(enum.Enum):
+    CONTINUE = 1
+    BREAK = 2
+    BREAK_PASS = 3
+
+
+class EventContext:
+    def __init__(self, event, econtext=None):
+        self.event = event; self.econtext = econtext or {}; self.action = EventAction.CONTINUE
+
+    def __getitem__(self, key): return self.econtext[key]
+
+    def __setitem__(self, key, value): self.econtext[key] = value
+
+    def get(self, key, default=None): return self.econtext.get(key, default)
+
+
+class Plugin:
+    config = {}
+
+    def __init__(self):
+        self.handlers = {}
+
+    def load_config(self):
+        return dict(Plugin.config)
+
+    def get_help_text(self, **kwargs): return ""
+
+
+def register(**kwargs):
+    def wrapper(cls):
+        cls.name = kwargs.get("name"); cls.version = kwargs.get("version"); cls.path = PLUGIN_DIR
+        return cls
+    return wrapper
+
+
+class FakeGewechatClient:
+    # 记录所有调用; latency 为每次调用的耗时 (秒), failure_rate 为返回 ret=500 的概率
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency; self.failure_rate = failure_rate
+        self.calls = []; self.counts = {}
+        self._random = random.Random(seed); self._lock = threading.Lock()
+
+    def _call(self, name, *args, data=None):
+        if self.latency: time.sleep(self.latency)
+        with self._lock:
+            self.calls.append((name,) + args); self.counts[name] = self.counts.get(name, 0) + 1
+            failed = self._random.random() < self.failure_rate
+        return {"ret": 500, "msg": "fake failure"} if failed else {"ret": 200, "msg": "ok", "data": data}
+
+    def post_text(self, app_id, to_wxid, content, ats=""): return self._call("post_text", to_wxid, content)
+
+    def post_image(self, app_id, to_wxid, img_url): return self._call("post_image", to_wxid, img_url)
+
+    def post_file(self, app_id, to_wxid, file_url, file_name): return self._call("post_file", to_wxid, file_url, file_name)
+
+    def get_chatroom_info(self, app_id, chatroom_id):
+        return self._call("get_chatroom_info", chatroom_id, data={"nickName": f"测试群{chatroom_id.split('@')[0][-4:]}"})
+
+    def get_brief_info(self, app_id, wxids):
+        return self._call("get_brief_info", tuple(wxids), data=[{"userName": w, "nickName": f"昵称{w[-4:]}"} for w in wxids])
+
+
+class FakeGeWeChatChannel:
+    client = None
+
+    def __init__(self):
+        if FakeGeWeChatChannel.client is None: FakeGeWeChatChannel.client = FakeGewechatClient()
+        self.app_id = "wx_fake_app"
+
+
+class RecordingChannel:
+    # on_handle_context 的回复通过 channel.send 发出, 这里只记录
+    def __init__(self):
+        self.sent = []
+
+    def send(self, reply, context): self.sent.append(reply.content)
+
+
+def install_modules(config=None, client=None, global_config=None, log_level=logging.WARNING):
+    # 只注册桩模块, 不导入插件; config 为插件配置, global_config 为 config.conf() 的内容
+    Plugin.config = dict(config or {})
+    FakeGeWeChatChannel.client = client or FakeGewechatClient()
+    modules = {name: types.ModuleType(name) for name in (
+        "bridge", "bridge.context", "bridge.reply", "channel", "channel.chat_message", "channel.gewechat",
+        "channel.gewechat.gewechat_channel", "plugins", "common", "common.log", "config")}
+    modules["bridge.context"].ContextType = ContextType; modules["bridge.context"].Context = Context
+    modules["bridge.reply"].Reply = Reply; modules["bridge.reply"].ReplyType = ReplyType
+    modules["channel.chat_message"].ChatMessage = ChatMessage
+    modules["channel.gewechat.gewechat_channel"].GeWeChatChannel = FakeGeWeChatChannel
+    plugins = modules["plugins"]
+    for name in ("Plugin", "Event", "EventAction", "EventContext"): setattr(plugins, name, globals()[name])
+    plugins.register = register; plugins.__all__ = ["Plugin", "Event", "EventAction", "EventContext"]
+    logging.basicConfig(level=log_level, format="%(asctime)s %(levelname)s %(message)s")
+    modules["common.log"].logger = logging.getLogger("dify-on-wechat")
+    modules["config"].conf = lambda: dict(global_config or {})
+    sys.modules.update(modules)
+
+
+def install(config=None, client=None, global_config=None, log_level=logging.WARNING, package_root=None):
+    # 注册桩模块并导入插件, 返回 revocation 模块
+    # package_root 为 make_package_root 建好的目录时按正常方式导入插件包 (会执行包的 __init__), 否则只建一个空包指向插件目录
+    install_modules(config, client, global_config, log_level)
+    if package_root: sys.path.insert(0, package_root)
+    else:
+        package = types.ModuleType(PACKAGE_NAME); package.__path__ = [PLUGIN_DIR]
+        sys.modules[PACKAGE_NAME] = package
+    return importlib.import_module(f"{PACKAGE_NAME}.revocation")
+
+
+def make_package_root(path):
+    # 建一个可以用 python -m RevocationAndLogger.<模块> 启动插件模块的目录: 指向插件目录的链接, 以及启动时注册桩模块的 sitecustomize
+    # 加入 PYTHONPATH 后子进程 (如自动启动的守护进程) 也能按插件包的真实路径导入
+    os.makedirs(path, exist_ok=True)
+    os.symlink(PLUGIN_DIR, os.path.join(path, PACKAGE_NAME))
+    with open(os.path.join(path, "sitecustomize.py"), 'w', encoding="utf-8") as f:
+        f.write(f"import sys\nsys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r})\nimport stubs\nstubs.install_modules()\n")
+    return path
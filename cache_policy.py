@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+from common.log import logger
+
+CACHED_TYPES = ("TEXT", "IMAGE", "VIDEO", "FILE", "VOICE", "SHARING", "CARD", "PATPAT")
+MEDIA_TYPES = ("IMAGE", "VIDEO", "FILE", "VOICE")
+DEFAULT = "default"
+
+
+class CachePolicy:
+    # 防撤回缓存策略, 加载时编译成两级字典: 会话ID -> {消息类型: (策略名, 缓存秒数, 大小上限字节)}
+    # 未单独配置的会话使用默认表, 每条消息只需两次字典查找; 缓存秒数为 0 表示不缓存, 大小上限为 0 表示不限
+    # 配置 (config.json 的 cache_policy):
+    #   allow           只缓存这些群聊/好友, 为空时不限制; 不为空时 rules 中不在 allow 里的会话同样不缓存
+    #   deny            不缓存这些群聊/好友, 优先于 allow 和 rules
+    #   ttl / max_mb    按消息类型的缓存秒数与大小上限 (MB), "*" 表示所有类型; 未列出的类型使用 message_expire_time, 不限大小
+    #   rules           [{"name", "chats", "ttl", "max_mb"}], 在上面的基础上覆盖列出的会话; 一个会话出现在多条规则中时取第一条
+    def __init__(self, config, default_ttl):
+        config = config or {}
+        base = self._compile(DEFAULT, config, {ctype: (max(0.0, float(default_ttl)), 0) for ctype in CACHED_TYPES})
+        self._chats = {}
+        self.rules = []
+        allow = set(config.get("allow") or [])
+        for i, rule in enumerate(config.get("rules") or []):
+            name = str(rule.get("name") or f"rule{i + 1}"); table = self._compile(name, rule, {ctype: entry[1:] for ctype, entry in base.items()})
+            self.rules.append(name)
+            for chat_id in rule.get("chats") or []:
+                if not allow or chat_id in allow: self._chats.setdefault(chat_id, table)
+        if allow:
+            for chat_id in allow: self._chats.setdefault(chat_id, base)
+            base = self._closed("not_allowed")
+        deny = self._closed("deny")
+        for chat_id in config.get("deny") or []: self._chats[chat_id] = deny
+        self._default = base
+        self.max_ttl = max([entry[1] for table in [base, *self._chats.values()] for entry in table.values()] + [0.0])
+
+    @staticmethod
+    def _compile(name, section, inherited):
+        ttl = section.get("ttl") or {}; max_mb = section.get("max_mb") or {}
+        for key in set(ttl) | set(max_mb):
+            if key != "*" and key not in CACHED_TYPES: logger.warning(f"[RevocationAndLogger] 缓存策略 '{name}' 中的消息类型 '{key}' 不会被缓存, 已忽略")
+        table = {}
+        for ctype in CACHED_TYPES:
+            seconds, max_bytes = inherited[ctype]
+            if ctype in ttl or "*" in ttl: seconds = max(0.0, float(ttl.get(ctype, ttl.get("*"))))
+            if ctype in max_mb or "*" in max_mb: max_bytes = max(0, int(float(max_mb.get(ctype, max_mb.get("*"))) * 1024 * 1024))
+            table[ctype] = (name, seconds, max_bytes)
+        return table
+
+    @staticmethod
+    def _closed(name):
+        return {ctype: (name, 0.0, 0) for ctype in CACHED_TYPES}
+
+    def decide(self, chat_id, ctype_name):
+        # 返回 (策略名, 缓存秒数, 大小上限字节); 不在缓存范围内的消息类型返回 None
+        return self._chats.get(chat_id, self._default).get(ctype_name)
+
+    def describe(self):
+        return f"{len(self.rules)} 条规则, {len(self._chats)} 个会话单独配置, 默认{'不缓存' if self._default[CACHED_TYPES[0]][0] == 'not_allowed' else '缓存'}, 最长缓存 {self.max_ttl:.0f}s"
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import os
+import threading
+
+from common.log import logger
+
+from .striped_lock import StripedLock
+
+
+class LastSpokenIndex:
+    # 每个群聊在内存中维护 成员昵称 -> 最后发言时间, 首次访问时从 "-最后发言.txt" 加载,
+    # 之后只在 snapshot() 时把有变动的群聊整体写回 (写临时文件再 rename)
+    # 另外按时间维护一份有序列表, 供分页/筛选查询使用 (时间格式 YYYY-MM-DD HH:MM 可直接按字符串排序)
+    # 每个群聊的数据只在该群聊的分段锁内读写 (包括首次加载时读文件), 全局锁只保护待写回的群聊集合
+    def __init__(self, path_fn, stripes=64):
+        self._path_fn = path_fn
+        self._groups = {}  # group_id -> {nickname: timestamp_str}, 保持文件中的行顺序
+        self._ordered = {}  # group_id -> [(timestamp_str, nickname)], 按时间升序
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._group_locks = StripedLock(stripes)
+        self._snapshot_lock = threading.Lock()
+
+    def _load(self, group_id):
+        # 调用方持有 group_id 的分段锁
+        members = self._groups.get(group_id)
+        if members is not None: return members
+        members = {}; file_path = self._path_fn(group_id)
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.rstrip('\n')
+                    end = line.rfind('】')
+                    if not line.startswith('【') or end < 0: continue
+                    members[line[1:end]] = line[end + 1:]
+        except FileNotFoundError: pass
+        except (IOError, OSError) as e: logger.error(f"[RevocationAndLogger] 读取最后发言文件失败 (File: {file_path}): {e}")
+        self._groups[group_id] = members
+        self._ordered[group_id] = sorted((ts, nickname) for nickname, ts in members.items())
+        return members
+
+    def update(self, group_id, nickname, timestamp_str):
+        with self._group_locks(group_id):
+            members = self._load(group_id)
+            old_ts = members.get(nickname)
+            if old_ts == timestamp_str: return
+            ordered = self._ordered[group_id]
+            if old_ts is not None:
+                i = bisect.bisect_left(ordered, (old_ts, nickname))
+                if i < len(ordered) and ordered[i] == (old_ts, nickname): del ordered[i]
+            bisect.insort(ordered, (timestamp_str, nickname))
+            members[nickname] = timestamp_str
+        with self._lock: self._dirty.add(group_id)
+
+    def query(self, group_id, before=None, offset=0, limit=None, newest_first=False):
+        # 返回 (符合条件的总人数, [(nickname, timestamp_str)]); before 为时间上限 (不含), 只查这之前最后发言的成员
+        with self._group_locks(group_id):
+            self._load(group_id); ordered = self._ordered[group_id]
+            end = bisect.bisect_left(ordered, (before,)) if before else len(ordered)
+            stop = end if limit is None else min(end, offset + limit)
+            if newest_first: rows = [ordered[end - 1 - i] for i in range(offset, stop)]
+            else: rows = ordered[offset:stop]
+            return end, [(nickname, ts) for ts, nickname in rows]
+
+    def render(self, group_id):
+        # 与文件格式一致; 群聊既无记录文件也无内存记录时返回 None
+        with self._group_locks(group_id):
+            members = self._load(group_id)
+            if not members and not os.path.exists(self._path_fn(group_id)): return None
+            return ''.join(f"【{nickname}】{ts}\n" for nickname, ts in members.items())
+
+    def snapshot(self):
+        with self._snapshot_lock:
+            with self._lock: dirty = self._dirty; self._dirty = set()
+            pending = []
+            for gid in dirty:
+                with self._group_locks(gid): pending.append((gid, ''.join(f"【{n}】{t}\n" for n, t in self._groups[gid].items())))
+            written = 0
+            for group_id, content in pending:
+                file_path = self._path_fn(group_id); tmp_path = f"{file_path}.tmp"
+                try:
+                    with open(tmp_path, 'w', encoding='utf-8') as f: f.write(content)
+                    os.replace(tmp_path, file_path); written += 1
+                except (IOError, OSError) as e:
+                    logger.error(f"[RevocationAndLogger] 写入最后发言快照失败 (File: {file_path}): {e}")
+                    with self._lock: self._dirty.add(group_id)
+            return written
+
+    def stats(self):
+        groups = list(self._groups.values())
+        with self._lock: dirty = len(self._dirty)
+        return {"groups": len(groups), "members": sum(len(m) for m in groups), "dirty_groups": dirty}
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import io
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+
+try:
+    from common.log import logger
+except ImportError:  # 随 search_index.py / backfill.py 作为脚本单独运行时
+    import logging
+    logger = logging.getLogger("RevocationAndLogger.log_archive")
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MANIFEST_FILE = "manifest.json"
+RECORD_MARK = " 【".encode('utf-8')
+
+
+class LogArchive:
+    # 按时间分区的聊天记录: chat_logs/<群聊ID>/<YYYY-MM-DD>.txt (按月时为 <YYYY-MM>.txt)
+    # 已结束的分区由后台任务压缩为 .txt.gz / .txt.zst, 并按保留天数和总大小删除最旧的分区
+    # 每个群目录下的 manifest.json 记录各分区的文件名和时间范围, 读取时不需要列目录
+    KEY_LENGTH = {"day": 10, "month": 7}
+    SUFFIX = {"gzip": ".gz", "zstd": ".zst", "none": ""}
+
+    def __init__(self, log_dir, sanitize_fn, log_writer, rotation="day", compression="gzip",
+                 retention_days=0, retention_mb=0, interval=600, grace=300):
+        self.log_dir = log_dir
+        self._sanitize = sanitize_fn
+        self.log_writer = log_writer
+        self.rotation = rotation
+        self.key_length = self.KEY_LENGTH[rotation]
+        if compression not in self.SUFFIX:
+            logger.warning(f"[RevocationAndLogger] 未知的聊天记录压缩方式 '{compression}', 使用 gzip"); compression = "gzip"
+        if compression == "zstd" and zstandard is None:
+            logger.warning("[RevocationAndLogger] 未安装 zstandard, 聊天记录改用 gzip 压缩"); compression = "gzip"
+        self.compression = compression
+        self.retention_days = retention_days
+        self.retention_bytes = int(float(retention_mb) * 1024 * 1024)
+        self.interval = interval
+        self.grace = grace  # 分区结束后再等待一段时间才压缩, 给延迟到达的消息留出余量
+        self._manifests = {}  # 群目录名 -> {"group_id": ..., "rotation": ..., "partitions": {key: {...}}}
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._job = None
+        self._last_run = 0
+        self._stats = dict.fromkeys(("runs", "sealed", "deleted", "raw_bytes", "compressed_bytes", "errors"), 0)
+
+    def group_dir(self, group_id):
+        return os.path.join(self.log_dir, self._sanitize(group_id))
+
+    def partition_key(self, timestamp_str):
+        return timestamp_str[:self.key_length]
+
+    def bounds(self, key):
+        if self.rotation == "day":
+            start = datetime.strptime(key, "%Y-%m-%d"); end = start + timedelta(days=1)
+        else:
+            start = datetime.strptime(key, "%Y-%m"); end = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return start.strftime("%Y-%m-%d %H:%M"), (end - timedelta(minutes=1)).strftime("%Y-%m-%d %H:%M")
+
+    def register(self, group_id, timestamp_str):
+        # 返回 (写入路径, 是否需要写文件头); 只有第一次出现的分区才写文件头, 延迟到达的旧消息直接追加
+        self._ensure_loaded()
+        key = self.partition_key(timestamp_str); dirname = self._sanitize(group_id)
+        path = os.path.join(self.log_dir, dirname, f"{key}.txt")
+        with self._lock:
+            manifest = self._manifests.get(dirname)
+            if manifest is not None and key in manifest["partitions"]: return path, False
+            if manifest is None: manifest = self._manifests[dirname] = {"group_id": group_id, "rotation": self.rotation, "partitions": {}}
+            start, end = self.bounds(key); is_new = not os.path.exists(path)
+            manifest["partitions"][key] = {"file": f"{key}.txt", "start": start, "end": end, "first": timestamp_str, "last": None,
+                                           "lines": 0, "bytes": 0, "compression": None}
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._save_manifest(dirname)
+        return path, is_new
+
+    def partition_files(self, group_id, since=None, until=None):
+        # 按 manifest 找出与 [since, until] 有交集的分区文件, 按时间顺序返回 (压缩文件在前, 之后追加的未压缩文件在后)
+        self._ensure_loaded()
+        dirname = self._sanitize(group_id); files = []
+        with self._lock:
+            manifest = self._manifests.get(dirname)
+            if manifest is None: return files
+            for key in sorted(manifest["partitions"]):
+                if (since and key < since[:self.key_length]) or (until and key > until[:self.key_length]): continue
+                entry = manifest["partitions"][key]
+                if entry["compression"]: files.append(os.path.join(self.log_dir, dirname, entry["file"]))
+                files.append(os.path.join(self.log_dir, dirname, f"{key}.txt"))
+        return [path for path in files if os.path.exists(path)]
+
+    @staticmethod
+    def open_text(path):
+        if path.endswith(".gz"): return gzip.open(path, 'rt', encoding='utf-8')
+        if path.endswith(".zst"):
+            if zstandard is None: raise OSError(f"未安装 zstandard, 无法读取 {path}")
+            reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True)
+            return io.TextIOWrapper(reader, encoding='utf-8')
+        return open(path, 'r', encoding='utf-8')
+
+    def maybe_run(self):
+        # 由调度线程的 log_archive 任务调用, 压缩和清理放在单独的后台线程里执行, 同一时间只运行一个
+        if time.time() - self._last_run < self.interval or (self._job is not None and self._job.is_alive()): return False
+        self._last_run = time.time()
+        self._job = threading.Thread(target=self.run, name="RevocationAndLogger-archive", daemon=True)
+        self._job.start()
+        return True
+
+    def run(self, now=None):
+        now = time.time() if now is None else now
+        self._ensure_loaded(); self.log_writer.flush()
+        seal_before = datetime.fromtimestamp(now - self.grace).strftime("%Y-%m-%d %H:%M")[:self.key_length]
+        with self._lock:
+            todo = [(dirname, key) for dirname, manifest in self._manifests.items() for key, entry in manifest["partitions"].items()
+                    if key < seal_before and self.compression != "none" and self._has_plain(dirname, key)]
+        for dirname, key in todo:
+            try: self._seal(dirname, key)
+            except Exception as e:
+                with self._lock: self._stats["errors"] += 1
+                logger.error(f"[RevocationAndLogger] 压缩聊天记录分区失败: {dirname}/{key}, Error: {e}")
+        try: self._apply_retention(now)
+        except Exception as e: logger.error(f"[RevocationAndLogger] 清理过期聊天记录分区失败: {e}")
+        with self._lock: self._stats["runs"] += 1
+        if todo: logger.info(f"[RevocationAndLogger] 聊天记录归档完成: 压缩 {len(todo)} 个分区, 状态: {self.stats()}")
+
+    def _seal(self, dirname, key):
+        path = os.path.join(self.log_dir, dirname, f"{key}.txt")
+        sealing = f"{path}.sealing"
+        # 上次中断遗留的 .sealing 先处理, 否则把当前文件改名后再压缩, 改名期间的新写入会落到新文件
+        if not os.path.exists(sealing) and not self.log_writer.detach(path, sealing): return
+        filename = f"{key}.txt{self.SUFFIX[self.compression]}"
+        target = os.path.join(self.log_dir, dirname, filename); part = f"{target}.part"
+        raw_bytes = os.path.getsize(sealing); prev_bytes = os.path.getsize(target) if os.path.exists(target) else 0
+        with open(sealing, 'rb') as src, self._open_compressed(part) as dst: lines, first, last = self._count_records(src, dst)
+        if os.path.exists(target):
+            # gzip / zstd 都支持多段拼接, 延迟写入的内容作为新的一段追加到已有的压缩文件后面
+            with open(part, 'rb') as src, open(target, 'ab') as dst: shutil.copyfileobj(src, dst)
+            os.remove(part)
+        else: os.replace(part, target)
+        os.remove(sealing)
+        self._update_entry(dirname, key, filename, lines, first, last)
+        with self._lock: self._stats["sealed"] += 1; self._stats["raw_bytes"] += raw_bytes; self._stats["compressed_bytes"] += os.path.getsize(target) - prev_bytes
+
+    def _has_plain(self, dirname, key):
+        path = os.path.join(self.log_dir, dirname, f"{key}.txt")
+        return os.path.exists(path) or os.path.exists(f"{path}.sealing")
+
+    def _open_compressed(self, path):
+        if self.compression == "zstd": return zstandard.ZstdCompressor(level=3).stream_writer(open(path, 'wb'))
+        return gzip.open(path, 'wb', compresslevel=6)
+
+    @staticmethod
+    def _count_records(src, dst):
+        lines = 0; first = last = None
+        for line in src:
+            if dst is not None: dst.write(line)
+            if line[16:20] != RECORD_MARK: continue
+            ts = line[:16].decode('ascii', 'replace'); lines += 1
+            if first is None or ts < first: first = ts
+            if last is None or ts > last: last = ts
+        return lines, first, last
+
+    def _update_entry(self, dirname, key, filename, lines, first, last):
+        # 延迟写入再次压缩时累加行数并扩展首末时间
+        path = os.path.join(self.log_dir, dirname, filename)
+        with self._lock:
+            entry = self._manifests[dirname]["partitions"][key]
+            if entry["compression"] is None: entry["lines"] = 0; entry["first"] = entry["last"] = None
+            entry["lines"] += lines
+            entry["first"] = min(filter(None, (entry["first"], first)), default=None); entry["last"] = max(filter(None, (entry["last"], last)), default=None)
+            entry["file"] = filename; entry["compression"] = self.compression; entry["bytes"] = os.path.getsize(path)
+            self._save_manifest(dirname)
+
+    def _apply_retention(self, now):
+        if not self.retention_days and not self.retention_bytes: return
+        current = datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M")[:self.key_length]
+        expire_before = datetime.fromtimestamp(now - self.retention_days * 86400).strftime("%Y-%m-%d %H:%M") if self.retention_days else None
+        with self._lock:
+            partitions = sorted((entry["end"], dirname, key) for dirname, manifest in self._manifests.items() for key, entry in manifest["partitions"].items())
+        sizes = {(dirname, key): self._partition_bytes(dirname, key) for _, dirname, key in partitions}
+        total = sum(sizes.values())
+        for end, dirname, key in partitions:
+            if key >= current: continue  # 正在写入的分区不删除
+            if (expire_before and end < expire_before) or (self.retention_bytes and total > self.retention_bytes):
+                self._delete(dirname, key); total -= sizes[(dirname, key)]
+
+    def _partition_bytes(self, dirname, key):
+        base = os.path.join(self.log_dir, dirname, f"{key}.txt"); size = 0
+        for suffix in ("", ".sealing", ".gz", ".zst"):
+            try: size += os.path.getsize(base + suffix)
+            except OSError: pass
+        return size
+
+    def _delete(self, dirname, key):
+        base = os.path.join(self.log_dir, dirname, f"{key}.txt")
+        self.log_writer.close_path(base)
+        for suffix in ("", ".sealing", ".gz", ".zst"):
+            try: os.remove(base + suffix)
+            except FileNotFoundError: pass
+        with self._lock:
+            self._manifests[dirname]["partitions"].pop(key, None); self._stats["deleted"] += 1
+            self._save_manifest(dirname)
+        logger.info(f"[RevocationAndLogger] 已删除过期聊天记录分区: {dirname}/{key}")
+
+    def _ensure_loaded(self):
+        if self._loaded: return
+        with self._lock:
+            if self._loaded: return
+            try: names = os.listdir(self.log_dir)
+            except FileNotFoundError: names = []
+            for dirname in names:
+                manifest_path = os.path.join(self.log_dir, dirname, MANIFEST_FILE)
+                if not os.path.isfile(manifest_path): continue
+                try:
+                    with open(manifest_path, 'r', encoding='utf-8') as f: self._manifests[dirname] = json.load(f)
+                except (OSError, ValueError) as e: logger.error(f"[RevocationAndLogger] 读取聊天记录分区清单失败: {manifest_path}, Error: {e}")
+            self._loaded = True
+
+    def _save_manifest(self, dirname):
+        manifest_path = os.path.join(self.log_dir, dirname, MANIFEST_FILE); tmp_path = f"{manifest_path}.tmp"
+        manifest = self._manifests[dirname]
+        data = {**manifest, "partitions": dict(sorted(manifest["partitions"].items()))}
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(data, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, manifest_path)
+        except OSError as e: logger.error(f"[RevocationAndLogger] 保存聊天记录分区清单失败: {manifest_path}, Error: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {"rotation": self.rotation, "compression": self.compression, "groups": len(self._manifests),
+                    "partitions": sum(len(m["partitions"]) for m in self._manifests.values()), **self._stats}
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from common.log import logger
+
+from .striped_lock import StripedLock
+
+GroupLogRecord = namedtuple("GroupLogRecord", ["group_id", "timestamp_str", "sender_nickname", "content"])
+
+
+class GroupLogWriter:
+    # 按文件缓冲写入并复用打开的句柄; 每个文件的缓冲与写盘只持有该文件所在的分段锁,
+    # 全局锁只保护打开句柄的 LRU, 一个群聊写盘时不会阻塞其他群聊
+    def __init__(self, max_open_files=64, flush_lines=50, flush_interval=2.0, stripes=64):
+        self.max_open_files = max(1, int(max_open_files))
+        self.flush_lines = max(1, int(flush_lines))
+        self.flush_interval = max(0.0, float(flush_interval))
+        self._handles = OrderedDict()  # path -> 打开的追加句柄, 按最近使用排序 (全局锁)
+        self._buffers = {}  # path -> 待写入行 (分段锁)
+        self._buffered_since = {}  # path -> 最早一条待写入行的时间 (分段锁)
+        self._known_files = set()  # 已确认存在(已有文件头)的日志文件 (分段锁)
+        self._lock = threading.Lock()
+        self._path_locks = StripedLock(stripes)
+        self._closed = False
+
+    def claim_header(self, path):
+        # 每个文件在进程生命周期内只检查一次是否存在, 返回 True 表示调用方需要写入文件头
+        with self._path_locks(path):
+            if path in self._known_files: return False
+            self._known_files.add(path)
+            return not os.path.exists(path)
+
+    def write(self, path, text):
+        with self._path_locks(path):
+            if self._closed:
+                self._write_through(path, text); return
+            buf = self._buffers.get(path)
+            if buf is None:
+                buf = self._buffers[path] = []; self._buffered_since[path] = time.monotonic()
+            buf.append(text)
+            if len(buf) >= self.flush_lines or time.monotonic() - self._buffered_since[path] >= self.flush_interval:
+                self._flush_path(path)
+
+    def flush_due(self):
+        now = time.monotonic()
+        for path in [p for p, since in list(self._buffered_since.items()) if now - since >= self.flush_interval]:
+            with self._path_locks(path): self._flush_path(path)
+
+    def flush(self):
+        for path in list(self._buffers):
+            with self._path_locks(path): self._flush_path(path)
+
+    def close_path(self, path):
+        with self._path_locks(path):
+            self._flush_path(path)
+            self._drop_handle(path)
+            self._known_files.discard(path)
+
+    def detach(self, path, new_path):
+        # 刷新并关闭后在锁内改名, 之后的写入会落到新建的 path 上, 不会写进已改名的文件
+        with self._path_locks(path):
+            self._flush_path(path)
+            self._drop_handle(path)
+            self._known_files.discard(path)
+            if path in self._buffers: return False
+            try: os.replace(path, new_path)
+            except FileNotFoundError: return False
+            return True
+
+    def close(self):
+        # 取得全部分段锁后再标记关闭, 不会有写入在刷新之后才进入缓冲
+        with self._path_locks.all():
+            for path in list(self._buffers): self._flush_path(path)
+            with self._lock: handles = list(self._handles.items()); self._handles.clear()
+            for path, f in handles: self._close_handle(path, f)
+            self._closed = True
+
+    def _flush_path(self, path):
+        # 调用方持有 path 的分段锁
+        lines = self._buffers.get(path)
+        if not lines: return
+        try:
+            f = self._get_handle(path); f.write(''.join(lines)); f.flush()
+        except (IOError, OSError) as e:
+            # 写入失败时保留缓冲, 下次刷新时按原顺序重试
+            logger.error(f"[RevocationAndLogger] 写入日志文件IO错误 (File: {os.path.basename(path)}): {e}")
+            self._drop_handle(path)
+            return
+        del self._buffers[path]; del self._buffered_since[path]
+
+    def _get_handle(self, path):
+        # 调用方持有 path 的分段锁; 超出句柄上限时关闭最久未用的句柄,
+        # 只关闭能立即取得分段锁的 (其他线程可能正在写), 取不到就跳过, 暂时超出上限
+        with self._lock:
+            f = self._handles.get(path)
+            if f is not None:
+                self._handles.move_to_end(path); return f
+            candidates = list(self._handles)[:max(0, len(self._handles) - self.max_open_files + 1)]
+        for old_path in candidates:
+            lock = self._path_locks(old_path)
+            if not lock.acquire(blocking=False): continue
+            try: self._drop_handle(old_path)
+            finally: lock.release()
+        f = open(path, 'a', encoding='utf-8')
+        with self._lock: self._handles[path] = f
+        return f
+
+    def _drop_handle(self, path):
+        # 调用方持有 path 的分段锁
+        with self._lock: f = self._handles.pop(path, None)
+        if f: self._close_handle(path, f)
+
+    def _write_through(self, path, text):
+        try:
+            with open(path, 'a', encoding='utf-8') as f: f.write(text)
+        except (IOError, OSError) as e: logger.error(f"[RevocationAndLogger] 写入日志文件IO错误 (File: {os.path.basename(path)}): {e}")
+
+    def _close_handle(self, path, f):
+        try: f.close()
+        except Exception as e: logger.warning(f"[RevocationAndLogger] 关闭日志文件失败 (File: {os.path.basename(path)}): {e}")
+
+    def stats(self):
+        buffers = list(self._buffers.values())
+        with self._lock: open_files = len(self._handles)
+        return {"open_files": open_files, "buffered_files": len(buffers), "buffered_lines": sum(len(b) for b in buffers)}
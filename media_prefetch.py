@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from common.log import logger
+
+
+class MediaTooLarge(Exception):
+    # 下载超过大小上限时中止; size 为响应声明的大小 (未知时为 0), received 为中止前已下载的字节数
+    def __init__(self, size, received, limit):
+        super().__init__(f"文件大小超过上限 {limit} 字节 (声明 {size or '未知'}, 已下载 {received})")
+        self.size = size; self.received = received; self.limit = limit
+
+
+class MediaPrefetcher:
+    # 媒体文件的下载与复制放到有界线程池里执行, 缓存中保存 Future, 撤回时再带超时等待结果
+    def __init__(self, workers=4, timeout=20, chunk_size=64 * 1024):
+        self.workers = max(1, int(workers))
+        self.timeout = timeout
+        self.chunk_size = max(4096, int(chunk_size))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="RevocationAndLogger-media")
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.downloaded_bytes = 0
+
+    def submit(self, fn, *args):
+        with self._stats_lock: self.submitted += 1
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._count)
+        return future
+
+    def _count(self, future):
+        with self._stats_lock:
+            if future.cancelled() or future.exception() is not None or not future.result(): self.failed += 1
+            else: self.completed += 1
+
+    def _get_session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+                    session.mount("http://", adapter); session.mount("https://", adapter)
+                    self._session = session
+        return self._session
+
+    def download(self, url, target_path, max_bytes=0):
+        # 分块流式写入 .part 文件, 完成后再改名, 不会把整个响应体读进内存
+        # max_bytes 非 0 时, 声明的大小超过上限则不下载, 下载中超过上限则中止 (抛出 MediaTooLarge)
+        part_path = f"{target_path}.part"; size = 0
+        try:
+            with self._get_session().get(url, stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                try: declared = int(response.headers.get('Content-Length') or 0)
+                except ValueError: declared = 0
+                if max_bytes and declared > max_bytes: raise MediaTooLarge(declared, 0, max_bytes)
+                with open(part_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        if chunk: f.write(chunk); size += len(chunk)
+                        if max_bytes and size > max_bytes: raise MediaTooLarge(declared, size, max_bytes)
+            os.replace(part_path, target_path)
+        except BaseException:
+            if os.path.exists(part_path):
+                try: os.remove(part_path)
+                except OSError: pass
+            raise
+        with self._stats_lock: self.downloaded_bytes += size
+        return target_path
+
+    @staticmethod
+    def resolve(value, timeout):
+        # value 为路径或 Future; 等待超时或下载失败时返回 None
+        if not isinstance(value, Future): return value
+        try: return value.result(timeout=timeout)
+        except FutureTimeoutError:
+            logger.warning(f"[RevocationAndLogger] 等待媒体文件缓存超时 ({timeout}s)"); return None
+        except Exception as e:
+            logger.error(f"[RevocationAndLogger] 媒体文件缓存失败: {e}"); return None
+
+    @staticmethod
+    def when_ready(value, fn):
+        # 路径已就绪时立即回调, Future 则在完成后回调 (失败或取消时不回调)
+        if not isinstance(value, Future):
+            if value: fn(value)
+            return
+        def _done(future):
+            if future.cancelled() or future.exception() is not None: return
+            if future.result(): fn(future.result())
+        value.add_done_callback(_done)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._session is not None:
+            try: self._session.close()
+            except Exception: pass
+
+    def stats(self):
+        with self._stats_lock:
+            return {"submitted": self.submitted, "completed": self.completed, "failed": self.failed,
+                    "inflight": self.submitted - self.completed - self.failed, "downloaded_bytes": self.downloaded_bytes}
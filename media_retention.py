@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from common.log import logger
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FICLONE = 0x40049409  # Linux ioctl, btrfs / xfs / bcachefs 等支持 reflink 的文件系统可用
+
+
+class MediaRef:
+    # reference 模式下只记录原文件路径和 (大小, 修改时间) 指纹, 撤回时才复制
+    __slots__ = ("path", "size", "mtime_ns", "materialized")
+
+    def __init__(self, path, size, mtime_ns):
+        self.path = path; self.size = size; self.mtime_ns = mtime_ns; self.materialized = None
+
+    def __repr__(self):
+        return f"MediaRef(path={self.path!r}, size={self.size})"
+
+
+class MediaRetainer:
+    # copy: 完整复制到 tmp (旧行为)
+    # link: 同一文件系统时硬链接 (不支持时尝试 reflink), 否则复制
+    # reference: 不复制, 撤回时校验指纹后再复制到 tmp
+    MODES = ("copy", "link", "reference")
+
+    def __init__(self, tmp_dir, mode="link", store=None):
+        self.tmp_dir = tmp_dir
+        self.store = store  # 可选的 MediaStore, 启用后相同内容只保留一份
+        if mode not in self.MODES:
+            logger.warning(f"[RevocationAndLogger] 未知的媒体保留模式 '{mode}', 使用 link"); mode = "link"
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._counters = {}
+        for kind in ("copy", "link", "reflink", "ref", "materialize"): self._counters[kind] = 0; self._counters[f"{kind}_bytes"] = 0
+        self._counters["stale_ref"] = 0
+
+    def _count(self, kind, size):
+        with self._lock: self._counters[kind] += 1; self._counters[f"{kind}_bytes"] += size
+
+    def _target_path(self, file_path):
+        base, ext = os.path.splitext(os.path.basename(file_path))
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        return os.path.join(self.tmp_dir, f"{base}_{str(uuid.uuid4())[:8]}{ext}")
+
+    def retain(self, file_path):
+        st = os.stat(file_path)
+        if self.mode == "reference":
+            self._count("ref", st.st_size)
+            return MediaRef(file_path, st.st_size, st.st_mtime_ns)
+        return self._place(file_path, st)
+
+    def _place(self, file_path, st):
+        if self.store is not None: return self.store.put(file_path, lambda src, target: self._place_at(src, target, st))
+        target_path = self._target_path(file_path); self._place_at(file_path, target_path, st)
+        return target_path
+
+    def _place_at(self, file_path, target_path, st):
+        if self.mode == "copy": self._copy(file_path, target_path, st.st_size)
+        else: self._link_or_copy(file_path, target_path, st)
+
+    def _link_or_copy(self, file_path, target_path, st):
+        try:
+            if os.stat(self.tmp_dir).st_dev == st.st_dev:
+                os.link(file_path, target_path); self._count("link", st.st_size); return
+        except OSError as e: logger.debug(f"[RevocationAndLogger] 硬链接失败, 尝试 reflink/复制: {e}")
+        if self._reflink(file_path, target_path): self._count("reflink", st.st_size); return
+        self._copy(file_path, target_path, st.st_size)
+
+    def _reflink(self, file_path, target_path):
+        if fcntl is None: return False
+        try:
+            with open(file_path, 'rb') as src, open(target_path, 'wb') as dst: fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return True
+        except OSError:
+            try: os.remove(target_path)
+            except OSError: pass
+            return False
+
+    def _copy(self, file_path, target_path, size):
+        shutil.copy2(file_path, target_path); self._count("copy", size)
+
+    def materialize(self, value):
+        # 返回可发送的 tmp 路径; 原文件已被删除或修改时返回 None
+        if not isinstance(value, MediaRef): return value
+        if value.materialized and os.path.exists(value.materialized): return value.materialized
+        try:
+            st = os.stat(value.path)
+            if st.st_size != value.size or st.st_mtime_ns != value.mtime_ns: raise FileNotFoundError(value.path)
+            target_path = self._place(value.path, st)
+        except OSError as e:
+            with self._lock: self._counters["stale_ref"] += 1
+            logger.warning(f"[RevocationAndLogger] 原媒体文件已不可用, 无法还原撤回内容: {value.path} ({e})"); return None
+        self._count("materialize", value.size); value.materialized = target_path
+        return target_path
+
+    def release(self, value):
+        # MediaRef 指向的是原文件, 只删除撤回时复制出来的文件
+        if isinstance(value, MediaRef): value = value.materialized
+        if not value: return
+        if self.store is not None and self.store.owns(value): self.store.release(value); return
+        if os.path.exists(value):
+            try: os.remove(value)
+            except Exception as e: logger.error(f"[RevocationAndLogger] 删除过期临时文件失败: {value}, Error: {e}")
+
+    @staticmethod
+    def size_of(value):
+        if isinstance(value, MediaRef): return value.size
+        try: return os.path.getsize(value)
+        except (OSError, TypeError): return 0
+
+    def stats(self):
+        with self._lock: return {"mode": self.mode, **self._counters}
+
+
+def sweep_tmp(tmp_dir, referenced, max_age, store=None):
+    # 删除 tmp 目录顶层超过 max_age 秒且不在 referenced (绝对路径) 中的文件, 返回删除的个数
+    # 按 ctime 判断, 硬链接保留时会刷新原文件的 ctime; 子目录 (撤回缓存日志) 不处理; MediaStore 的媒体文件交给 store 删除
+    cutoff = time.time() - max_age; removed = 0
+    with os.scandir(tmp_dir) as it:
+        for entry in it:
+            try:
+                if not entry.is_file(follow_symlinks=False) or entry.path in referenced or entry.stat(follow_symlinks=False).st_ctime > cutoff: continue
+                if store is not None and store.is_blob(entry.path):
+                    if store.discard_orphan(entry.path): removed += 1
+                    continue
+                os.remove(entry.path); removed += 1
+            except OSError as e: logger.debug(f"[RevocationAndLogger] 清理 tmp 文件失败: {entry.path}, Error: {e}")
+    return removed
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import threading
+import uuid
+
+from common.log import logger
+
+
+class MediaStore:
+    # 按内容哈希存放防撤回媒体文件, 同样的内容只保留一份, 引用计数归零时删除
+    # 文件直接放在 tmp 目录下 (blob_<hash><ext>), 回调地址 ?file=tmp/... 的形式保持不变
+    def __init__(self, tmp_dir, chunk_size=1024 * 1024):
+        self.tmp_dir = tmp_dir
+        self.chunk_size = chunk_size
+        self._refs = {}  # blob path -> 引用次数
+        self._sizes = {}  # blob path -> 文件大小
+        self._lock = threading.Lock()
+        self.puts = 0
+        self.dedup_hits = 0
+        self.bytes_in = 0
+        self.bytes_stored = 0
+        self.deleted = 0
+
+    def digest(self, file_path):
+        h = hashlib.blake2b(digest_size=16)
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b''): h.update(chunk)
+        return h.hexdigest()
+
+    def put(self, file_path, place_fn):
+        # place_fn(src, target) 负责把源文件放到 target (硬链接/复制), 仅在该内容还没有文件时调用
+        # 哈希和放置 (可能是整个文件的复制) 都在锁外: 先放到唯一的临时文件名, 再在锁内改名为 blob 文件; 锁内只做引用计数和去重登记
+        size = os.path.getsize(file_path); ext = os.path.splitext(file_path)[1].lower()
+        blob_path = os.path.join(self.tmp_dir, f"blob_{self.digest(file_path)}{ext}")
+        with self._lock:
+            self.puts += 1; self.bytes_in += size
+            if self._add_ref(blob_path, size): return blob_path
+        part_path = os.path.join(self.tmp_dir, f"part_{uuid.uuid4().hex}{ext}")
+        try:
+            place_fn(file_path, part_path)
+            with self._lock:
+                # 放置期间其他线程可能已经放好了同样的内容, 这时丢弃自己的临时文件
+                if not self._add_ref(blob_path, size):
+                    os.replace(part_path, blob_path); part_path = None
+                    self._refs[blob_path] = 1; self._sizes[blob_path] = size; self.bytes_stored += size
+        finally:
+            if part_path is not None and os.path.exists(part_path): os.remove(part_path)
+        return blob_path
+
+    def _add_ref(self, blob_path, size):
+        # 调用方持有 _lock; 已登记的文件增加引用 (去重), 重启前遗留的同内容文件直接沿用; 都不需要再放置时返回 True
+        if not os.path.exists(blob_path): return False
+        if blob_path in self._refs: self._refs[blob_path] += 1; self.dedup_hits += 1
+        else: self._refs[blob_path] = 1; self._sizes[blob_path] = size; self.bytes_stored += size
+        return True
+
+    def adopt(self, blob_path):
+        # 重启后从撤回缓存日志恢复的条目重新登记引用, 文件已不存在时返回 False
+        with self._lock:
+            if not os.path.exists(blob_path): return False
+            if blob_path not in self._refs: self._sizes[blob_path] = os.path.getsize(blob_path)
+            self._refs[blob_path] = self._refs.get(blob_path, 0) + 1
+            return True
+
+    def is_blob(self, path):
+        name = os.path.basename(path)
+        return name.startswith("blob_") and os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.tmp_dir)
+
+    def owns(self, path):
+        return path in self._refs
+
+    def release(self, blob_path):
+        with self._lock:
+            count = self._refs.get(blob_path)
+            if count is None: return False
+            if count > 1: self._refs[blob_path] = count - 1; return True
+            del self._refs[blob_path]; self._sizes.pop(blob_path, None)
+            try:
+                if os.path.exists(blob_path): os.remove(blob_path); self.deleted += 1
+            except OSError as e: logger.error(f"[RevocationAndLogger] 删除媒体缓存文件失败: {blob_path}, Error: {e}")
+            return True
+
+    def discard_orphan(self, blob_path):
+        # 删除没有任何缓存条目引用的媒体文件 (重启前遗留等); 与 put 在同一把锁下, 不会删掉刚被重新引用的文件
+        with self._lock:
+            if blob_path in self._refs: return False
+            os.remove(blob_path); self.deleted += 1
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {"blobs": len(self._refs), "blob_bytes": sum(self._sizes.values()), "refs": sum(self._refs.values()),
+                    "puts": self.puts, "dedup_hits": self.dedup_hits, "deleted": self.deleted,
+                    "bytes_in": self.bytes_in, "bytes_stored": self.bytes_stored, "bytes_saved": self.bytes_in - self.bytes_stored,
+                    "dedup_ratio": round(self.bytes_in / self.bytes_stored, 3) if self.bytes_stored else 1.0}
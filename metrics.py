@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import functools
+import logging
+import os
+import threading
+import time
+
+# 耗时直方图的桶上界 (秒): 热点方法大多在 100µs 以内, 比 Prometheus 默认桶多了亚毫秒级的几档
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PREFIX = "revocation_"
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1); self.total = 0.0; self.count = 0
+
+    def quantile(self, q):
+        # 在所在的桶内线性插值估算分位数, 落在最后一个桶 (+Inf) 时返回最大的桶上界
+        rank = q * self.count; seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                if i == len(BUCKETS): return BUCKETS[-1]
+                lower = BUCKETS[i - 1] if i else 0.0
+                return lower + (BUCKETS[i] - lower) * (rank - seen) / n
+            seen += n
+        return 0.0
+
+
+def instrument(stage, expected=()):
+    # 方法装饰器: 耗时计入 self.metrics 中 stage 的直方图, 抛出的异常计入 errors_total 后照常抛出 (expected 中的异常类型不计入)
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            started = time.perf_counter()
+            try: return fn(self, *args, **kwargs)
+            except Exception as e:
+                if not isinstance(e, expected): self.metrics.inc("errors", stage=stage)
+                raise
+            finally: self.metrics.observe(stage, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+class LogCounter(logging.Handler):
+    # 按级别统计插件自己的 WARNING/ERROR 日志 (以 prefix 开头的消息), 不用在每个 except 里单独计数
+    def __init__(self, metrics, prefix):
+        super().__init__(logging.WARNING); self.metrics = metrics; self.prefix = prefix
+
+    def emit(self, record):
+        if isinstance(record.msg, str) and record.msg.startswith(self.prefix): self.metrics.inc("log_messages", level=record.levelname.lower())
+
+
+def dir_usage(path):
+    # (文件数, 字节数), 递归统计, 不跟随符号链接
+    files = size = 0; stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False): stack.append(entry.path)
+                        else: files += 1; size += entry.stat(follow_symlinks=False).st_size
+                    except OSError: pass
+        except OSError: pass
+    return files, size
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(items):
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}" if items else ""
+
+
+class Metrics:
+    # 进程内指标: 各阶段耗时直方图 + 带标签的计数器 + 采集时才调用的收集函数 (缓存大小、队列积压等)
+    # 热点路径上只有一次加锁和几次整数加法, 可以常开
+    def __init__(self):
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._histograms = {}  # stage -> Histogram
+        self._counters = {}  # (name, ((label, value), ...)) -> 数值
+        self._collectors = []  # fn() -> [(name, type, help, value)]
+
+    def observe(self, stage, seconds):
+        histogram = self._histograms.get(stage) or self._histograms.setdefault(stage, Histogram())
+        i = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock: histogram.counts[i] += 1; histogram.total += seconds; histogram.count += 1
+
+    def inc(self, name, amount=1, **labels):
+        # 标签按传入顺序组成 key, 同一指标在各调用处的标签顺序要一致
+        key = (name, tuple(labels.items()))
+        with self._lock: self._counters[key] = self._counters.get(key, 0) + amount
+
+    def add_collector(self, fn):
+        self._collectors.append(fn)
+
+    def snapshot(self):
+        with self._lock:
+            histograms = {stage: (list(h.counts), h.total, h.count) for stage, h in self._histograms.items()}
+            counters = dict(self._counters)
+        collected = []
+        for fn in self._collectors:
+            try: collected.extend(fn())
+            except Exception: self.inc("errors", stage="collect_metrics")
+        return histograms, counters, collected
+
+    def render_prometheus(self):
+        histograms, counters, collected = self.snapshot(); lines = []
+        lines += [f"# HELP {PREFIX}stage_seconds 各处理阶段耗时", f"# TYPE {PREFIX}stage_seconds histogram"]
+        for stage in sorted(histograms):
+            counts, total, count = histograms[stage]; cumulative = 0
+            for bound, n in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += n; lines.append(f"{PREFIX}stage_seconds_bucket{_labels((('stage', stage), ('le', bound)))} {cumulative}")
+            lines.append(f"{PREFIX}stage_seconds_sum{_labels((('stage', stage),))} {total:.6f}")
+            lines.append(f"{PREFIX}stage_seconds_count{_labels((('stage', stage),))} {count}")
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {PREFIX}{name}_total counter")
+            lines += [f"{PREFIX}{name}_total{_labels(labels)} {value}" for (n, labels), value in sorted(counters.items()) if n == name]
+        for name, kind, help_text, value in collected:
+            lines += [f"# HELP {PREFIX}{name} {help_text}", f"# TYPE {PREFIX}{name} {kind}", f"{PREFIX}{name} {value}"]
+        lines.append(f"# TYPE {PREFIX}uptime_seconds gauge"); lines.append(f"{PREFIX}uptime_seconds {time.time() - self.started:.0f}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        # 先写临时文件再替换, node_exporter 的 textfile collector 不会读到写了一半的文件
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f: f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+
+    def summary(self):
+        # 聊天命令使用的简要文本
+        histograms, counters, collected = self.snapshot()
+        uptime = int(time.time() - self.started)
+        lines = [f"运行时间: {uptime // 86400}天{uptime % 86400 // 3600}小时{uptime % 3600 // 60}分", "各阶段耗时 (次数 p50/p99 ms):"]
+        for stage in sorted(histograms):
+            counts, total, count = histograms[stage]
+            h = Histogram(); h.counts = counts; h.total = total; h.count = count
+            lines.append(f"  {stage}: {count} 次 {h.quantile(0.5) * 1000:.2f}/{h.quantile(0.99) * 1000:.2f}")
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"{name}: " + ", ".join(f"{'/'.join(str(v) for _, v in labels) or '总计'}={value}" for (n, labels), value in sorted(counters.items()) if n == name))
+        lines += [f"{help_text}: {value}" for _, _, help_text, value in collected]
+        return "\n".join(lines)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import itertools
+import random
+import threading
+import time
+from collections import deque
+
+from common.log import logger
+
+
+class Notification:
+    # 一条撤回通知: parts 为依次调用的发送接口 [(方法名, 参数)], 单独发送时全部发出
+    # 合并成摘要时只用 summary 作为摘要里的一行, attachments (图片/文件) 仍在摘要之后单独发送
+    __slots__ = ("receiver", "key", "title", "summary", "parts", "attachments", "created", "attempts", "next_part", "reserved")
+
+    def __init__(self, receiver, key, title, summary, parts, attachments=()):
+        self.receiver = receiver; self.key = key; self.title = title; self.summary = summary
+        self.parts = list(parts); self.attachments = list(attachments)
+        self.created = time.time(); self.attempts = 0; self.next_part = 0; self.reserved = False
+
+
+class _Digest:
+    __slots__ = ("receiver", "key", "items")
+
+    def __init__(self, receiver, key, first):
+        self.receiver = receiver; self.key = key; self.items = [first]
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate; self.capacity = capacity; self.tokens = capacity; self.updated = time.monotonic()
+
+    def take(self, now):
+        # 取一个令牌, 返回需要等待的秒数; 令牌不足时预支 (令牌数变为负), 依次推迟的任务各自排到后面的发送时间, 不会同时醒来再争抢
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate) - 1; self.updated = now
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class OutboundNotifier:
+    # 撤回通知的发送队列: 工作线程从按就绪时间排序的堆里取任务
+    # - 每个接收者一个令牌桶限速, 令牌不足时把任务推迟到可发送的时间
+    # - 发送失败按指数退避 (带随机抖动) 重试, 已发出的部分不会重复发送
+    # - 同一来源 (群/好友) 在 digest_window 秒内超过 digest_threshold 条时, 之后的通知合并成一条摘要
+    def __init__(self, send_fn, workers=2, rate=1.0, burst=5, max_retries=3, retry_base=2.0, retry_max=60.0,
+                 digest_threshold=5, digest_window=10.0, queue_size=1000):
+        self._send = send_fn  # send_fn(receiver, method, args), 失败时抛异常
+        self.rate = max(0.01, float(rate))
+        self.burst = max(1.0, float(burst))
+        self.max_retries = max(0, int(max_retries))
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.digest_threshold = int(digest_threshold)
+        self.digest_window = digest_window
+        self.queue_size = max(1, int(queue_size))
+        self._heap = []  # (ready_at, seq, Notification 或 _Digest)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._buckets = {}  # receiver -> TokenBucket
+        self._recent = {}  # (receiver, key) -> deque[提交时间]
+        self._digests = {}  # (receiver, key) -> 等待发送的 _Digest
+        self._digest_items = 0  # 并入摘要、不单独占堆位置的通知数, 与堆一起计入 queue_size
+        self._latencies = deque(maxlen=1000)
+        self._busy = 0
+        self._stopped = False
+        self._stats = dict.fromkeys(("enqueued", "sent", "failed", "retries", "throttled", "coalesced", "digests", "dropped"), 0)
+        self._threads = [threading.Thread(target=self._run, name=f"RevocationAndLogger-notify-{i}", daemon=True) for i in range(max(1, int(workers)))]
+        for t in self._threads: t.start()
+
+    def submit(self, notification):
+        now = time.time()
+        with self._cond:
+            if self._stopped or len(self._heap) + self._digest_items >= self.queue_size:
+                self._stats["dropped"] += 1
+                logger.error(f"[RevocationAndLogger] 通知队列已满或已关闭, 丢弃发往 {notification.receiver} 的撤回通知")
+                return False
+            self._stats["enqueued"] += 1
+            slot = (notification.receiver, notification.key)
+            digest = self._digests.get(slot)
+            if digest is not None:
+                digest.items.append(notification); self._digest_items += 1; self._stats["coalesced"] += 1
+                return True
+            if self.digest_threshold > 0 and notification.key:
+                recent = self._recent.setdefault(slot, deque())
+                while recent and recent[0] < now - self.digest_window: recent.popleft()
+                recent.append(now)
+                if len(recent) > self.digest_threshold:
+                    self._digests[slot] = _Digest(notification.receiver, notification.key, notification); self._stats["coalesced"] += 1
+                    self._push(now + self.digest_window, self._digests[slot])
+                    return True
+            self._push(now, notification)
+        return True
+
+    def _push(self, ready_at, job):
+        heapq.heappush(self._heap, (ready_at, next(self._seq), job)); self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._heap and self._heap[0][0] <= time.time(): break
+                    if self._stopped: return
+                    self._cond.wait(None if not self._heap else self._heap[0][0] - time.time())
+                _, _, job = heapq.heappop(self._heap); self._busy += 1
+                if isinstance(job, _Digest): job = self._build_digest(job)
+            try: self._deliver(job)
+            except Exception as e: logger.error(f"[RevocationAndLogger] 发送撤回通知出错: {e}")
+            finally:
+                with self._cond: self._busy -= 1; self._cond.notify_all()
+
+    def _build_digest(self, digest):
+        self._digests.pop((digest.receiver, digest.key), None); self._digest_items -= len(digest.items) - 1
+        if len(digest.items) == 1: return digest.items[0]
+        first = digest.items[0]
+        text = f"{first.title} 在短时间内撤回了 {len(digest.items)} 条消息:\n" + "\n".join(f"[{time.strftime('%H:%M:%S', time.localtime(n.created))}] {n.summary}" for n in digest.items)
+        merged = Notification(digest.receiver, digest.key, first.title, text, [("post_text", (text, ""))] + [part for n in digest.items for part in n.attachments])
+        merged.created = first.created; self._stats["digests"] += 1
+        return merged
+
+    def _deliver(self, n):
+        while n.next_part < len(n.parts):
+            if n.reserved: n.reserved = False  # 推迟时已经预支了这一部分的令牌
+            else:
+                with self._cond:
+                    bucket = self._buckets.get(n.receiver)
+                    if bucket is None: bucket = self._buckets[n.receiver] = TokenBucket(self.rate, self.burst)
+                    wait = bucket.take(time.monotonic())
+                    if wait > 0: self._stats["throttled"] += 1; n.reserved = True; self._push(time.time() + wait, n); return
+            method, args = n.parts[n.next_part]
+            try: self._send(n.receiver, method, args)
+            except Exception as e:
+                n.attempts += 1
+                with self._cond:
+                    if n.attempts > self.max_retries:
+                        self._stats["failed"] += 1
+                        logger.error(f"[RevocationAndLogger] 撤回通知发送失败, 已重试 {self.max_retries} 次, 放弃: {method} -> {n.receiver}: {e}"); return
+                    delay = min(self.retry_max, self.retry_base * (2 ** (n.attempts - 1))) * random.uniform(0.5, 1.5)
+                    self._stats["retries"] += 1; self._push(time.time() + delay, n)
+                logger.warning(f"[RevocationAndLogger] 撤回通知发送失败, {delay:.1f}s 后重试 ({n.attempts}/{self.max_retries}): {method} -> {n.receiver}: {e}")
+                return
+            n.next_part += 1
+        with self._cond: self._stats["sent"] += 1; self._latencies.append(time.time() - n.created)
+
+    def shutdown(self, timeout=5):
+        # 退出时等待中的摘要立即发送, 其余通知在 timeout 内按限速尽量发完
+        deadline = time.time() + timeout
+        with self._cond:
+            self._heap = [(min(ready_at, time.time()) if isinstance(job, _Digest) else ready_at, seq, job) for ready_at, seq, job in self._heap]
+            heapq.heapify(self._heap)
+            while (self._busy or (self._heap and self._heap[0][0] <= deadline)) and time.time() < deadline: self._cond.wait(0.05)
+            if self._heap: logger.warning(f"[RevocationAndLogger] 退出时仍有 {len(self._heap)} 条撤回通知未发送")
+            self._stopped = True; self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            latencies = sorted(self._latencies)
+            pct = lambda p: round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1) if latencies else 0
+            return {"depth": len(self._heap) + self._digest_items, "pending_digests": len(self._digests), "busy": self._busy, **self._stats,
+                    "latency_p50_ms": pct(0.5), "latency_p95_ms": pct(0.95), "latency_max_ms": pct(1.0)}
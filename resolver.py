@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from common.log import logger
+
+GROUP = "g"
+USER = "u"
+
+
+class InfoResolver:
+    # 群名/用户名解析:
+    # - TTL + LRU 缓存, 也接收消息里顺带的昵称 (observe)
+    # - 同一 id 的并发查询只发一次请求 (single-flight)
+    # - 用户查询在 batch_window 内合并成一次 getBriefInfo 调用
+    # - 失败按指数退避加随机抖动做负缓存, 期间返回上一次成功的名字 (如有)
+    # - 落盘保存, 重启后不必重新查询
+    def __init__(self, fetch_group, fetch_users, group_ttl=3600, user_ttl=3600, max_entries=20000,
+                 negative_ttl=60, max_backoff=1800, batch_window=0.02, batch_max=20, wait_timeout=10, persist_path=None):
+        self._fetch_group = fetch_group  # group_id -> name 或 None, 出错时抛异常
+        self._fetch_users = fetch_users  # [user_id] -> {user_id: name}, 出错时抛异常
+        self._ttl = {GROUP: group_ttl, USER: user_ttl}
+        self.max_entries = max(1, int(max_entries))
+        self.negative_ttl = negative_ttl
+        self.max_backoff = max_backoff
+        self.batch_window = batch_window
+        self.batch_max = max(1, int(batch_max))
+        self.wait_timeout = wait_timeout
+        self.persist_path = persist_path
+        self._cache = OrderedDict()  # (kind, id) -> [name, expires_at, fails], fails > 0 表示负缓存, name 为上次成功的名字
+        self._inflight = {}  # (kind, id) -> Future
+        self._pending_users = []
+        self._cond = threading.Condition()
+        self._batch_thread = None
+        self._dirty = False
+        self._stats = dict.fromkeys(("hits", "misses", "coalesced", "api_calls", "batched_ids", "failures", "observed"), 0)
+        if persist_path: self.load()
+
+    def group_name(self, group_id, force_refresh=False):
+        return self._lookup((GROUP, group_id), force_refresh)
+
+    def user_name(self, user_id, force_refresh=False):
+        return self._lookup((USER, user_id), force_refresh)
+
+    def observe(self, kind, item_id, name):
+        # 消息里带的昵称只在缓存缺失或过期时写入, 不覆盖接口查到的备注名
+        if not item_id or not name or name == item_id: return
+        with self._cond:
+            entry = self._cache.get((kind, item_id))
+            if entry is not None and entry[2] == 0 and time.time() < entry[1]: return
+            self._put((kind, item_id), name, time.time() + self._ttl[kind], 0); self._stats["observed"] += 1
+
+    def _lookup(self, key, force_refresh):
+        now = time.time()
+        with self._cond:
+            entry = self._cache.get(key)
+            if entry is not None and not force_refresh and now < entry[1]:
+                self._cache.move_to_end(key); self._stats["hits"] += 1
+                return entry[0]
+            future = self._inflight.get(key); owner = future is None
+            if owner:
+                self._stats["misses"] += 1
+                future = self._inflight[key] = Future()
+                if key[0] == USER: self._pending_users.append(key[1]); self._ensure_batch_thread(); self._cond.notify()
+            else: self._stats["coalesced"] += 1
+            stale = entry[0] if entry is not None else None
+        if owner and key[0] == GROUP:
+            try:
+                with self._cond: self._stats["api_calls"] += 1
+                self._complete(key, self._fetch_group(key[1]))
+            except Exception as e:
+                logger.error(f"[RevocationAndLogger] 获取群信息 API 调用失败 for {key[1]}: {e}"); self._complete(key, None)
+        try: return future.result(timeout=self.wait_timeout)
+        except Exception: return stale
+
+    def _complete(self, key, name):
+        now = time.time()
+        with self._cond:
+            if name:
+                self._put(key, name, now + self._ttl[key[0]], 0)
+            else:
+                old = self._cache.get(key); fails = (old[2] if old else 0) + 1; stale = old[0] if old else None
+                backoff = min(self.max_backoff, self.negative_ttl * (2 ** (fails - 1))) * random.uniform(0.5, 1.5)
+                self._put(key, stale, now + backoff, fails); self._stats["failures"] += 1; name = stale
+            future = self._inflight.pop(key, None)
+        if future is not None: future.set_result(name)
+
+    def _put(self, key, name, expires_at, fails):
+        self._cache[key] = [name, expires_at, fails]; self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries: self._cache.popitem(last=False)
+        if fails == 0: self._dirty = True
+
+    def _ensure_batch_thread(self):
+        if self._batch_thread is None or not self._batch_thread.is_alive():
+            self._batch_thread = threading.Thread(target=self._batch_loop, name="RevocationAndLogger-resolver", daemon=True)
+            self._batch_thread.start()
+
+    def _batch_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending_users: self._cond.wait()
+            time.sleep(self.batch_window)  # 等待同一时间段内的其他查询一起合并
+            with self._cond:
+                batch = self._pending_users[:self.batch_max]; del self._pending_users[:self.batch_max]
+                self._stats["api_calls"] += 1; self._stats["batched_ids"] += len(batch)
+            try: names = self._fetch_users(batch) or {}
+            except Exception as e:
+                logger.error(f"[RevocationAndLogger] 获取用户信息 API 调用失败 for {batch}: {e}"); names = {}
+            for user_id in batch: self._complete((USER, user_id), names.get(user_id))
+
+    def load(self):
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f: data = json.load(f)
+        except FileNotFoundError: return
+        except (OSError, ValueError) as e:
+            logger.warning(f"[RevocationAndLogger] 读取名称缓存失败: {self.persist_path}, Error: {e}"); return
+        with self._cond:
+            for key, (name, expires_at) in data.get("entries", {}).items():
+                kind, _, item_id = key.partition(":")
+                if kind in self._ttl and name: self._cache[(kind, item_id)] = [name, float(expires_at), 0]
+            while len(self._cache) > self.max_entries: self._cache.popitem(last=False)
+        logger.info(f"[RevocationAndLogger] 已加载名称缓存 {len(self._cache)} 条")
+
+    def save(self):
+        if not self.persist_path or not self._dirty: return
+        with self._cond:
+            # 过期的名字也保存, 重启后先用旧名字, 过期后再刷新
+            entries = {f"{kind}:{item_id}": [name, expires_at] for (kind, item_id), (name, expires_at, _) in self._cache.items() if name}
+            self._dirty = False
+        tmp_path = f"{self.persist_path}.{os.getpid()}.tmp"  # 共用缓存守护进程时多个实例写同一个文件
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f: json.dump({"entries": entries}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+        except OSError as e:
+            logger.error(f"[RevocationAndLogger] 保存名称缓存失败: {self.persist_path}, Error: {e}"); self._dirty = True
+
+    def stats(self):
+        with self._cond:
+            return {"entries": len(self._cache), "inflight": len(self._inflight), **self._stats}
@@ -7,16 +7,34 @@ import plugins
 import json
 import os
 import re
-from threading import Timer
 import time
-from datetime import datetime
-import shutil
+from datetime import datetime, timedelta
 import uuid
 from plugins import *
 from common.log import logger
 from config import conf
-import copy
 import traceback
+import atexit
+import sqlite3
+import collections
+from concurrent.futures import Future
+from .log_writer import GroupLogRecord
+from .writer_queue import ShardedWriterQueue
+from .storage import create_storage, sanitize_filename
+from .revoke_cache import RevokeCache, CachedMessage
+from .media_prefetch import MediaPrefetcher, MediaTooLarge
+from .media_retention import MediaRetainer, MediaRef, sweep_tmp
+from .media_store import MediaStore
+from .resolver import InfoResolver, USER
+from .search_index import SearchIndex
+from .revoke_parser import parse_revoke, candidate_ids
+from .notifier import OutboundNotifier, Notification
+from .revoke_journal import RevokeJournal
+from .metrics import Metrics, LogCounter, instrument, dir_usage
+from .scheduler import Scheduler
+from .activity import ActivityIndex, hour_index
+from .cache_policy import CachePolicy, MEDIA_TYPES
+from .sidecar import SidecarClient, SidecarError, LocalFallback, RemoteRevokeCache, RemoteMediaRetainer, RemoteStorage, RemoteSearchIndex, RemoteActivity, start_daemon
 
 try:
     from channel.gewechat.gewechat_channel import GeWeChatChannel
@@ -34,6 +52,9 @@ except ImportError:
     author="Misk00",
 )
 class RevocationAndLogger(Plugin):
+    ACTIVITY_KIND_NAMES = {"TEXT": "文字", "IMAGE": "图片", "VIDEO": "视频", "VOICE": "语音", "FILE": "文件", "SHARING": "链接", "CARD": "名片",
+                           "PATPAT": "拍一拍", "JOIN_GROUP": "入群", "EXIT_GROUP": "退群", "SYSTEM": "系统消息", "ACCEPT_FRIEND": "好友请求"}
+
     def __init__(self):
         super().__init__()
         self.config = super().load_config()
@@ -43,15 +64,54 @@ class RevocationAndLogger(Plugin):
         self.handlers[Event.ON_RECEIVE_MESSAGE] = self.on_receive_message
         self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
 
+        self.metrics = Metrics()
+        for handler in [h for h in logger.handlers if type(h).__name__ == "LogCounter"]: logger.removeHandler(handler)  # 插件重载时不重复计数
+        logger.addHandler(LogCounter(self.metrics, "[RevocationAndLogger"))
+        self.log_detail = logger.info if self.config.get("verbose_logging", False) else logger.debug  # 每条消息的处理细节, 默认只在 DEBUG 输出
+        self.metrics_textfile = self.config.get("metrics_textfile", "")
+        self.metrics_interval = self.config.get("metrics_interval", 60)
+
         logger.info("[RevocationAndLogger] 插件初始化 (V1.0 - 修复命令回复及提示优化)")
 
-        self.msg_dict = {}
+        self.sidecar = self.connect_sidecar() if self.config.get("sidecar_socket") else None
+        self._sidecar_down = False
+        # 使用守护进程时, 本进程内的缓存/媒体文件/存储只在守护进程不可用期间使用, 第一次需要时才创建
+        new_cache = lambda: RevokeCache(
+            max_entries=self.config.get("cache_max_entries", 10000),
+            max_bytes=self.config.get("cache_max_mb", 512) * 1024 * 1024,
+            on_evict=self.on_cache_evict,
+        )
+        self.msg_cache = RemoteRevokeCache(self.sidecar, ContextType.__getitem__, LocalFallback(new_cache)) if self.sidecar else new_cache()
+        self.media_prefetcher = MediaPrefetcher(
+            workers=self.config.get("media_prefetch_workers", 4),
+            timeout=self.config.get("download_timeout", 20),
+            chunk_size=self.config.get("download_chunk_size", 65536),
+        )
+        atexit.register(self.media_prefetcher.shutdown)
         self.target_friend = None
-        self.group_info_cache = {}
         self.cache_expiry_time = self.config.get("group_cache_expiry", 3600)
 
         self.tmp_dir = os.path.join(os.getcwd(), 'tmp')
         if not os.path.exists(self.tmp_dir): os.makedirs(self.tmp_dir)
+        self.media_store = MediaStore(self.tmp_dir) if self.config.get("media_dedup", True) and not self.sidecar else None
+        if self.sidecar:
+            fallback_mode = "copy" if self.config.get("media_retention", "link") == "copy" else "link"
+            self.media_retainer = RemoteMediaRetainer(self.sidecar, LocalFallback(lambda: MediaRetainer(self.tmp_dir, fallback_mode)))
+        else: self.media_retainer = MediaRetainer(self.tmp_dir, self.config.get("media_retention", "link"), self.media_store)
+        self._pending_release = collections.deque()  # 移出缓存的媒体文件, 由调度线程删除, 不在收消息的线程里做文件删除
+        self.revoke_journal = None
+        if self.config.get("revoke_journal", False) and self.sidecar: logger.info("[RevocationAndLogger] 使用缓存守护进程时撤回缓存保存在守护进程中, 不写撤回缓存日志")
+        elif self.config.get("revoke_journal", False):
+            try:
+                self.revoke_journal = RevokeJournal(
+                    os.path.join(self.tmp_dir, "revoke_journal"),
+                    segment_bytes=self.config.get("revoke_journal_segment_mb", 4) * 1024 * 1024,
+                    segment_seconds=self.config.get("revoke_journal_segment_seconds", 60),
+                )
+                self.replay_revoke_journal()
+                atexit.register(self.revoke_journal.close)
+            except Exception as e:
+                logger.error(f"[RevocationAndLogger] 初始化撤回缓存日志失败, 重启后将无法恢复缓存: {e}"); self.revoke_journal = None
         self.log_dir = os.path.join(os.getcwd(), self.config.get("chat_log_dir", "chat_logs"))
         if not os.path.exists(self.log_dir):
             try:
@@ -65,7 +125,62 @@ class RevocationAndLogger(Plugin):
                 logger.info(f"[RevocationAndLogger] 创建最后发言记录目录: {self.last_spoken_dir}")
             except Exception as e: logger.error(f"[RevocationAndLogger] 创建最后发言记录目录失败: {e}")
 
-        self.start_cleanup_timer()
+        self.resolver = InfoResolver(
+            self.fetch_group_name, self.fetch_user_names,
+            group_ttl=self.cache_expiry_time,
+            user_ttl=self.config.get("user_cache_expiry", 3600),
+            negative_ttl=self.config.get("name_negative_ttl", 60),
+            batch_window=self.config.get("name_batch_window", 0.02),
+            persist_path=os.path.join(self.log_dir, self.config.get("name_cache_file", "name_cache.json")),
+        )
+        atexit.register(self.resolver.save)
+        new_storage = lambda: create_storage(self.config, self.log_dir, self.last_spoken_dir, self.sanitize_filename, lambda group_id: self.get_group_info(group_id)[0])
+        if self.sidecar: self.storage = RemoteStorage(self.sidecar, lambda group_id: self.get_group_info(group_id)[0], LocalFallback(new_storage))
+        else: self.storage = new_storage()
+        atexit.register(self.storage.close)
+        self.search_index = None
+        if self.sidecar:
+            if self.config.get("search_enabled", True) and self.sidecar.server_info["search"]: self.search_index = RemoteSearchIndex(self.sidecar)
+        elif self.config.get("search_enabled", True):
+            search_db = os.path.join(self.log_dir, self.config.get("search_index_file", "search.db"))
+            try:
+                self.search_index = SearchIndex(search_db, batch_size=self.config.get("sqlite_batch_size", 200), flush_interval=self.config.get("log_flush_interval", 2))
+                atexit.register(self.search_index.close)
+            except sqlite3.Error as e: logger.error(f"[RevocationAndLogger] 初始化搜索索引失败 (需要 SQLite FTS5), 搜索功能不可用: {e}")
+        self.last_spoken_snapshot_interval = self.config.get("last_spoken_snapshot_interval", 10)
+        self.activity_dir = os.path.join(self.log_dir, "activity")
+        if self.sidecar: self.activity = RemoteActivity(self.sidecar, days=self.config.get("activity_days", 30))
+        else: self.activity = ActivityIndex(lambda group_id: os.path.join(self.activity_dir, f"{self.sanitize_filename(group_id)}.json"), days=self.config.get("activity_days", 30))
+        atexit.register(self.activity.snapshot)
+        self.writer_queue = ShardedWriterQueue(
+            workers=self.config.get("writer_threads", 2),
+            queue_size=self.config.get("writer_queue_size", 10000),
+            put_timeout=self.config.get("writer_put_timeout", 0.05),
+        )
+        atexit.register(self.writer_queue.shutdown)
+        self._reported_dropped = 0
+        self.notifier = OutboundNotifier(
+            self.send_notification,
+            workers=self.config.get("notify_workers", 2),
+            rate=self.config.get("notify_rate", 1.0),
+            burst=self.config.get("notify_burst", 5),
+            max_retries=self.config.get("notify_max_retries", 3),
+            retry_base=self.config.get("notify_retry_base", 2),
+            digest_threshold=self.config.get("notify_digest_threshold", 5),
+            digest_window=self.config.get("notify_digest_window", 10),
+            queue_size=self.config.get("notify_queue_size", 1000),
+        )
+        atexit.register(self.notifier.shutdown)
+        self._reported_notify_failures = 0
+        self.metrics.add_collector(self.collect_metrics)
+
+        self.cache_policy = None; self._cache_policy_key = None
+        self.apply_cache_policy(self.config)
+
+        self.scheduler = Scheduler(observe=lambda name, seconds: self.metrics.observe(f"job:{name}", seconds))
+        self.start_periodic_jobs()
+        atexit.register(self.release_tmp_files)
+        atexit.register(self.scheduler.shutdown)  # 后进先出: 先停调度线程, 再关闭队列和存储
 
         self.gewechat_channel = None
         if GeWeChatChannel:
@@ -77,6 +192,7 @@ class RevocationAndLogger(Plugin):
         else:
                 logger.warning("[RevocationAndLogger] GeWeChatChannel 未导入或初始化失败，无法使用gewechat特定功能 (如获取用户名/群名)。")
 
+        self.media_size_pattern = re.compile(r'(?:\blength="|<totallen>)(\d+)')
         self.quote_pattern = re.compile(r"^「(.+?)\s*:\s*<msg>.*?</msg>\s*」\s*[-—]+\s*(.*)$", re.DOTALL)
 
         self.command_trigger = self.config.get("last_spoken_command", "最后信息").strip()
@@ -84,6 +200,12 @@ class RevocationAndLogger(Plugin):
             logger.warning("[RevocationAndLogger] 未配置最后发言查询命令 (last_spoken_command)，将使用默认值 '最后信息'")
             self.command_trigger = "最后信息"
         logger.info(f"[RevocationAndLogger] 最后发言记录查询命令: '{self.command_trigger}'")
+        self.search_trigger = self.config.get("search_command", "搜索记录").strip() or "搜索记录"
+        logger.info(f"[RevocationAndLogger] 聊天记录搜索命令: '{self.search_trigger}'")
+        self.activity_trigger = self.config.get("activity_command", "群活跃").strip() or "群活跃"
+        logger.info(f"[RevocationAndLogger] 群活跃统计命令: '{self.activity_trigger}'")
+        self.metrics_trigger = self.config.get("metrics_command", "插件状态").strip() or "插件状态"
+        self.metrics_admins = set(self.config.get("metrics_admins", []))
 
     def _load_config_template(self):
         logger.debug("[RevocationAndLogger] 未找到配置文件，使用模板")
@@ -93,8 +215,70 @@ class RevocationAndLogger(Plugin):
             "cleanup_interval": 60,
             "chat_log_dir": "chat_logs",
             "last_spoken_command": "最后信息",
+            "search_command": "搜索记录",
             "group_cache_expiry": 3600,
-            "download_timeout": 20
+            "download_timeout": 20,
+            "log_max_open_files": 64,
+            "log_flush_lines": 50,
+            "log_flush_interval": 2,
+            "writer_threads": 2,
+            "writer_queue_size": 10000,
+            "writer_put_timeout": 0.05,
+            "last_spoken_snapshot_interval": 10,
+            "storage_engine": "text",
+            "sqlite_file": "chat_logs.db",
+            "sqlite_batch_size": 200,
+            "cache_max_entries": 10000,
+            "cache_max_mb": 512,
+            "media_prefetch_workers": 4,
+            "media_prefetch_wait": 10,
+            "download_chunk_size": 65536,
+            "media_retention": "link",
+            "media_dedup": True,
+            "last_spoken_page_size": 30,
+            "last_spoken_max_pages": 3,
+            "user_cache_expiry": 3600,
+            "name_negative_ttl": 60,
+            "name_batch_window": 0.02,
+            "name_cache_file": "name_cache.json",
+            "log_rotation": "none",
+            "log_compression": "gzip",
+            "log_retention_days": 0,
+            "log_retention_mb": 0,
+            "log_archive_interval": 600,
+            "search_enabled": True,
+            "search_index_file": "search.db",
+            "search_page_size": 10,
+            "debug_cache_dump": False,
+            "notify_workers": 2,
+            "notify_rate": 1.0,
+            "notify_burst": 5,
+            "notify_max_retries": 3,
+            "notify_retry_base": 2,
+            "notify_digest_threshold": 5,
+            "notify_digest_window": 10,
+            "notify_queue_size": 1000,
+            "revoke_journal": False,
+            "revoke_journal_segment_mb": 4,
+            "revoke_journal_segment_seconds": 60,
+            "verbose_logging": False,
+            "metrics_command": "插件状态",
+            "metrics_admins": [],
+            "metrics_textfile": "",
+            "metrics_interval": 60,
+            "scheduler_jitter": 0.1,
+            "tmp_sweep_interval": 3600,
+            "tmp_max_age": 86400,
+            "activity_command": "群活跃",
+            "activity_days": 30,
+            "activity_top": 10,
+            "activity_snapshot_interval": 300,
+            "cache_policy": {"allow": [], "deny": [], "ttl": {}, "max_mb": {}, "rules": []},
+            "cache_policy_reload_interval": 30,
+            "sidecar_socket": "",
+            "sidecar_autostart": True,
+            "sidecar_timeout": 5,
+            "sidecar_dedupe_ttl": 3600
         }
         try:
             plugin_config_path = os.path.join(self.path, "config.json.template")
@@ -115,6 +299,10 @@ class RevocationAndLogger(Plugin):
         help_text += "2. 将接收到的群聊消息按 群聊ID.txt 格式保存文件。\n"
         help_text += "3. 记录每个群成员的最后发言时间。\n"
         help_text += f"4. 在群聊中发送 '{self.command_trigger}' 可获取该群成员最后发言时间的文本记录。\n"
+        help_text += f"   也可以带参数分页查询，如 '{self.command_trigger} 前20'、'{self.command_trigger} 30天'、'{self.command_trigger} 30天 第2页'、'{self.command_trigger} 最新'。\n"
+        help_text += f"   发送 '{self.search_trigger} 关键词' 可搜索本群聊天记录，可加 '@昵称'、'N天'、'2024-01-01~2024-01-31'、'第N页' 筛选。\n"
+        help_text += f"   发送 '{self.activity_trigger}' 可查看本群近{self.activity.days}天的消息量、最活跃时段、发言最多的成员和消息类型占比。\n"
+        help_text += f"   管理员 (metrics_admins) 发送 '{self.metrics_trigger}' 可查看插件运行状态，包括队列、缓存和各阶段耗时等指标。\n"
         help_text += "5. 首次记录某群聊时，会在文件开头写入群名和ID。\n"
         help_text += f"6. 聊天记录默认保存在: '{self.config.get('chat_log_dir', 'chat_logs')}' 文件夹。\n"
         help_text += f"7. 最后发言记录在上述目录下的 'last_spoken' 子文件夹中。\n"
@@ -123,37 +311,15 @@ class RevocationAndLogger(Plugin):
         return help_text
 
     def sanitize_filename(self, name):
-        if not name: return f"unknown_{str(uuid.uuid4())[:8]}"
-        name = re.sub(r'[\\/*?:"<>|]+', '_', name)
-        name = name.strip('. ')
-        name = re.sub(r'[\s_]+', '_', name)
-        if not name: return f"unknown_{str(uuid.uuid4())[:8]}"
-        return name
-
-    def log_group_message(self, msg: ChatMessage):
-        file_name = ""
+        return sanitize_filename(name)
+
+    @instrument("build_log_record")
+    def build_log_record(self, msg: ChatMessage):
         group_id_str = msg.from_user_id if msg else 'N/A'
         try:
-            if msg.ctype == ContextType.REVOKE: return
+            if msg.ctype == ContextType.REVOKE: return None
             group_id = msg.from_user_id
-            if not group_id: logger.warning("[RevocationAndLogger] 无法获取群聊ID，跳过记录"); return
-
-            safe_group_id_filename = self.sanitize_filename(group_id)
-            file_name = f"{safe_group_id_filename}.txt"
-            log_file_path = os.path.join(self.log_dir, file_name)
-
-            write_header = not os.path.exists(log_file_path)
-            header_content = ""
-            if write_header:
-                try:
-                    group_name, _ = self.get_group_info(group_id)
-                    header_content += f"# 群聊名称: {group_name if group_name else '未能获取'}\n"
-                    header_content += f"# 群聊 ID: {group_id}\n"
-                    header_content += f"# 文件创建时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-                    header_content += "---\n"
-                except Exception as header_e:
-                    logger.error(f"[RevocationAndLogger] 获取群名或生成文件头失败 (GroupID: {group_id}): {header_e}")
-                    write_header = False
+            if not group_id: logger.warning("[RevocationAndLogger] 无法获取群聊ID，跳过记录"); return None
 
             sender_nickname = msg.actual_user_nickname or msg.actual_user_id or "未知成员"
             try:
@@ -201,45 +367,57 @@ class RevocationAndLogger(Plugin):
                 content = msg.content.strip().replace('\n',' ')[:50] if isinstance(msg.content, str) else ""; content_to_log = f"[系统消息: {content}...]" if content else "[系统消息]"
             else: content_to_log = f"[未知类型: {msg.ctype.name}]"
 
-            log_line = f"{timestamp_str} 【{sender_nickname}】{content_to_log}\n"
-            try:
-                mode = 'w' if write_header else 'a'
-                with open(log_file_path, mode, encoding='utf-8') as f:
-                    if write_header: f.write(header_content)
-                    f.write(log_line)
-            except IOError as io_err: logger.error(f"[RevocationAndLogger] 写入日志文件IO错误 (File: {file_name}): {io_err}")
+            return GroupLogRecord(group_id, timestamp_str, sender_nickname, content_to_log)
+        except Exception as e:
+            logger.error(f"[RevocationAndLogger] 生成群聊记录失败 (GroupID: {group_id_str}): {e}")
+            logger.error(f"[RevocationAndLogger] 错误详情: {traceback.format_exc()}")
+            return None
+
+    @instrument("write_log_record")
+    def write_log_record(self, record: GroupLogRecord):
+        try: self.storage.append_log(record)
         except Exception as e:
-            logger.error(f"[RevocationAndLogger] 记录群聊消息失败 (GroupID: {group_id_str}, FileName: {file_name}): {e}")
+            logger.error(f"[RevocationAndLogger] 记录群聊消息失败 (GroupID: {record.group_id}): {e}")
             logger.error(f"[RevocationAndLogger] 错误详情: {traceback.format_exc()}")
+        if self.search_index:
+            try: self.search_index.add(record)
+            except Exception as e: logger.error(f"[RevocationAndLogger] 更新搜索索引失败 (GroupID: {record.group_id}): {e}")
 
+    @instrument("update_last_spoken_time")
     def update_last_spoken_time(self, group_id: str, nickname: str, timestamp_str: str):
         if not group_id or not nickname: logger.warning(f"[RevocationAndLogger] update_last_spoken_time: 无效的 group_id 或 nickname ({group_id}, {nickname})"); return
         if not hasattr(self, 'last_spoken_dir') or not self.last_spoken_dir: logger.error("[RevocationAndLogger] last_spoken_dir 未初始化"); return
-        os.makedirs(self.last_spoken_dir, exist_ok=True)
-
-        file_name = f"{self.sanitize_filename(group_id)}-最后发言.txt"
-        file_path = os.path.join(self.last_spoken_dir, file_name)
-        search_prefix = f"【{nickname}】"; new_line = f"{search_prefix}{timestamp_str}\n"
-        lines = []; found = False; content_changed = False
-        try:
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f: lines = f.readlines()
-            except FileNotFoundError: content_changed = True; pass
-            output_lines = []
-            for line in lines:
-                if line.startswith(search_prefix):
-                    found = True
-                    if line.strip() != new_line.strip(): output_lines.append(new_line); content_changed = True
-                    else: output_lines.append(line)
-                else: output_lines.append(line)
-            if not found: output_lines.append(new_line); content_changed = True
-            if content_changed:
-                with open(file_path, 'w', encoding='utf-8') as f: f.writelines(output_lines)
-        except IOError as e: logger.error(f"[RevocationAndLogger] 读写最后发言文件失败 (File: {file_path}): {e}")
+        try: self.storage.update_last_spoken(group_id, nickname, timestamp_str)
         except Exception as e:
-            logger.error(f"[RevocationAndLogger] 更新最后发言时间时发生未知错误 (File: {file_path}): {e}")
+            logger.error(f"[RevocationAndLogger] 更新最后发言时间时发生未知错误 (GroupID: {group_id}): {e}")
             logger.error(f"[RevocationAndLogger] 错误详情: {traceback.format_exc()}")
 
+    def connect_sidecar(self):
+        # 连接本地缓存守护进程, 与同一台机器上的其他实例共用撤回缓存、tmp 媒体文件和聊天记录写入; 连接不上时使用本进程内的缓存和存储
+        socket_path = os.path.join(os.getcwd(), self.config.get("sidecar_socket"))
+        paths = {"log_dir": os.path.join(os.getcwd(), self.config.get("chat_log_dir", "chat_logs")), "tmp_dir": os.path.join(os.getcwd(), 'tmp')}
+        autostart = (lambda: start_daemon(socket_path, __package__)) if self.config.get("sidecar_autostart", True) else None
+        client = SidecarClient(socket_path, self.config, paths, timeout=self.config.get("sidecar_timeout", 5), autostart=autostart)
+        try: info = client.connect()
+        except SidecarError as e: logger.error(f"[RevocationAndLogger] {e}, 使用本进程内的缓存和存储"); return None
+        logger.info(f"[RevocationAndLogger] 已连接缓存守护进程 (PID {info['pid']}): {socket_path}, 聊天记录目录 {info['log_dir']}")
+        atexit.register(client.close)
+        return client
+
+    def claim_message(self, msg: ChatMessage):
+        # 多个实例在同一个群里时, 同一条消息只由最先收到的实例记录和缓存
+        # 守护进程不可用时按新消息处理, 记录和缓存自动改用本进程内的存储 (这期间各实例可能重复记录); 不可用和恢复时各输出一次日志
+        if not msg.msg_id: return True
+        try: claimed = self.sidecar.claim(str(msg.msg_id))
+        except SidecarError as e:
+            self.metrics.inc("sidecar_unavailable")
+            if not self._sidecar_down: self._sidecar_down = True; logger.error(f"[RevocationAndLogger] {e}, 暂时在本进程内记录和缓存消息")
+            return True
+        except RuntimeError as e: logger.error(f"[RevocationAndLogger] 消息去重失败, 按新消息处理 ({msg.msg_id}): {e}"); return True
+        if self._sidecar_down: self._sidecar_down = False; logger.info("[RevocationAndLogger] 已重新连接缓存守护进程")
+        if not claimed: self.metrics.inc("sidecar_duplicates")
+        return claimed
+
     def get_revoke_msg_receiver(self):
         if self.target_friend is None:
             receiver_config = self.config.get("receiver", {}); match_name = receiver_config.get("name", "filehelper")
@@ -247,94 +425,203 @@ class RevocationAndLogger(Plugin):
             self.target_friend = { 'UserName': match_name, 'protocol': 'gewechat' }
         return self.target_friend
 
-    def start_cleanup_timer(self):
-        def delete_out_date_msg():
+    def start_periodic_jobs(self):
+        # 所有周期任务注册到同一个调度线程, 依次运行; 各任务的耗时记入 job:<名称> 指标
+        cleanup_interval = self.config.get("cleanup_interval", 60); jitter = self.config.get("scheduler_jitter", 0.1)
+        jobs = [("cache_expire", self.expire_cache, cleanup_interval, "skip"),
+                ("tmp_release", self.release_tmp_files, cleanup_interval, "skip"),
+                ("log_flush", self.flush_logs, self.config.get("log_flush_interval", 2), "delay"),
+                ("journal_compact", self.compact_revoke_journal, cleanup_interval, "skip"),
+                ("log_archive", self.storage.maintain, cleanup_interval, "skip"),
+                ("snapshot", self.save_snapshots, self.last_spoken_snapshot_interval or cleanup_interval, "delay"),
+                ("activity_snapshot", self.activity.snapshot, self.config.get("activity_snapshot_interval", 300), "delay"),
+                ("queue_health", self.check_queue_health, cleanup_interval, "skip")]
+        if self.config.get("cache_policy_reload_interval", 30) > 0: jobs.append(("policy_reload", self.reload_cache_policy, self.config.get("cache_policy_reload_interval", 30), "skip"))
+        if self.config.get("tmp_sweep_interval", 3600) > 0 and not self.sidecar: jobs.append(("tmp_sweep", self.sweep_tmp_dir, self.config.get("tmp_sweep_interval", 3600), "skip"))
+        if self.metrics_textfile: jobs.append(("metrics_textfile", lambda: self.metrics.write_textfile(self.metrics_textfile), self.metrics_interval, "skip"))
+        for name, fn, interval, overrun in jobs: self.scheduler.add(name, fn, interval, jitter=jitter, overrun=overrun, delay=min(1, interval))
+        logger.info(f"[RevocationAndLogger] 启动周期任务调度: {', '.join(name for name, *_ in jobs)}")
+
+    def expire_cache(self):
+        if self.msg_cache.expire(): logger.debug(f"[RevocationAndLogger] 消息缓存状态: {self.msg_cache.stats()}")
+
+    def flush_logs(self):
+        self.storage.flush_due()
+        if self.search_index: self.search_index.flush_due()
+
+    def compact_revoke_journal(self):
+        if self.revoke_journal and self.revoke_journal.compact(): logger.debug(f"[RevocationAndLogger] 撤回缓存日志状态: {self.revoke_journal.stats()}")
+
+    def save_snapshots(self):
+        self.storage.snapshot(); self.resolver.save()
+
+    def check_queue_health(self):
+        queue_stats = self.writer_queue.stats()
+        if queue_stats["dropped"] > self._reported_dropped:
+            logger.warning(f"[RevocationAndLogger] 写入队列累计丢弃 {queue_stats['dropped']} 条记录 (当前积压: {queue_stats['depth']}, 最大积压: {queue_stats['max_depth']})")
+            self._reported_dropped = queue_stats["dropped"]
+        notify_stats = self.notifier.stats(); failures = notify_stats["failed"] + notify_stats["dropped"]
+        if failures > self._reported_notify_failures:
+            logger.warning(f"[RevocationAndLogger] 撤回通知累计发送失败 {notify_stats['failed']} 条, 丢弃 {notify_stats['dropped']} 条 (队列状态: {notify_stats})")
+            self._reported_notify_failures = failures
+        elif notify_stats["enqueued"]: logger.debug(f"[RevocationAndLogger] 撤回通知队列状态: {notify_stats}")
+
+    def apply_cache_policy(self, config):
+        # 编译 cache_policy; 配置没有变化时不重新编译, 配置有误时保留当前策略
+        section = config.get("cache_policy") or {}; key = json.dumps([section, config.get("message_expire_time", 120)], sort_keys=True, ensure_ascii=False)
+        if key == self._cache_policy_key: return False
+        self._cache_policy_key = key
+        try: policy = CachePolicy(section, config.get("message_expire_time", 120))
+        except (TypeError, ValueError, AttributeError) as e:
+            logger.error(f"[RevocationAndLogger] 缓存策略 cache_policy 配置有误, {'继续使用原策略' if self.cache_policy else '使用默认策略'}: {e}")
+            if self.cache_policy is None: self.cache_policy = CachePolicy({}, config.get("message_expire_time", 120))
+            return False
+        reloaded = self.cache_policy is not None; self.cache_policy = policy
+        logger.info(f"[RevocationAndLogger] {'已重新加载' if reloaded else '使用'}缓存策略: {policy.describe()}")
+        return True
+
+    def reload_cache_policy(self):
+        # 定期重新读取配置文件, 修改 cache_policy 后不用重启即可生效
+        config = super().load_config()
+        if config: self.apply_cache_policy(config)
+
+    def count_policy_skip(self, policy, ctype_name, reason, size=0, download=False):
+        # 按策略统计没有缓存的消息, 以及因此省下的下载次数和字节数 (大小已知时)
+        self.metrics.inc("policy_skipped", policy=policy, ctype=ctype_name, reason=reason)
+        if download: self.metrics.inc("policy_downloads_avoided", policy=policy)
+        if size > 0: self.metrics.inc("policy_bytes_avoided", size, policy=policy)
+
+    def media_size_hint(self, msg: ChatMessage):
+        # 下载前从消息 XML 中读取媒体大小 (图片/视频/语音的 length, 文件的 totallen), 没有时返回 0
+        data = getattr(msg, 'msg_data', None); content = data.get('Content') if isinstance(data, dict) else None
+        if isinstance(content, dict): content = content.get('string')
+        match = self.media_size_pattern.search(content) if isinstance(content, str) else None
+        return int(match.group(1)) if match else 0
+
+    def release_tmp_files(self):
+        while self._pending_release: self.media_retainer.release(self._pending_release.popleft())
+
+    def sweep_tmp_dir(self):
+        # 删除 tmp 目录顶层长时间未被缓存引用的文件: 下载后已不再需要的原文件、重启前遗留的副本和媒体文件等
+        max_age = max(self.config.get("tmp_max_age", 86400), self.cache_policy.max_ttl + self.config.get("tmp_sweep_interval", 3600))
+        referenced = set()
+        for cached_msg in self.msg_cache.values():
+            value = cached_msg.tmp_path
+            if isinstance(value, Future): value = value.result() if value.done() and not value.cancelled() and value.exception() is None else None
+            for path in ((value.path, value.materialized) if isinstance(value, MediaRef) else (value,)):
+                if path: referenced.add(os.path.abspath(path))
+        removed = sweep_tmp(self.tmp_dir, referenced, max_age, self.media_store)
+        if removed: logger.info(f"[RevocationAndLogger] 清理 tmp 目录中 {removed} 个超过 {max_age} 秒未被引用的文件")
+
+    def journal_cached(self, keys, cached_msg: CachedMessage, expire_at, size, tmp_path=None):
+        if not self.revoke_journal: return
+        if isinstance(tmp_path, MediaRef): tmp_path = ["ref", tmp_path.path, tmp_path.size, tmp_path.mtime_ns]
+        try:
+            self.revoke_journal.append(expire_at, [keys, cached_msg.msg_id, cached_msg.ctype.name, cached_msg.content, cached_msg.from_user_id,
+                                                   cached_msg.actual_user_id, cached_msg.actual_user_nickname, cached_msg.create_time, tmp_path, size])
+        except Exception as e: logger.error(f"[RevocationAndLogger] 写入撤回缓存日志失败 ({cached_msg.msg_id}): {e}")
+
+    def replay_revoke_journal(self):
+        started = time.time(); restored = 0
+        media_types = (ContextType.IMAGE, ContextType.VIDEO, ContextType.FILE, ContextType.VOICE)
+        for expire_at, row in self.revoke_journal.replay():
             try:
-                current_time = time.time(); expire_time_secs = self.config.get("message_expire_time", 120); expired_ids = []
-                for msg_id, msg_info in list(self.msg_dict.items()):
-                    stored_msg = msg_info[0] if isinstance(msg_info, tuple) else msg_info
-                    if not hasattr(stored_msg, 'create_time'): continue
-                    try:
-                        ts = stored_msg.create_time; msg_timestamp = ts.timestamp() if isinstance(ts, datetime) else float(ts)
-                        if (current_time - msg_timestamp) > expire_time_secs: expired_ids.append(msg_id)
-                    except Exception as ts_err: logger.warning(f"[RevocationAndLogger] 清理缓存时处理时间戳错误 for msg_id {msg_id}: {ts_err}"); continue
-                removed_count = 0
-                for msg_id in expired_ids:
-                    if msg_id in self.msg_dict:
-                        msg_info = self.msg_dict.pop(msg_id); removed_count += 1
-                        if isinstance(msg_info, tuple):
-                            _, file_path = msg_info
-                            if file_path and os.path.exists(file_path):
-                                try: os.remove(file_path)
-                                except Exception as e: logger.error(f"[RevocationAndLogger] 删除过期临时文件失败: {file_path}, Error: {e}")
-            except Exception as e: logger.error(f"[RevocationAndLogger] 缓存清理任务出错: {e}"); logger.error(f"[RevocationAndLogger] 错误详情: {traceback.format_exc()}")
-            finally:
-                interval = self.config.get("cleanup_interval", 60); cleanup_timer = Timer(interval, delete_out_date_msg); cleanup_timer.daemon = True; cleanup_timer.start()
-        logger.info("[RevocationAndLogger] 启动消息缓存清理定时器..."); initial_timer = Timer(1, delete_out_date_msg); initial_timer.daemon = True; initial_timer.start()
+                keys, msg_id, ctype_name, content, from_user_id, actual_user_id, actual_user_nickname, create_time, tmp_path, size = row
+                ctype = ContextType[ctype_name]
+                if isinstance(tmp_path, list): tmp_path = MediaRef(*tmp_path[1:])
+                elif tmp_path and self.media_store and self.media_store.is_blob(tmp_path):
+                    if not self.media_store.adopt(tmp_path): tmp_path = None
+                elif tmp_path and not os.path.exists(tmp_path): tmp_path = None
+                if ctype in media_types and not tmp_path: continue  # 媒体文件已被删除, 无法再还原
+                self.msg_cache.put(keys, CachedMessage(msg_id, ctype, content, from_user_id, actual_user_id, actual_user_nickname, create_time, tmp_path), expire_at, size)
+                restored += 1
+            except (ValueError, KeyError, TypeError) as e: logger.debug(f"[RevocationAndLogger] 跳过无法解析的撤回缓存日志记录: {e}")
+        logger.info(f"[RevocationAndLogger] 从撤回缓存日志恢复 {restored} 条消息, 用时 {(time.time() - started) * 1000:.0f}ms ({self.revoke_journal.stats()})")
+
+    def on_cache_evict(self, cached_msg: CachedMessage):
+        if isinstance(cached_msg.tmp_path, Future) and cached_msg.tmp_path.cancel(): return
+        MediaPrefetcher.when_ready(cached_msg.tmp_path, self._pending_release.append)
 
     def copy_to_tmp(self, file_path):
+        # 按 media_retention 模式保留文件: 返回 tmp 路径, reference 模式下返回 MediaRef
         try:
             if not file_path or not os.path.exists(file_path): logger.warning(f"[RevocationAndLogger] File not found for copying to tmp: {file_path}"); return None
-            ext = os.path.splitext(file_path)[1]; base_name = os.path.basename(file_path)
-            unique_name = f"{os.path.splitext(base_name)[0]}_{str(uuid.uuid4())[:8]}{ext}"; target_path = os.path.join(self.tmp_dir, unique_name)
-            shutil.copy2(file_path, target_path); return target_path
+            return self.media_retainer.retain(file_path)
         except Exception as e: logger.error(f"[RevocationAndLogger] 复制文件到tmp失败: {e}"); return None
 
-    def download_files(self, msg: ChatMessage):
+    @instrument("download_files", expected=MediaTooLarge)  # 在媒体缓存线程里执行, 沿用原来 download_files 的阶段名; 超过大小上限不算错误
+    def fetch_media(self, file_path, url, max_bytes=0):
         try:
-            file_path = msg.content
             if isinstance(file_path, str) and file_path and os.path.exists(file_path): return file_path
-            if hasattr(msg, 'url') and msg.url and isinstance(msg.url, str):
-                logger.info(f"[RevocationAndLogger] Attempting to download file from URL: {msg.url}")
+            if url and isinstance(url, str):
+                self.log_detail(f"[RevocationAndLogger] Attempting to download file from URL: {url}")
                 try: import requests
                 except ImportError: logger.error("[RevocationAndLogger] 下载文件需要 'requests' 库"); return None
                 try:
-                    response = requests.get(msg.url, timeout=self.config.get("download_timeout", 20)); response.raise_for_status()
-                    url_ext=os.path.splitext(msg.url)[1]; orig_path_ext=os.path.splitext(file_path if isinstance(file_path, str) else "")[1]; ext = url_ext or orig_path_ext or ".dat"
+                    url_ext=os.path.splitext(url)[1]; orig_path_ext=os.path.splitext(file_path if isinstance(file_path, str) else "")[1]; ext = url_ext or orig_path_ext or ".dat"
                     orig_basename = os.path.basename(file_path) if isinstance(file_path, str) and file_path else None; name = orig_basename or f"dl_{str(uuid.uuid4())[:8]}{ext}"; safe_name = self.sanitize_filename(name)
                     os.makedirs(self.tmp_dir, exist_ok=True); target_path = os.path.join(self.tmp_dir, safe_name); counter=0; base_target = target_path
                     while os.path.exists(target_path): counter+=1; fn, fext = os.path.splitext(base_target); target_path = f"{fn}_{counter}{fext}"
-                    with open(target_path, 'wb') as f: f.write(response.content); logger.info(f"[RevocationAndLogger] 文件下载成功: {target_path}")
-                    msg.content = target_path; return target_path
-                except requests.exceptions.RequestException as e: logger.error(f"[RevocationAndLogger] 下载文件失败 (URL: {msg.url}): {e}"); return None
-                except Exception as e: logger.error(f"[RevocationAndLogger] 下载或保存文件时出错 (URL: {msg.url}): {e}"); return None
+                    self.media_prefetcher.download(url, target_path, max_bytes); self.log_detail(f"[RevocationAndLogger] 文件下载成功: {target_path}")
+                    return target_path
+                except MediaTooLarge: raise
+                except requests.exceptions.RequestException as e: logger.error(f"[RevocationAndLogger] 下载文件失败 (URL: {url}): {e}"); return None
+                except Exception as e: logger.error(f"[RevocationAndLogger] 下载或保存文件时出错 (URL: {url}): {e}"); return None
             else: return None
-        except Exception as e: logger.error(f"[RevocationAndLogger] download_files 处理异常: {e}"); return None
+        except MediaTooLarge: raise
+        except Exception as e: logger.error(f"[RevocationAndLogger] fetch_media 处理异常: {e}"); return None
+
+    @instrument("prefetch_media")
+    def prefetch_media(self, msg_id_str, ctype_name, file_path, url, policy=None, max_bytes=0):
+        try: local_path = self.fetch_media(file_path, url, max_bytes)
+        except MediaTooLarge as e:
+            self.log_detail(f"[RevocationAndLogger] 媒体文件超过缓存策略 '{policy}' 的大小上限，跳过缓存: {msg_id_str} ({ctype_name}): {e}")
+            self.count_policy_skip(policy, ctype_name, "too_large", e.size - e.received if e.size else 0); return None
+        if not local_path: logger.warning(f"[RevocationAndLogger] 无法获取文件路径，跳过缓存: {msg_id_str} ({ctype_name})"); return None
+        if max_bytes:
+            size = MediaRetainer.size_of(local_path)
+            if size > max_bytes:
+                self.log_detail(f"[RevocationAndLogger] 媒体文件 {size} 字节超过缓存策略 '{policy}' 的大小上限，跳过缓存: {msg_id_str} ({ctype_name})")
+                self.count_policy_skip(policy, ctype_name, "too_large", size); return None
+        tmp_path = self.copy_to_tmp(local_path)
+        if not tmp_path: logger.warning(f"[RevocationAndLogger] 无法复制文件到tmp，跳过缓存: {msg_id_str} ({ctype_name})"); return None
+        return tmp_path
+
+    def on_media_prefetched(self, msg_id_str, future, cache_keys=None, cached_msg=None, expire_at=None):
+        tmp_path = None if future.cancelled() or future.exception() is not None else future.result()
+        if not tmp_path: self.msg_cache.pop(msg_id_str); return
+        size = MediaRetainer.size_of(tmp_path)
+        self.msg_cache.update_size(msg_id_str, size)
+        # 只有写撤回缓存日志时才需要确认条目还在 (共享缓存模式下不写日志, 也省掉一次到守护进程的往返)
+        if cached_msg is not None and self.revoke_journal and msg_id_str in self.msg_cache: self.journal_cached(cache_keys, cached_msg, expire_at, size, tmp_path)
 
     def get_user_info(self, user_id):
-        try:
-            if not self.gewechat_channel or not hasattr(self.gewechat_channel, 'client') or not self.gewechat_channel.client: return user_id
-            client = self.gewechat_channel.client; app_id = self.gewechat_channel.app_id
-            if not app_id: return user_id
-            method_name = 'getBriefInfo' if hasattr(client,'getBriefInfo') else 'get_brief_info'
-            if not hasattr(client, method_name): logger.warning(f"[RevocationAndLogger] gewechat client missing user info method: {method_name}"); return user_id
-            api_method = getattr(client, method_name); res = api_method(app_id, [user_id])
-            if res and res.get('ret') == 200 and res.get('data') and isinstance(res['data'], list) and len(res['data']) > 0:
-                info = res['data'][0]; name = info.get('remark') or info.get('nickName')
-                if name: return name
-            return user_id
-        except Exception as e: logger.error(f"[RevocationAndLogger] 获取用户信息 API 调用失败 for {user_id}: {e}"); return user_id
+        return self.resolver.user_name(user_id) or user_id
+
+    def fetch_user_names(self, user_ids):
+        if not self.gewechat_channel or not hasattr(self.gewechat_channel, 'client') or not self.gewechat_channel.client: return {}
+        client = self.gewechat_channel.client; app_id = self.gewechat_channel.app_id
+        if not app_id: return {}
+        method_name = 'getBriefInfo' if hasattr(client,'getBriefInfo') else 'get_brief_info'
+        if not hasattr(client, method_name): logger.warning(f"[RevocationAndLogger] gewechat client missing user info method: {method_name}"); return {}
+        res = self.call_gewechat(method_name, list(user_ids)); names = {}
+        if res and res.get('ret') == 200 and isinstance(res.get('data'), list):
+            for i, info in enumerate(res['data']):
+                if not isinstance(info, dict): continue
+                user_id = info.get('userName') or (user_ids[i] if i < len(user_ids) else None); name = info.get('remark') or info.get('nickName')
+                if user_id and name: names[user_id] = name
+        return names
 
+    @instrument("handle_revoke")
     def handle_revoke(self, msg: ChatMessage, is_group=False):
-        logger.info(f"[RevocationAndLogger V1.0] Processing revoke message (Group: {is_group})...")
+        self.log_detail(f"[RevocationAndLogger V1.0] Processing revoke message (Group: {is_group})...")
         revoke_xml_content = msg.content if isinstance(msg.content, str) else ""
 
-        revoked_msg_id_attr = str(getattr(msg, 'revoked_msg_id', ''))
-        msgid_xml = None
-        newmsgid_xml = None
-        possible_ids = []
+        notice = None; possible_ids = []
 
         try:
-            if revoke_xml_content:
-                msgid_match = re.search(r"<msgid>(.*?)</msgid>", revoke_xml_content)
-                if msgid_match: msgid_xml = str(msgid_match.group(1))
-                newmsgid_match = re.search(r"<newmsgid>(.*?)</newmsgid>", revoke_xml_content)
-                if newmsgid_match: newmsgid_xml = str(newmsgid_match.group(1))
-
-            if revoked_msg_id_attr: possible_ids.append(revoked_msg_id_attr)
-            if newmsgid_xml and newmsgid_xml not in possible_ids: possible_ids.append(newmsgid_xml)
-            if msgid_xml and msgid_xml not in possible_ids: possible_ids.append(msgid_xml)
-
+            notice = parse_revoke(revoke_xml_content)
+            possible_ids = candidate_ids(notice, getattr(msg, 'revoked_msg_id', None))
         except Exception as e:
             logger.error(f"[RevocationAndLogger V1.0] Error parsing revoke message IDs from XML: {e}")
 
@@ -342,22 +629,17 @@ class RevocationAndLogger(Plugin):
             logger.error("[RevocationAndLogger V1.0] Failed to extract any potential revoked message ID.")
             return
 
-        logger.info(f"[RevocationAndLogger V1.0] Possible revoked IDs: {possible_ids}. Cache keys: {list(self.msg_dict.keys())}")
+        self.log_detail(f"[RevocationAndLogger V1.0] Possible revoked IDs: {possible_ids}")
+        if self.config.get("debug_cache_dump", False): logger.info(f"[RevocationAndLogger V1.0] Cache keys: {self.msg_cache.keys()}")
 
-        found_msg_info = None
-        found_id = None
-        for try_id in possible_ids:
-            if try_id in self.msg_dict:
-                found_msg_info = self.msg_dict[try_id]
-                found_id = try_id
-                logger.info(f"[RevocationAndLogger V1.0] Found original message in cache using ID: {found_id}")
-                break
+        found_id, found_msg_info = self.msg_cache.find(possible_ids)
+        if found_msg_info: self.log_detail(f"[RevocationAndLogger V1.0] Found original message in cache using ID: {found_id}")
 
         if not found_msg_info:
             logger.warning(f"[RevocationAndLogger V1.0] Original message not found in cache for IDs: {possible_ids}")
             return
 
-        original_msg, tmp_file_path = found_msg_info if isinstance(found_msg_info, tuple) else (found_msg_info, None)
+        original_msg = found_msg_info; tmp_file_path = self.media_retainer.materialize(MediaPrefetcher.resolve(original_msg.tmp_path, self.config.get("media_prefetch_wait", 10)))
         target = self.get_revoke_msg_receiver()
         if not target:
             logger.error("[RevocationAndLogger V1.0] Cannot get revoke message receiver config.")
@@ -386,209 +668,372 @@ class RevocationAndLogger(Plugin):
                 if hasattr(original_msg, 'actual_user_nickname') and original_msg.actual_user_nickname:
                     actual_name = original_msg.actual_user_nickname
                     revoker_id = getattr(original_msg, 'actual_user_id', None)
-                    logger.info(f"[RevocationAndLogger V1.0] Got revoker from original_msg: {actual_name} (ID: {revoker_id})")
+                    self.log_detail(f"[RevocationAndLogger V1.0] Got revoker from original_msg: {actual_name} (ID: {revoker_id})")
                 elif hasattr(original_msg, 'actual_user_id') and original_msg.actual_user_id:
                     revoker_id = original_msg.actual_user_id
-                    logger.info(f"[RevocationAndLogger V1.0] Got revoker ID from original_msg: {revoker_id}, looking up name...")
+                    self.log_detail(f"[RevocationAndLogger V1.0] Got revoker ID from original_msg: {revoker_id}, looking up name...")
                     actual_name_lookup = self.get_user_info(revoker_id)
                     if actual_name_lookup != revoker_id:
                         actual_name = actual_name_lookup
-                        logger.info(f"[RevocationAndLogger V1.0] Looked up revoker name: {actual_name}")
+                        self.log_detail(f"[RevocationAndLogger V1.0] Looked up revoker name: {actual_name}")
                     else:
                         logger.warning(f"[RevocationAndLogger V1.0] Lookup for {revoker_id} failed, name unknown.")
                         actual_name = "未知成员"
 
-                if (actual_name == "未知成员" or not actual_name) and revoke_xml_content:
-                    logger.info("[RevocationAndLogger V1.0] Trying fallback: Parsing nickname from revoke XML <replacemsg>...")
-                    try:
-                        replacemsg_match = re.search(r'<!\[CDATA\["([^"]+)"\s+撤回了一条消息\]\]>', revoke_xml_content, re.IGNORECASE)
-                        if replacemsg_match:
-                            parsed_name = replacemsg_match.group(1)
-                            actual_name = parsed_name
-                            logger.info(f"[RevocationAndLogger V1.0] Parsed nickname from <replacemsg>: {actual_name}")
-                        else:
-                            logger.warning("[RevocationAndLogger V1.0] Failed to parse nickname from <replacemsg> CDATA.")
-                    except Exception as parse_e:
-                        logger.error(f"[RevocationAndLogger V1.0] Error parsing <replacemsg>: {parse_e}")
+                if (actual_name == "未知成员" or not actual_name) and notice:
+                    self.log_detail("[RevocationAndLogger V1.0] Trying fallback: Parsing nickname from revoke XML <replacemsg>...")
+                    if notice.nickname:
+                        actual_name = notice.nickname
+                        self.log_detail(f"[RevocationAndLogger V1.0] Parsed nickname from <replacemsg>: {actual_name}")
+                    else:
+                        logger.warning("[RevocationAndLogger V1.0] Failed to parse nickname from <replacemsg> CDATA.")
 
                 if not actual_name or actual_name == "未知成员": actual_name = f"用户({revoker_id or '未知ID'})"
-                prefix = f"群「{from_name}」的成员「{actual_name}」"
+                prefix = f"群「{from_name}」的成员「{actual_name}」"; title = f"群「{from_name}」"; who = f"「{actual_name}」: "
 
             else:
                 sender_id = original_msg.from_user_id
                 from_name = self.get_user_info(sender_id)
-                prefix = f"好友「{from_name}」"
+                prefix = f"好友「{from_name}」"; title = prefix; who = ""
 
-            logger.info(f"[RevocationAndLogger V1.0] Constructed prefix: {prefix}")
+            self.log_detail(f"[RevocationAndLogger V1.0] Constructed prefix: {prefix}")
 
+            # 通知交给发送队列, 由其限速/重试, 短时间内大量撤回时合并为摘要
+            parts = []; attachments = []; summary = None
             if original_msg.ctype == ContextType.TEXT:
-                logger.info(f"[RevocationAndLogger V1.0] Sending TEXT revoke notification to {receiver}...")
-                client.post_text(app_id, receiver, f"{prefix} 撤回了一条消息:\n---\n{original_msg.content}", "")
-                logger.info(f"[RevocationAndLogger V1.0] TEXT notification sent.")
+                parts.append(("post_text", (f"{prefix} 撤回了一条消息:\n---\n{original_msg.content}", ""))); summary = original_msg.content
             elif tmp_file_path and os.path.exists(tmp_file_path) and original_msg.ctype in [ContextType.IMAGE, ContextType.VIDEO, ContextType.FILE, ContextType.VOICE]:
                 type_str_map = { ContextType.IMAGE: "图片", ContextType.VIDEO: "视频", ContextType.FILE: "文件", ContextType.VOICE: "语音" }
                 type_str = type_str_map.get(original_msg.ctype, "媒体文件")
-                logger.info(f"[RevocationAndLogger V1.0] Sending {type_str} revoke notification to {receiver}...")
-                client.post_text(app_id, receiver, f"{prefix} 撤回了一个{type_str}👇", "")
+                parts.append(("post_text", (f"{prefix} 撤回了一个{type_str}👇", ""))); summary = f"[{type_str}]"
 
                 callback_url = conf().get("gewechat_callback_url", "").rstrip('/')
                 if callback_url:
-                    try:
-                        rel_path = os.path.relpath(tmp_file_path, os.getcwd()).replace(os.sep, '/')
-                        if not rel_path.startswith('tmp/'): rel_path = 'tmp/' + os.path.basename(tmp_file_path)
-                        file_url = f"{callback_url}?file={rel_path}"
-                        logger.info(f"[RevocationAndLogger V1.0] Sending file via URL: {file_url}")
-                        if original_msg.ctype == ContextType.IMAGE: client.post_image(app_id, receiver, file_url)
-                        elif original_msg.ctype == ContextType.VIDEO: client.post_file(app_id, receiver, file_url, os.path.basename(tmp_file_path))
-                        elif original_msg.ctype == ContextType.VOICE: client.post_file(app_id, receiver, file_url, os.path.basename(tmp_file_path))
-                        else: client.post_file(app_id, receiver, file_url, os.path.basename(tmp_file_path))
-                        logger.info(f"[RevocationAndLogger V1.0] File notification sent.")
-                    except Exception as send_e:
-                        logger.error(f"[RevocationAndLogger V1.0] Failed to send file via callback URL: {send_e}")
-                        client.post_text(app_id, receiver, f"（无法发送被撤回的{type_str}文件，请检查回调配置或临时文件）", "")
+                    rel_path = os.path.relpath(tmp_file_path, os.getcwd()).replace(os.sep, '/')
+                    if not rel_path.startswith('tmp/'): rel_path = 'tmp/' + os.path.basename(tmp_file_path)
+                    file_url = f"{callback_url}?file={rel_path}"
+                    self.log_detail(f"[RevocationAndLogger V1.0] Queueing file via URL: {file_url}")
+                    if original_msg.ctype == ContextType.IMAGE: attachments.append(("post_image", (file_url,)))
+                    else: attachments.append(("post_file", (file_url, os.path.basename(tmp_file_path))))
+                    parts.extend(attachments)
                 else:
                     logger.error("[RevocationAndLogger V1.0] gewechat_callback_url not configured, cannot send file content.")
-                    client.post_text(app_id, receiver, f"（无法发送被撤回的{type_str}文件，回调URL未配置）", "")
+                    parts.append(("post_text", (f"（无法发送被撤回的{type_str}文件，回调URL未配置）", "")))
             elif original_msg.ctype not in [ContextType.TEXT]:
                 type_name = original_msg.ctype.name
-                logger.info(f"[RevocationAndLogger V1.0] Sending {type_name} type revoke notification to {receiver}...")
-                client.post_text(app_id, receiver, f"{prefix} 撤回了一条 {type_name} 类型的消息。", "")
-                logger.info(f"[RevocationAndLogger V1.0] Type notification sent.")
+                parts.append(("post_text", (f"{prefix} 撤回了一条 {type_name} 类型的消息。", ""))); summary = f"[{type_name}]"
             else: logger.warning(f"[RevocationAndLogger V1.0] Unhandled original message type for revoke: {original_msg.ctype}, tmp_file_path: {tmp_file_path}")
 
-            logger.info(f"[RevocationAndLogger V1.0] Revoke handling appears complete for ID {found_id}.")
+            if parts:
+                logger.info(f"[RevocationAndLogger V1.0] Queueing {original_msg.ctype.name} revoke notification to {receiver}...")
+                self.notifier.submit(Notification(receiver, original_msg.from_user_id, title, f"{who}{summary}", parts, attachments))
+            self.log_detail(f"[RevocationAndLogger V1.0] Revoke handling appears complete for ID {found_id}.")
         except Exception as e:
-            logger.error(f"[RevocationAndLogger V1.0] Exception during revoke notification sending: {e}")
+            logger.error(f"[RevocationAndLogger V1.0] Exception during revoke notification queueing: {e}")
             logger.error(f"[RevocationAndLogger V1.0] Traceback: {traceback.format_exc()}")
 
+    def send_notification(self, receiver, method, args):
+        if not self.gewechat_channel or not self.gewechat_channel.client or not self.gewechat_channel.app_id: raise RuntimeError("gewechat client not initialized")
+        res = self.call_gewechat(method, receiver, *args)
+        if isinstance(res, dict) and res.get('ret') not in (None, 200): raise RuntimeError(f"gewechat 返回 ret={res.get('ret')}: {res.get('msg', '')}")
+        return res
+
+    def call_gewechat(self, method, *args):
+        # 所有 gewechat 接口调用都经过这里, 记录调用次数、结果和耗时
+        started = time.perf_counter(); result = "error"
+        try:
+            res = getattr(self.gewechat_channel.client, method)(self.gewechat_channel.app_id, *args)
+            result = "ok" if not isinstance(res, dict) or res.get('ret') in (None, 200) else "fail"
+            return res
+        finally:
+            self.metrics.inc("api_calls", method=method, result=result); self.metrics.observe(f"api:{method}", time.perf_counter() - started)
+
+    def collect_metrics(self):
+        cache = self.msg_cache.stats(); queue = self.writer_queue.stats(); notify = self.notifier.stats(); tmp_files, tmp_bytes = dir_usage(self.tmp_dir)
+        metrics = [("cache_entries", "gauge", "撤回缓存条数", cache["entries"]), ("cache_bytes", "gauge", "撤回缓存字节数", cache["bytes"]),
+                   ("cache_hits_total", "counter", "撤回时缓存命中次数", cache["hits"]), ("cache_misses_total", "counter", "撤回时缓存未命中次数", cache["misses"]),
+                   ("tmp_files", "gauge", "tmp 目录文件数", tmp_files), ("tmp_bytes", "gauge", "tmp 目录字节数", tmp_bytes),
+                   ("writer_queue_depth", "gauge", "写入队列积压", queue["depth"]), ("writer_dropped_total", "counter", "写入队列丢弃条数", queue["dropped"]),
+                   ("notify_queue_depth", "gauge", "撤回通知队列积压", notify["depth"]), ("notify_sent_total", "counter", "撤回通知发送成功条数", notify["sent"]),
+                   ("notify_failed_total", "counter", "撤回通知发送失败条数", notify["failed"] + notify["dropped"]),
+                   ("notify_latency_p50_ms", "gauge", "撤回通知投递延迟 p50 (ms)", notify["latency_p50_ms"]), ("notify_latency_p95_ms", "gauge", "撤回通知投递延迟 p95 (ms)", notify["latency_p95_ms"]),
+                   ("notify_latency_max_ms", "gauge", "撤回通知投递延迟最大值 (ms)", notify["latency_max_ms"]),
+                   ("name_cache_entries", "gauge", "群名/昵称缓存条数", self.resolver.stats()["entries"])]
+        retained = self.media_retainer.stats(); prefetch = self.media_prefetcher.stats()
+        for kind in ("copy", "link", "reflink", "ref", "materialize"):
+            metrics += [(f"media_{kind}_total", "counter", f"媒体保留 {kind} 次数", retained[kind]), (f"media_{kind}_bytes_total", "counter", f"媒体保留 {kind} 字节数", retained[f"{kind}_bytes"])]
+        metrics += [("media_stale_ref_total", "counter", "reference 模式下原文件已变化的次数", retained["stale_ref"]),
+                    ("media_prefetch_inflight", "gauge", "后台缓存中的媒体文件数", prefetch["inflight"]),
+                    ("media_prefetch_completed_total", "counter", "媒体文件缓存成功次数", prefetch["completed"]), ("media_prefetch_failed_total", "counter", "媒体文件缓存失败次数", prefetch["failed"]),
+                    ("media_downloaded_bytes_total", "counter", "媒体文件下载字节数", prefetch["downloaded_bytes"])]
+        # 共享缓存模式下媒体文件由守护进程去重
+        store = self.media_store.stats() if self.media_store else self.sidecar.call("store.stats") if self.sidecar else None
+        if store:
+            metrics += [("media_blobs", "gauge", "去重后的媒体文件数", store["blobs"]), ("media_dedup_hits_total", "counter", "媒体文件去重命中次数", store["dedup_hits"]),
+                        ("media_bytes_saved_total", "counter", "媒体去重省下的字节数", store["bytes_saved"]), ("media_dedup_ratio", "gauge", "媒体去重比 (写入/实际存储)", store["dedup_ratio"])]
+        return metrics
+
+    @instrument("handle_msg")
     def handle_msg(self, msg: ChatMessage, is_group=False):
         try:
             if msg.ctype == ContextType.REVOKE: self.handle_revoke(msg, is_group); return
-            expire_duration=self.config.get("message_expire_time",120); current_time=time.time()
+            decision = self.cache_policy.decide(msg.from_user_id, msg.ctype.name)
+            if decision is None: return  # 不缓存的消息类型
+            policy, expire_duration, max_bytes = decision; is_media = msg.ctype.name in MEDIA_TYPES
+            if not expire_duration: self.count_policy_skip(policy, msg.ctype.name, "disabled", self.media_size_hint(msg) if is_media else 0, is_media); return
+            current_time=time.time()
             try:
                 ts=msg.create_time; msg_timestamp=ts.timestamp() if isinstance(ts,datetime) else float(ts)
                 if msg_timestamp < (current_time - expire_duration): return
             except Exception as time_err: logger.warning(f"[RevocationAndLogger] 无法处理消息时间戳 {msg.msg_id}: {time_err}. 跳过缓存."); return
 
-            msg_id_str = str(msg.msg_id); cached_data = None
-            if msg.ctype == ContextType.TEXT: cached_data = msg
-            elif msg.ctype in [ContextType.IMAGE, ContextType.VIDEO, ContextType.FILE, ContextType.VOICE]:
-                local_path = self.download_files(msg)
-                if not local_path: logger.warning(f"[RevocationAndLogger] 无法获取文件路径，跳过缓存: {msg_id_str} ({msg.ctype.name})"); return
-                tmp_path = self.copy_to_tmp(local_path)
-                if not tmp_path: logger.warning(f"[RevocationAndLogger] 无法复制文件到tmp，跳过缓存: {msg_id_str} ({msg.ctype.name})"); return
-                msg_copy = copy.copy(msg); msg_copy.content = tmp_path; cached_data = (msg_copy, tmp_path)
-            elif msg.ctype in [ContextType.SHARING, ContextType.CARD, ContextType.PATPAT]: cached_data = msg
+            msg_id_str = str(msg.msg_id); cached_data = None; cached_size = 0; media_future = None
+            if msg.ctype == ContextType.TEXT:
+                cached_size = len(msg.content.encode('utf-8')) if isinstance(msg.content, str) else 0
+                if max_bytes and cached_size > max_bytes: self.count_policy_skip(policy, msg.ctype.name, "too_large", cached_size); return
+                cached_data = CachedMessage.from_msg(msg, msg_timestamp)
+            elif is_media:
+                size_hint = self.media_size_hint(msg) if max_bytes else 0
+                if size_hint > max_bytes: self.count_policy_skip(policy, msg.ctype.name, "too_large", size_hint, True); return
+                # 下载在后台进行, 不再像以前那样把 msg.content 改成下载后的 tmp 路径 (后续插件看到的仍是原始的 content)
+                media_future = self.media_prefetcher.submit(self.prefetch_media, msg_id_str, msg.ctype.name, msg.content, getattr(msg, 'url', None), policy, max_bytes)
+                cached_data = CachedMessage.from_msg(msg, msg_timestamp, content="", tmp_path=media_future)
+            else: cached_data = CachedMessage.from_msg(msg, msg_timestamp, content="")  # SHARING/CARD/PATPAT, 撤回通知只用到类型
 
             if cached_data:
-                self.msg_dict[msg_id_str] = cached_data
-                if hasattr(msg, 'msg_data') and isinstance(msg.msg_data, dict) and 'MsgId' in msg.msg_data:
-                    internal_id_str = str(msg.msg_data['MsgId'])
-                    if internal_id_str != msg_id_str and internal_id_str not in self.msg_dict: self.msg_dict[internal_id_str] = cached_data
+                cache_keys = [msg_id_str]
+                if hasattr(msg, 'msg_data') and isinstance(msg.msg_data, dict):  # 撤回通知里的 msgid/newmsgid 分别对应 MsgId/NewMsgId
+                    cache_keys.extend(str(msg.msg_data[k]) for k in ('MsgId', 'NewMsgId') if msg.msg_data.get(k))
+                expire_at = msg_timestamp + expire_duration
+                self.msg_cache.put(cache_keys, cached_data, expire_at, cached_size)
+                if media_future: media_future.add_done_callback(lambda f: self.on_media_prefetched(msg_id_str, f, cache_keys, cached_data, expire_at))
+                else: self.journal_cached(cache_keys, cached_data, expire_at, cached_size)
         except Exception as e:
             logger.error(f"[RevocationAndLogger] 缓存消息失败 ({msg.msg_id if hasattr(msg, 'msg_id') else 'N/A'}): {e}")
             logger.error(f"[RevocationAndLogger] 错误详情: {traceback.format_exc()}")
 
+    @instrument("get_group_info")
     def get_group_info(self, group_id, force_refresh=False):
-        current_time = time.time()
-        if not force_refresh and group_id in self.group_info_cache:
-            cached_name, expiry = self.group_info_cache[group_id]
-            if current_time < expiry: return cached_name, {}
-        group_name = None; member_dict = {}
-        try:
-            if not self.gewechat_channel or not self.gewechat_channel.client: return group_id, {}
-            client = self.gewechat_channel.client; app_id = self.gewechat_channel.app_id
-            if not app_id: return group_id, {}
-            method_name = 'getChatroomInfo' if hasattr(client, 'getChatroomInfo') else 'get_chatroom_info'
-            if hasattr(client, method_name):
-                api_method = getattr(client, method_name); res = api_method(app_id, group_id)
-                if res and res.get('ret') == 200 and res.get('data'): group_name = res['data'].get('nickName') or res['data'].get('remark')
-            else: logger.warning(f"[RevocationAndLogger] gewechat client missing group info method: {method_name}")
-            final_name = group_name or group_id; self.group_info_cache[group_id] = (final_name, current_time + self.cache_expiry_time)
-            return final_name, member_dict
-        except Exception as e:
-            logger.error(f"[RevocationAndLogger] 获取群信息 API 调用失败 for {group_id}: {e}")
-            self.group_info_cache[group_id] = (group_id, current_time + 60); return group_id, {}
+        return self.resolver.group_name(group_id, force_refresh) or group_id, {}
 
+    def fetch_group_name(self, group_id):
+        if not self.gewechat_channel or not self.gewechat_channel.client: return None
+        client = self.gewechat_channel.client; app_id = self.gewechat_channel.app_id
+        if not app_id: return None
+        method_name = 'getChatroomInfo' if hasattr(client, 'getChatroomInfo') else 'get_chatroom_info'
+        if not hasattr(client, method_name): logger.warning(f"[RevocationAndLogger] gewechat client missing group info method: {method_name}"); return None
+        res = self.call_gewechat(method_name, group_id)
+        if res and res.get('ret') == 200 and res.get('data'): return res['data'].get('nickName') or res['data'].get('remark')
+        return None
+
+    @instrument("on_receive_message")
     def on_receive_message(self, e_context: EventContext):
         try:
             context: Context = e_context['context']; cmsg: ChatMessage = context.get('msg')
             if not cmsg: return
+            self.metrics.inc("messages", ctype=getattr(cmsg.ctype, 'name', 'UNKNOWN'))
+            self.observe_names(cmsg)
+            if self.sidecar and cmsg.ctype != ContextType.REVOKE and not self.claim_message(cmsg): return  # 撤回消息各实例都要处理, 通知各自的接收者
             if cmsg.is_group: self.handle_group_msg(cmsg)
             else: self.handle_single_msg(cmsg)
         except Exception as e:
             logger.error(f"[RevocationAndLogger] on_receive_message 处理失败: {e}")
             logger.error(f"[RevocationAndLogger] Traceback: {traceback.format_exc()}")
 
+    def observe_names(self, msg: ChatMessage):
+        if msg.is_group: self.resolver.observe(USER, getattr(msg, 'actual_user_id', None), getattr(msg, 'actual_user_nickname', None))
+        else: self.resolver.observe(USER, msg.from_user_id, getattr(msg, 'from_user_nickname', None))
+
     def handle_single_msg(self, msg: ChatMessage):
         self.handle_msg(msg, is_group=False)
 
     def handle_group_msg(self, msg: ChatMessage):
-        self.log_group_message(msg)
-        if msg.ctype != ContextType.REVOKE:
-            try:
-                group_id = msg.from_user_id; sender_nickname = msg.actual_user_nickname or msg.actual_user_id or "未知成员"; ts = msg.create_time
-                timestamp_str = datetime.fromtimestamp(int(ts)).strftime("%Y-%m-%d %H:%M") if isinstance(ts, (int, float)) else ts.strftime("%Y-%m-%d %H:%M") if isinstance(ts, datetime) else datetime.now().strftime("%Y-%m-%d %H:%M")
-                if group_id and sender_nickname: self.update_last_spoken_time(group_id, sender_nickname, timestamp_str)
-            except Exception as e: logger.error(f"[RevocationAndLogger] 调用 update_last_spoken_time 失败: {e}")
+        record = self.build_log_record(msg)
+        if record: self.record_activity(record, msg.ctype)
+        if record and not self.writer_queue.submit(record.group_id, self.process_group_record, record):
+            logger.debug(f"[RevocationAndLogger] 写入队列已满，丢弃群聊记录 (GroupID: {record.group_id})")
         self.handle_msg(msg, is_group=True)
 
+    @instrument("record_activity")
+    def record_activity(self, record: GroupLogRecord, ctype):
+        # 系统/入群/退群消息只计入类型, 不算作成员发言
+        member = None if ctype in (ContextType.SYSTEM, ContextType.JOIN_GROUP, ContextType.EXIT_GROUP) else record.sender_nickname
+        try: self.activity.record(record.group_id, hour_index(record.timestamp_str), member, getattr(ctype, 'name', None))
+        except Exception as e: logger.error(f"[RevocationAndLogger] 更新群活跃统计失败 (GroupID: {record.group_id}): {e}")
+
+    def render_activity(self, group_id):
+        summary = self.activity.summary(group_id, hour_index(datetime.now()), self.config.get("activity_top", 10))
+        group_name, _ = self.get_group_info(group_id); display_name = group_name if group_name != group_id else "本群"
+        if not summary or not summary["total"]: return f"{display_name} 近{summary['days'] if summary else self.activity.days}天没有消息记录。"
+        total = summary["total"]
+        lines = [f"{display_name} 近{summary['days']}天活跃统计", f"消息: 共 {total} 条, 近24小时 {summary['last_24h']} 条, 今天 {summary['today']} 条, 发言 {summary['members']} 人"]
+        if summary["busiest_hours"]: lines.append("最活跃时段 (近7天): " + ", ".join(f"{h}时 {n}条" for h, n in summary["busiest_hours"][:3]))
+        if summary["top_members"]:
+            lines.append("发言最多:"); lines += [f"{i}. {name} {n}条 ({n * 100 / total:.1f}%)" for i, (name, n) in enumerate(summary["top_members"], 1)]
+        lines.append("消息类型: " + ", ".join(f"{self.ACTIVITY_KIND_NAMES.get(kind, kind)} {n * 100 / total:.1f}%" for kind, n in summary["kinds"]))
+        return "\n".join(lines)
+
+    def process_group_record(self, record: GroupLogRecord):
+        self.write_log_record(record)
+        try:
+            if record.group_id and record.sender_nickname: self.update_last_spoken_time(record.group_id, record.sender_nickname, record.timestamp_str)
+        except Exception as e: logger.error(f"[RevocationAndLogger] 调用 update_last_spoken_time 失败: {e}")
+
+    def query_last_spoken_pages(self, group_id, args):
+        # 参数: 前N (最久未发言的N人) / N天 (超过N天未发言) / 第N页 / 最新 (按最近发言排序)
+        usage = f"用法: {self.command_trigger} [前N] [N天] [第N页] [最新]，例如 '{self.command_trigger} 30天 第2页'"
+        top_n = days = page = None; newest_first = False
+        for arg in args:
+            m = re.fullmatch(r"(?:前|最久)(\d+)", arg) or re.fullmatch(r"(\d+)天", arg) or re.fullmatch(r"第(\d+)页", arg)
+            if arg == "最新": newest_first = True
+            elif not m or int(m.group(1)) <= 0: return [usage]
+            elif arg.endswith("天"): days = int(m.group(1))
+            elif arg.endswith("页"): page = int(m.group(1))
+            else: top_n = int(m.group(1))
+
+        page_size = max(1, int(self.config.get("last_spoken_page_size", 30))); max_pages = max(1, int(self.config.get("last_spoken_max_pages", 3)))
+        before = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M") if days else None
+        total, _ = self.storage.query_last_spoken(group_id, before=before, limit=0, newest_first=newest_first)
+        if top_n: total = min(total, top_n)
+        if total == 0: return [f"没有超过 {days} 天未发言的成员。" if days else "本群尚无发言记录。"]
+
+        pages = (total + page_size - 1) // page_size
+        first_page = page or 1
+        if first_page > pages: return [f"共 {pages} 页，第 {first_page} 页没有记录。"]
+        last_page = first_page if page else min(pages, max_pages)
+        offset = (first_page - 1) * page_size; count = min(total, last_page * page_size) - offset
+        _, rows = self.storage.query_last_spoken(group_id, before=before, offset=offset, limit=count, newest_first=newest_first)
+
+        title = f"超过 {days} 天未发言的成员" if days else ("最近发言的成员" if newest_first else "最久未发言的成员")
+        replies = []
+        for p in range(first_page, last_page + 1):
+            chunk = rows[(p - first_page) * page_size:(p - first_page + 1) * page_size]
+            replies.append(f"{title}（共 {total} 人，第 {p}/{pages} 页）\n" + "".join(f"【{nickname}】{ts}\n" for nickname, ts in chunk))
+        if last_page < pages: replies[-1] += f"……发送 '{' '.join([self.command_trigger] + [a for a in args if not a.endswith('页')] + [f'第{last_page + 1}页'])}' 查看更多"
+        return replies
+
+    def query_search_pages(self, group_id, args):
+        # 参数: 关键词 (可多个) / @昵称 / N天 / 2024-01-01 或 2024-01-01~2024-01-31 / 第N页
+        usage = f"用法: {self.search_trigger} 关键词 [@昵称] [N天] [2024-01-01~2024-01-31] [第N页]"
+        keywords = []; sender = since = until = None; page = 1
+        for arg in args:
+            m_days = re.fullmatch(r"(\d+)天", arg); m_page = re.fullmatch(r"第(\d+)页", arg)
+            m_date = re.fullmatch(r"(\d{4}-\d{2}-\d{2})(?:~(\d{4}-\d{2}-\d{2}))?", arg)
+            if arg.startswith("@") and len(arg) > 1: sender = arg[1:]
+            elif m_days: since = (datetime.now() - timedelta(days=int(m_days.group(1)))).strftime("%Y-%m-%d %H:%M")
+            elif m_page: page = max(1, int(m_page.group(1)))
+            elif m_date: since = f"{m_date.group(1)} 00:00"; until = f"{m_date.group(2) or m_date.group(1)} 23:59"
+            else: keywords.append(arg)
+        if not keywords and not sender: return [usage]
+
+        page_size = max(1, int(self.config.get("search_page_size", 10)))
+        total, rows = self.search_index.search(group_id, keywords, sender=sender, since=since, until=until, offset=(page - 1) * page_size, limit=page_size)
+        title = "、".join(keywords) if keywords else f"@{sender}"
+        if total == 0: return [f"没有找到与「{title}」相关的聊天记录。"]
+        pages = (total + page_size - 1) // page_size
+        if page > pages: return [f"共 {pages} 页，第 {page} 页没有记录。"]
+        reply = f"「{title}」的搜索结果（共 {total} 条，第 {page}/{pages} 页）\n" + "".join(f"{ts} 【{nickname}】{content}\n" for ts, nickname, content in rows)
+        if page < pages: reply += f"……发送 '{' '.join([self.search_trigger] + [a for a in args if not a.endswith('页')] + [f'第{page + 1}页'])}' 查看更多"
+        return [reply]
+
+    @instrument("on_handle_context")
     def on_handle_context(self, e_context: EventContext):
         context: Context = e_context['context']
         msg: ChatMessage = context.get('msg')
         channel = e_context['channel']
 
+        if context.type == ContextType.TEXT and msg and context.content.strip() == self.metrics_trigger:
+            sender = msg.actual_user_id if msg.is_group else msg.from_user_id
+            if sender not in self.metrics_admins: return  # 非管理员不响应, 交给其他插件
+            logger.info(f"[RevocationAndLogger] 收到命令 '{self.metrics_trigger}' 来自 {sender}")
+            e_context.action = EventAction.BREAK_PASS; e_context['reply'] = None; self.metrics.inc("commands", command="metrics")
+            try: replies = [self.metrics.summary()]
+            except Exception as e:
+                logger.error(f"[RevocationAndLogger] 生成插件状态失败: {e}")
+                replies = ["生成插件状态出错"]
+            self.send_replies(channel, context, msg.from_user_id, replies)
+            return
+
         if context.type == ContextType.TEXT and msg and msg.is_group:
             content = context.content.strip()
-            if content == self.command_trigger:
+            if content == self.search_trigger or content.startswith(self.search_trigger + " "):
+                logger.info(f"[RevocationAndLogger] 收到命令 '{self.search_trigger}' 来自群聊 {msg.from_user_id}")
+                e_context.action = EventAction.BREAK_PASS; e_context['reply'] = None; self.metrics.inc("commands", command="search")
+                group_id = msg.from_user_id
+                if not group_id: replies = ["无法获取当前群聊ID"]
+                elif not self.search_index: replies = ["搜索功能未启用"]
+                else:
+                    try: replies = self.query_search_pages(group_id, content[len(self.search_trigger):].split())
+                    except Exception as e:
+                        logger.error(f"[RevocationAndLogger] 搜索聊天记录失败: {group_id}, Error: {e}")
+                        replies = ["搜索聊天记录出错"]
+                self.send_replies(channel, context, group_id, replies)
+                return
+
+            if content == self.activity_trigger:
+                logger.info(f"[RevocationAndLogger] 收到命令 '{self.activity_trigger}' 来自群聊 {msg.from_user_id}")
+                e_context.action = EventAction.BREAK_PASS; e_context['reply'] = None; self.metrics.inc("commands", command="activity")
+                group_id = msg.from_user_id
+                if not group_id: replies = ["无法获取当前群聊ID"]
+                else:
+                    try: replies = [self.render_activity(group_id)]
+                    except Exception as e:
+                        logger.error(f"[RevocationAndLogger] 查询群活跃统计失败: {group_id}, Error: {e}")
+                        replies = ["查询群活跃统计出错"]
+                self.send_replies(channel, context, group_id, replies)
+                return
+
+            if content == self.command_trigger or content.startswith(self.command_trigger + " "):
                 logger.info(f"[RevocationAndLogger] 收到命令 '{self.command_trigger}' 来自群聊 {msg.from_user_id}")
-                e_context.action = EventAction.BREAK_PASS
+                e_context.action = EventAction.BREAK_PASS; self.metrics.inc("commands", command="last_spoken")
 
                 group_id = msg.from_user_id
-                reply_text = ""
+                args = content[len(self.command_trigger):].split()
+                replies = []
 
                 if not group_id:
-                    reply_text = "无法获取当前群聊ID"
+                    replies.append("无法获取当前群聊ID")
                 elif not hasattr(self, 'last_spoken_dir') or not self.last_spoken_dir:
-                    reply_text = "内部错误：记录目录未初始化"
+                    replies.append("内部错误：记录目录未初始化")
+                elif args:
+                    try: replies = self.query_last_spoken_pages(group_id, args)
+                    except Exception as e:
+                        logger.error(f"[RevocationAndLogger] 查询最后发言记录失败: {group_id}, Error: {e}")
+                        replies.append("查询最后发言记录出错")
                 else:
-                    file_name = f"{self.sanitize_filename(group_id)}-最后发言.txt"
-                    file_path = os.path.join(self.last_spoken_dir, file_name)
-
-                    if os.path.exists(file_path):
-                        logger.info(f"[RevocationAndLogger] 找到文件: {file_path}")
-                        try:
-                            with open(file_path, 'r', encoding='utf-8') as f:
-                                file_content = f.read()
-                            if file_content and file_content.strip():
-                                reply_text = file_content
-                                logger.info("[RevocationAndLogger] 准备发送文件内容")
-                            else:
-                                reply_text = "记录文件为空。"
-                                logger.info("[RevocationAndLogger] 文件为空")
-                        except Exception as e:
-                            logger.error(f"[RevocationAndLogger] 读取文件失败: {file_path}, Error: {e}")
-                            reply_text = "读取记录文件出错"
-                    else:
-                        logger.warning(f"[RevocationAndLogger] 未找到文件: {file_path}")
-                        group_name, _ = self.get_group_info(group_id)
-                        display_name = group_name if group_name != group_id else f"本群"
-                        reply_text = f"{display_name} 尚无发言记录。"
-                        logger.info("[RevocationAndLogger] 已设置未找到文件回复")
-
-                if reply_text:
                     try:
-                        reply = Reply(ReplyType.TEXT, reply_text)
-                        channel.send(reply, context)
-                        logger.info(f"[RevocationAndLogger] 已通过 channel.send 发送回复至群聊 {group_id}")
-                        e_context['reply'] = None
-                    except Exception as send_e:
-                         logger.error(f"[RevocationAndLogger] 使用 channel.send 发送回复失败: {send_e}")
-                         e_context['reply'] = None
-                else:
-                     e_context['reply'] = None
-                     logger.warning("[RevocationAndLogger] reply_text 为空，未发送任何回复。")
+                        file_content = self.storage.render_last_spoken(group_id)
+                        if file_content is None:
+                            logger.warning(f"[RevocationAndLogger] 未找到最后发言记录: {group_id}")
+                            group_name, _ = self.get_group_info(group_id)
+                            display_name = group_name if group_name != group_id else f"本群"
+                            replies.append(f"{display_name} 尚无发言记录。")
+                            self.log_detail("[RevocationAndLogger] 已设置未找到文件回复")
+                        elif file_content.strip():
+                            # 人数超过一页时和带参数时一样分页回复 (默认按最久未发言排序), 否则原样发送记录文件
+                            page_size = max(1, int(self.config.get("last_spoken_page_size", 30)))
+                            if sum(1 for line in file_content.splitlines() if line.startswith("【")) > page_size: replies = self.query_last_spoken_pages(group_id, [])
+                            else: replies.append(file_content)
+                            self.log_detail("[RevocationAndLogger] 准备发送文件内容")
+                        else:
+                            replies.append("记录文件为空。")
+                            self.log_detail("[RevocationAndLogger] 文件为空")
+                    except Exception as e:
+                        logger.error(f"[RevocationAndLogger] 读取最后发言记录失败: {group_id}, Error: {e}")
+                        replies.append("读取记录文件出错")
 
+                e_context['reply'] = None
+                self.send_replies(channel, context, group_id, replies)
                 return
 
         return
+
+    def send_replies(self, channel, context, group_id, replies):
+        if not replies: logger.warning("[RevocationAndLogger] reply_text 为空，未发送任何回复。")
+        for reply_text in replies:
+            try:
+                channel.send(Reply(ReplyType.TEXT, reply_text), context)
+                self.log_detail(f"[RevocationAndLogger] 已通过 channel.send 发送回复至群聊 {group_id}")
+            except Exception as send_e:
+                logger.error(f"[RevocationAndLogger] 使用 channel.send 发送回复失败: {send_e}")
+                break
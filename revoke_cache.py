@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+
+class CachedMessage:
+    # 缓存时生成的只读快照, 只保留撤回通知需要的字段, 不再持有完整的 ChatMessage (msg_data / XML / channel 引用)
+    # 媒体消息的 tmp_path 在后台缓存完成前是一个 Future
+    __slots__ = ("msg_id", "ctype", "content", "from_user_id", "actual_user_id", "actual_user_nickname", "create_time", "tmp_path")
+
+    def __init__(self, msg_id, ctype, content, from_user_id, actual_user_id=None, actual_user_nickname=None, create_time=0.0, tmp_path=None):
+        init = object.__setattr__
+        init(self, "msg_id", msg_id); init(self, "ctype", ctype); init(self, "content", content)
+        init(self, "from_user_id", from_user_id); init(self, "actual_user_id", actual_user_id)
+        init(self, "actual_user_nickname", actual_user_nickname); init(self, "create_time", create_time); init(self, "tmp_path", tmp_path)
+
+    @classmethod
+    def from_msg(cls, msg, create_time, content=None, tmp_path=None):
+        return cls(str(msg.msg_id), msg.ctype, msg.content if content is None else content, msg.from_user_id,
+                   getattr(msg, 'actual_user_id', None), getattr(msg, 'actual_user_nickname', None), create_time, tmp_path)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"CachedMessage is read-only (attribute '{name}')")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"CachedMessage is read-only (attribute '{name}')")
+
+    def __repr__(self):
+        return f"CachedMessage(msg_id={self.msg_id!r}, ctype={self.ctype!r}, from_user_id={self.from_user_id!r}, tmp_path={self.tmp_path!r})"
+
+
+class _Entry:
+    __slots__ = ("primary", "keys", "value", "expire_at", "size", "seq")
+
+    def __init__(self, primary, keys, value, expire_at, size, seq):
+        self.primary = primary; self.keys = keys; self.value = value
+        self.expire_at = expire_at; self.size = size; self.seq = seq
+
+
+class RevokeCache:
+    # 防撤回消息缓存: 哈希索引 + 按过期时间排序的小顶堆 + LRU 顺序
+    # 过期清理只弹出堆顶已过期的条目; 超出条数或字节上限时淘汰最久未使用的条目
+    # 每个条目可以有多个 key (msg_id 与 msg_data['MsgId']), 条目移除时所有别名一起移除
+    def __init__(self, max_entries=10000, max_bytes=512 * 1024 * 1024, on_evict=None):
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_bytes))
+        self.on_evict = on_evict
+        self._entries = OrderedDict()  # primary key -> _Entry, 按最近使用排序
+        self._aliases = {}  # 任意 key -> primary key
+        self._heap = []  # (expire_at, seq, primary)
+        self._bytes = 0
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def put(self, keys, value, expire_at, size=0):
+        keys = [k for k in dict.fromkeys(keys) if k]
+        if not keys: return
+        primary = keys[0]; removed = []
+        with self._lock:
+            old = self._entries.get(self._aliases.get(primary))
+            if old is not None and old.primary == primary: removed.append(self._remove(old))
+            elif old is not None: old.keys.remove(primary)  # 只是其他条目的别名, 改为指向新条目
+            entry = _Entry(primary, [primary], value, expire_at, max(0, int(size)), next(self._seq))
+            self._aliases[primary] = primary
+            for alias in keys[1:]:
+                if alias not in self._aliases: self._aliases[alias] = primary; entry.keys.append(alias)
+            self._entries[primary] = entry; self._bytes += entry.size
+            heapq.heappush(self._heap, (expire_at, entry.seq, primary))
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                lru = next(iter(self._entries.values()))
+                removed.append(self._remove(lru)); self.evicted += 1
+        self._notify(removed)
+
+    def get(self, key, now=None):
+        return self.find([key], now)[1]
+
+    def find(self, keys, now=None):
+        now = time.time() if now is None else now
+        removed = []; result = (None, None)
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(self._aliases.get(key))
+                if entry is None: continue
+                if entry.expire_at <= now:
+                    removed.append(self._remove(entry)); self.expired += 1; continue
+                self._entries.move_to_end(entry.primary); result = (key, entry.value); break
+            if result[1] is None: self.misses += 1
+            else: self.hits += 1
+        self._notify(removed)
+        return result
+
+    def update_size(self, key, size):
+        # 媒体文件异步缓存完成后才知道实际大小
+        removed = []
+        with self._lock:
+            entry = self._entries.get(self._aliases.get(key))
+            if entry is None: return
+            size = max(0, int(size)); self._bytes += size - entry.size; entry.size = size
+            while self._entries and self._bytes > self.max_bytes:
+                lru = next(iter(self._entries.values()))
+                removed.append(self._remove(lru)); self.evicted += 1
+        self._notify(removed)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.get(self._aliases.get(key))
+            removed = [self._remove(entry)] if entry is not None else []
+        self._notify(removed)
+        return removed[0] if removed else None
+
+    def expire(self, now=None):
+        now = time.time() if now is None else now
+        removed = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, seq, primary = heapq.heappop(self._heap)
+                entry = self._entries.get(primary)
+                if entry is None or entry.seq != seq: continue  # 已被替换或淘汰的旧堆节点
+                removed.append(self._remove(entry)); self.expired += 1
+        self._notify(removed)
+        return len(removed)
+
+    def _remove(self, entry):
+        del self._entries[entry.primary]
+        for key in entry.keys:
+            if self._aliases.get(key) == entry.primary: del self._aliases[key]
+        self._bytes -= entry.size
+        return entry.value
+
+    def _notify(self, values):
+        if self.on_evict:
+            for value in values: self.on_evict(value)
+
+    def keys(self):
+        with self._lock: return list(self._aliases)
+
+    def values(self):
+        with self._lock: return [entry.value for entry in self._entries.values()]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._aliases
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "keys": len(self._aliases), "bytes": self._bytes, "heap": len(self._heap),
+                    "hits": self.hits, "misses": self.misses, "expired": self.expired, "evicted": self.evicted}
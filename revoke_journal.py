@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+# 每条记录: 头部 (过期时间 float64, 内容长度 uint32, crc32 uint32) + JSON 内容
+# 重放时只读头部就能跳过已过期的记录, 不需要解码内容
+HEADER = struct.Struct("<dII")
+SEGMENT_PREFIX = "seg_"
+SEGMENT_SUFFIX = ".log"
+
+
+class RevokeJournal:
+    # 防撤回缓存的追加日志, 按段 (segment) 存放: 超过大小或时间后换新段
+    # 段内最大过期时间已过的整段文件直接删除 (压缩不需要重写), 启动时用 mmap 顺序重放仍有效的记录
+    def __init__(self, directory, segment_bytes=4 * 1024 * 1024, segment_seconds=60):
+        self.directory = directory
+        self.segment_bytes = max(4096, int(segment_bytes))
+        self.segment_seconds = segment_seconds
+        os.makedirs(directory, exist_ok=True)
+        self._segments = {}  # 已关闭的段 path -> 段内最大过期时间 (None 表示尚未扫描)
+        for name in sorted(os.listdir(directory)):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX): self._segments[os.path.join(directory, name)] = None
+        self._next_seq = max([int(os.path.basename(p)[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) for p in self._segments] or [0]) + 1
+        self._lock = threading.Lock()
+        self._file = None; self._path = None; self._opened_at = 0; self._max_expire = 0.0
+        self._stats = dict.fromkeys(("appended", "appended_bytes", "replayed", "skipped_expired", "corrupt", "segments_removed"), 0)
+
+    def append(self, expire_at, record):
+        payload = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        data = HEADER.pack(expire_at, len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            if self._file is None or self._file.tell() >= self.segment_bytes or time.time() - self._opened_at >= self.segment_seconds: self._rotate()
+            self._file.write(data); self._file.flush()
+            self._max_expire = max(self._max_expire, expire_at)
+            self._stats["appended"] += 1; self._stats["appended_bytes"] += len(data)
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close(); self._segments[self._path] = self._max_expire
+        self._path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{self._next_seq:010d}{SEGMENT_SUFFIX}"); self._next_seq += 1
+        self._file = open(self._path, "ab"); self._opened_at = time.time(); self._max_expire = 0.0
+
+    def replay(self, now=None):
+        # 按写入顺序返回 (expire_at, record); 同一条消息后写入的记录覆盖先写入的
+        now = time.time() if now is None else now
+        with self._lock: paths = sorted(self._segments)
+        for path in paths:
+            max_expire = 0.0
+            for expire_at, payload in self._scan(path, now):
+                max_expire = max(max_expire, expire_at)
+                if payload is None:
+                    self._stats["skipped_expired"] += 1; continue
+                try: record = json.loads(payload)
+                except ValueError:
+                    self._stats["corrupt"] += 1; continue
+                self._stats["replayed"] += 1
+                yield expire_at, record
+            with self._lock:
+                if path in self._segments: self._segments[path] = max_expire
+
+    def _scan(self, path, now):
+        # 逐条读取头部; 过期记录不取内容, payload 返回 None. 文件尾部写到一半的记录 (崩溃) 直接停止
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size == 0: return
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    offset = 0
+                    while offset + HEADER.size <= size:
+                        expire_at, length, crc = HEADER.unpack_from(mm, offset)
+                        start = offset + HEADER.size; offset = start + length
+                        if offset > size:
+                            self._stats["corrupt"] += 1; return
+                        if expire_at <= now:
+                            yield expire_at, None; continue
+                        payload = mm[start:offset]
+                        if zlib.crc32(payload) != crc:
+                            self._stats["corrupt"] += 1; continue
+                        yield expire_at, payload
+        except (OSError, ValueError):
+            self._stats["corrupt"] += 1
+
+    def compact(self, now=None):
+        # 删除所有记录都已过期的段; 当前段写满时间后先关闭, 下次写入时再开新段
+        now = time.time() if now is None else now
+        with self._lock:
+            if self._file is not None and time.time() - self._opened_at >= self.segment_seconds:
+                self._file.close(); self._segments[self._path] = self._max_expire; self._file = None
+            unknown = [path for path, max_expire in self._segments.items() if max_expire is None]
+        for path in unknown:
+            max_expire = max((expire_at for expire_at, _ in self._scan(path, float("inf"))), default=0.0)
+            with self._lock:
+                if path in self._segments: self._segments[path] = max_expire
+        removed = 0
+        with self._lock:
+            for path in [p for p, max_expire in self._segments.items() if max_expire is not None and max_expire <= now]:
+                try: os.remove(path)
+                except FileNotFoundError: pass
+                del self._segments[path]; removed += 1
+            self._stats["segments_removed"] += removed
+        return removed
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close(); self._segments[self._path] = self._max_expire; self._file = None
+
+    def stats(self):
+        with self._lock:
+            return {"segments": len(self._segments) + (self._file is not None), **self._stats}
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+import re
+from collections import namedtuple
+
+RevokeNotice = namedtuple("RevokeNotice", ["msgid", "newmsgid", "replacemsg", "nickname"])
+
+# 撤回通知只需要三个标签, 一次扫描取出, 不做完整的 XML 解析
+_TAG_PATTERN = re.compile(r"<(msgid|newmsgid|replacemsg)>(.*?)</\1>", re.DOTALL)
+_CDATA_PATTERN = re.compile(r"^\s*<!\[CDATA\[(.*)\]\]>\s*$", re.DOTALL)
+_NICKNAME_PATTERN = re.compile(r'^"([^"]+)"\s+撤回了一条消息')
+
+
+def parse_revoke(xml):
+    fields = {}
+    for m in _TAG_PATTERN.finditer(xml or ""):
+        fields.setdefault(m.group(1), m.group(2))
+        if len(fields) == 3: break
+    replacemsg = fields.get("replacemsg")
+    if replacemsg is not None:
+        cdata = _CDATA_PATTERN.match(replacemsg)
+        if cdata: replacemsg = cdata.group(1)
+    nickname = _NICKNAME_PATTERN.match(replacemsg) if replacemsg else None
+    return RevokeNotice(fields.get("msgid") or None, fields.get("newmsgid") or None, replacemsg, nickname.group(1) if nickname else None)
+
+
+def candidate_ids(notice, revoked_msg_id=None):
+    # 按可信度排序并去重: 消息对象上的 revoked_msg_id, newmsgid (对应 msg_id), msgid (对应 msg_data['MsgId'])
+    return list(dict.fromkeys(str(i).strip() for i in (revoked_msg_id, notice.newmsgid, notice.msgid) if i and str(i).strip()))
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import itertools
+import math
+import random
+import threading
+import time
+import traceback
+
+from common.log import logger
+
+
+class Job:
+    __slots__ = ("name", "fn", "interval", "jitter", "overrun", "due", "running", "cancelled",
+                 "runs", "failures", "skipped", "overruns", "total_time", "max_time", "last_time", "last_error")
+
+    def __init__(self, name, fn, interval, jitter, overrun, due):
+        self.name = name; self.fn = fn; self.interval = interval; self.jitter = jitter; self.overrun = overrun
+        self.due = due  # 不含抖动的计划时间 (monotonic), skip/catch_up 按它对齐节拍
+        self.running = False; self.cancelled = False
+        self.runs = self.failures = self.skipped = self.overruns = 0
+        self.total_time = self.max_time = self.last_time = 0.0; self.last_error = None
+
+
+class Scheduler:
+    # 插件所有周期任务共用一个常驻线程: 按下次运行时间排序的小顶堆, 到期的任务依次在该线程上执行
+    # (耗时较长的任务, 如聊天记录归档, 自己另起线程, 不要阻塞调度线程)
+    # overrun 决定任务运行超过间隔或调度落后时下一次的时间:
+    #   skip     按原节拍对齐, 跳过已错过的节拍 (默认)
+    #   delay    本次结束后再等一个完整间隔
+    #   catch_up 按原节拍补跑错过的次数
+    OVERRUN_POLICIES = ("skip", "delay", "catch_up")
+
+    def __init__(self, name="RevocationAndLogger-scheduler", observe=None):
+        self._observe = observe  # observe(job_name, seconds), 每次运行后调用
+        self._jobs = {}
+        self._heap = []  # (run_at, seq, job)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def add(self, name, fn, interval, jitter=0.0, overrun="skip", delay=None):
+        # jitter 为间隔的比例 (0.1 表示每次提前或推后至多 10%), 避免几个任务总在同一时刻运行; delay 为首次运行前的等待, 默认一个间隔
+        if overrun not in self.OVERRUN_POLICIES:
+            logger.warning(f"[RevocationAndLogger] 未知的任务超时策略 '{overrun}' (任务 {name}), 使用 skip"); overrun = "skip"
+        interval = max(0.05, float(interval))
+        with self._cond:
+            if name in self._jobs: self._jobs[name].cancelled = True
+            job = self._jobs[name] = Job(name, fn, interval, max(0.0, min(0.5, float(jitter))), overrun,
+                                         time.monotonic() + (interval if delay is None else max(0.0, delay)))
+            self._push(job)
+        return job
+
+    def remove(self, name):
+        with self._cond:
+            job = self._jobs.pop(name, None)
+            if job: job.cancelled = True
+
+    def _push(self, job):
+        run_at = job.due + (random.uniform(-job.jitter, job.jitter) * job.interval if job.jitter else 0.0)
+        heapq.heappush(self._heap, (run_at, next(self._seq), job)); self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped: return
+                    if self._heap and self._heap[0][0] <= time.monotonic(): break
+                    self._cond.wait(None if not self._heap else self._heap[0][0] - time.monotonic())
+                _, _, job = heapq.heappop(self._heap)
+                if job.cancelled: continue
+                job.running = True
+            started = time.monotonic(); error = None
+            try: job.fn()
+            except Exception as e:
+                error = e
+                logger.error(f"[RevocationAndLogger] 周期任务 '{job.name}' 执行失败: {e}")
+                logger.error(f"[RevocationAndLogger] 错误详情: {traceback.format_exc()}")
+            finished = time.monotonic(); duration = finished - started
+            with self._cond:
+                job.running = False; job.runs += 1; job.total_time += duration; job.last_time = duration; job.max_time = max(job.max_time, duration)
+                if error is not None: job.failures += 1; job.last_error = repr(error)
+                self._reschedule(job, finished)
+                if not job.cancelled: self._push(job)
+            if self._observe:
+                try: self._observe(job.name, duration)
+                except Exception: pass
+
+    def _reschedule(self, job, now):
+        if job.overrun == "delay": job.due = now + job.interval; return
+        job.due += job.interval
+        if job.due > now: return
+        job.overruns += 1
+        if job.overrun == "skip":
+            missed = math.ceil((now - job.due) / job.interval)
+            job.due += missed * job.interval; job.skipped += missed
+            if job.due <= now: job.due += job.interval; job.skipped += 1
+
+    def shutdown(self, timeout=5):
+        # 正在运行的任务会执行完, 之后不再调度
+        with self._cond:
+            self._stopped = True; self._cond.notify_all()
+        if threading.current_thread() is not self._thread: self._thread.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            return {name: {"interval": job.interval, "overrun": job.overrun, "runs": job.runs, "failures": job.failures,
+                           "skipped": job.skipped, "overruns": job.overruns, "running": job.running,
+                           "avg_ms": round(job.total_time / job.runs * 1000, 2) if job.runs else 0,
+                           "max_ms": round(job.max_time * 1000, 2), "last_ms": round(job.last_time * 1000, 2),
+                           "next_in_s": round(job.due - now, 1), "last_error": job.last_error}
+                    for name, job in self._jobs.items()}
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+try:
+    from common.log import logger
+except ImportError:  # 作为批量建索引脚本单独运行时
+    import logging
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    logger = logging.getLogger("RevocationAndLogger.search_index")
+
+try:
+    from .log_archive import LogArchive
+except ImportError:
+    from log_archive import LogArchive
+
+# 中日韩文字没有空格分词, 索引时拆成单字 (uni 列) 和相邻双字 (bi 列), 其余文字按单词索引在 bi 列
+# 查询时单字查 uni 列, 多字转换成 bi 列的双字短语, 相当于子串匹配
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"  # 假名, 汉字, 韩文
+_TOKEN = re.compile(f"([{_CJK}]+)|((?:(?![{_CJK}])\\w)+)")
+LINE_PATTERN = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}) 【(.*?)】(.*)$")
+HEADER_GROUP_ID = "# 群聊 ID: "
+
+
+def tokenize(text):
+    uni, bi = [], []
+    for m in _TOKEN.finditer(text or ""):
+        run = m.group(1)
+        if run:
+            uni.extend(run)
+            bi.extend([run[i:i + 2] for i in range(len(run) - 1)] or [run])
+        else: bi.append(m.group(2).lower())
+    return " ".join(uni), " ".join(bi)
+
+
+def group_token(group_id):
+    # 群聊ID作为 grp 列的单个词索引, 搜索时先在倒排表里按群过滤, 不必回表逐行比较
+    return "g" + hashlib.blake2b(group_id.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def match_expression(keywords):
+    # 关键词之间为 AND; 返回 None 表示关键词里没有可搜索的文字
+    terms = []
+    for keyword in keywords:
+        for m in _TOKEN.finditer(keyword):
+            run = m.group(1)
+            if run and len(run) == 1: terms.append(f'uni : "{run}"')
+            elif run: terms.append(f'bi : "{" ".join(run[i:i + 2] for i in range(len(run) - 1))}"')
+            else: terms.append(f'bi : "{m.group(2).lower()}"*')
+    return " AND ".join(terms) or None
+
+
+class SearchIndex:
+    # 群聊记录全文索引 (SQLite FTS5), 与聊天记录存储方式无关, 单独保存在 chat_logs/search.db
+    # bulk 标记来自批量导入的旧记录, 重新导入时先删除再导入, 只导入早于实时索引第一条记录的内容
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS search_log (
+            id INTEGER PRIMARY KEY,
+            group_id TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            sender TEXT NOT NULL,
+            content TEXT NOT NULL,
+            bulk INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_search_log_group_ts ON search_log (group_id, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_search_log_group_sender ON search_log (group_id, sender, timestamp);
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(grp, uni, bi, content='', tokenize='unicode61');
+    """
+
+    def __init__(self, db_path, batch_size=200, flush_interval=2):
+        self.db_path = db_path
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.0, float(flush_interval))
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pending_since = None
+        self._next_id = (self._conn.execute("SELECT MAX(id) FROM search_log").fetchone()[0] or 0) + 1
+        self._stats = dict.fromkeys(("indexed", "commits", "queries"), 0)
+
+    def add(self, record):
+        with self._lock:
+            self._pending.append((record.group_id, record.timestamp_str, record.sender_nickname, record.content, 0))
+            if self._pending_since is None: self._pending_since = time.monotonic()
+            if len(self._pending) >= self.batch_size or time.monotonic() - self._pending_since >= self.flush_interval: self._commit()
+
+    def _commit(self):
+        if not self._pending: return
+        first_id = self._next_id
+        rows = [(first_id + i, *row) for i, row in enumerate(self._pending)]
+        try:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT INTO search_log (id, group_id, timestamp, sender, content, bulk) VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._conn.executemany("INSERT INTO search_fts (rowid, grp, uni, bi) VALUES (?, ?, ?, ?)", [(row[0], group_token(row[1]), *tokenize(row[4])) for row in rows])
+            self._conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            logger.error(f"[RevocationAndLogger] 写入搜索索引失败: {e}")
+            try: self._conn.execute("ROLLBACK")
+            except sqlite3.Error: pass
+            return
+        self._next_id += len(rows); self._stats["indexed"] += len(rows); self._stats["commits"] += 1
+        self._pending = []; self._pending_since = None
+
+    def flush_due(self):
+        with self._lock:
+            if self._pending_since is not None and time.monotonic() - self._pending_since >= self.flush_interval: self._commit()
+
+    def search(self, group_id, keywords=(), sender=None, since=None, until=None, offset=0, limit=10):
+        # 返回 (总条数, [(时间, 发送者, 内容)]), 按时间倒序
+        match = match_expression(keywords)
+        if keywords and match is None: return 0, []
+        where = "m.group_id = ?"; params = [group_id]
+        if sender: where += " AND m.sender = ?"; params.append(sender)
+        if since: where += " AND m.timestamp >= ?"; params.append(since)
+        if until: where += " AND m.timestamp <= ?"; params.append(until)
+        source = "search_log m"
+        if match:
+            # CROSS JOIN 固定以全文索引为外层循环
+            source = "search_fts f CROSS JOIN search_log m ON m.id = f.rowid"; where = f"search_fts MATCH ? AND {where}"
+            params.insert(0, f'grp : "{group_token(group_id)}" AND {match}')
+        with self._lock:
+            self._commit(); self._stats["queries"] += 1
+            total = self._conn.execute(f"SELECT COUNT(*) FROM {source} WHERE {where}", params).fetchone()[0]
+            rows = self._conn.execute(f"SELECT m.timestamp, m.sender, m.content FROM {source} WHERE {where} ORDER BY m.timestamp DESC, m.id DESC LIMIT ? OFFSET ?",
+                                      params + [int(limit), int(offset)]).fetchall()
+        return total, rows
+
+    def bulk_index(self, group_id, lines, batch_size=5000):
+        # 导入一个群的历史记录: 先删除该群上次批量导入的内容, 再导入早于实时索引第一条记录的行
+        with self._lock:
+            self._commit()
+            cutoff = self._conn.execute("SELECT MIN(timestamp) FROM search_log WHERE group_id = ? AND bulk = 0", (group_id,)).fetchone()[0]
+            old = self._conn.execute("SELECT id, content FROM search_log WHERE group_id = ? AND bulk = 1", (group_id,)).fetchall()
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT INTO search_fts (search_fts, rowid, grp, uni, bi) VALUES ('delete', ?, ?, ?, ?)",
+                                   [(row_id, group_token(group_id), *tokenize(content)) for row_id, content in old])
+            self._conn.execute("DELETE FROM search_log WHERE group_id = ? AND bulk = 1", (group_id,))
+            self._conn.execute("COMMIT")
+        count = 0; batch = []
+        for ts, sender, content in lines:
+            if cutoff and ts >= cutoff: continue
+            batch.append((group_id, ts, sender, content, 1))
+            if len(batch) >= batch_size: count += self._insert_bulk(batch); batch = []
+        if batch: count += self._insert_bulk(batch)
+        return count
+
+    def _insert_bulk(self, batch):
+        with self._lock:
+            self._pending.extend(batch); self._commit()
+        return len(batch)
+
+    def close(self):
+        with self._lock:
+            self._commit()
+            try: self._conn.close()
+            except sqlite3.Error as e: logger.warning(f"[RevocationAndLogger] 关闭搜索索引失败: {e}")
+
+    def stats(self):
+        with self._lock: return {"pending": len(self._pending), **self._stats}
+
+
+def _read_group_id(path):
+    with LogArchive.open_text(path) as f:
+        for line in f:
+            if line.startswith(HEADER_GROUP_ID): return line[len(HEADER_GROUP_ID):].strip()
+            if not line.startswith("#"): return None
+    return None
+
+
+def find_log_files(log_dir):
+    # 返回 {群聊ID: [文件]}: chat_logs/<群聊ID>.txt 以及分区目录 chat_logs/<群聊ID>/<日期>.txt(.gz/.zst)
+    groups = {}
+    for name in sorted(os.listdir(log_dir)):
+        path = os.path.join(log_dir, name)
+        if os.path.isfile(path) and name.endswith(".txt"):
+            groups.setdefault(_read_group_id(path) or name[:-4], []).append(path)
+        elif os.path.isdir(path) and name != "last_spoken":
+            files = [os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith((".txt", ".txt.gz", ".txt.zst"))]
+            if not files: continue
+            group_id = next(filter(None, map(_read_group_id, files)), None) or name
+            groups.setdefault(group_id, []).extend(files)
+    return groups
+
+
+def iter_log_lines(paths):
+    for path in paths:
+        with LogArchive.open_text(path) as f:
+            for line in f:
+                m = LINE_PATTERN.match(line.rstrip('\n'))
+                if m: yield m.group(1), m.group(2), m.group(3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="为已有的群聊记录批量建立搜索索引")
+    parser.add_argument("log_dir", help="聊天记录目录, 如 dify-on-wechat/chat_logs")
+    parser.add_argument("--db", help="索引文件, 默认为 <log_dir>/search.db")
+    args = parser.parse_args()
+    index = SearchIndex(args.db or os.path.join(args.log_dir, "search.db"))
+    started = time.time(); total = 0
+    for group_id, paths in find_log_files(args.log_dir).items():
+        count = index.bulk_index(group_id, iter_log_lines(paths)); total += count
+        logger.info(f"[RevocationAndLogger] {group_id}: 导入 {count} 条 ({len(paths)} 个文件)")
+    index.close()
+    elapsed = time.time() - started
+    logger.info(f"[RevocationAndLogger] 批量索引完成: {total} 条, 用时 {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} 条/秒)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,678 @@
+# -*- coding: utf-8 -*-
+# 本地缓存/记录守护进程: 同一台机器上的多个 dify-on-wechat 进程 (不同账号, 可能在同一个群里) 通过 Unix 域套接字共用
+# 一份撤回缓存、tmp 媒体文件、聊天记录/最后发言/搜索索引/群活跃的写入, 并按消息 ID 去重, 同一条消息只由最先收到的进程处理
+# 用法: 在 dify-on-wechat 目录下运行 python -m plugins.RevocationAndLogger.sidecar --socket tmp/revocation.sock
+#      或在配置中设置 sidecar_socket, 由第一个连接不上的插件实例自动启动 (sidecar_autostart)
+# 守护进程没有自己的配置: 第一个连接的插件实例在 hello 请求中带上自己的配置和目录, 之后连接的实例沿用
+# 协议: 每行一个 JSON 请求 {"op": "storage.append_log", "args": [...], "reply": false}, reply 为 true 时返回一行 {"ok": ..., "result"/"error": ...}
+# 同一连接上的请求按顺序处理, 不需要回复的请求 (写记录、更新缓存等) 只管发送; 套接字权限为 0600, 只接受同一用户的进程
+
+import argparse
+import collections
+import json
+import os
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from common.log import logger
+
+from .activity import ActivityIndex
+from .cache_policy import CachePolicy
+from .log_writer import GroupLogRecord
+from .media_prefetch import MediaPrefetcher
+from .media_retention import MediaRetainer, sweep_tmp
+from .media_store import MediaStore
+from .revoke_cache import RevokeCache, CachedMessage
+from .scheduler import Scheduler
+from .search_index import SearchIndex
+from .storage import create_storage, sanitize_filename
+
+TMP_PATH = 7  # 守护进程中缓存的消息是 RemoteRevokeCache._pack 生成的列表, tmp 路径在第 8 个字段
+AUTOSTART_INTERVAL = 30  # 自动启动守护进程的最短间隔 (秒)
+
+
+class SidecarError(ConnectionError):
+    pass
+
+
+def _encode(obj):
+    return (json.dumps(obj, ensure_ascii=False, separators=(',', ':')) + "\n").encode('utf-8')
+
+
+class ClaimSet:
+    # 最近见过的消息 ID -> 到期时间; 有效期固定, 插入顺序即到期顺序, 清理只需从队首弹出
+    def __init__(self, ttl=3600):
+        self.ttl = max(1.0, float(ttl))
+        self._ids = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.claimed = 0
+        self.duplicates = 0
+
+    def claim(self, key, now=None):
+        # 第一次见到 key 时返回 True
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            expire_at = self._ids.get(key)
+            if expire_at is not None and expire_at > now: self.duplicates += 1; return False
+            self._ids[key] = now + self.ttl; self._ids.move_to_end(key); self.claimed += 1
+            return True
+
+    def prune(self, now=None):
+        now = time.monotonic() if now is None else now; removed = 0
+        with self._lock:
+            while self._ids:
+                key, expire_at = next(iter(self._ids.items()))
+                if expire_at > now: break
+                del self._ids[key]; removed += 1
+        return removed
+
+    def stats(self):
+        with self._lock: return {"ids": len(self._ids), "claimed": self.claimed, "duplicates": self.duplicates}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        daemon = self.server.sidecar; daemon.connected(self.request, True)
+        try:
+            for line in self.rfile:
+                if not line.endswith(b"\n"): break  # 客户端发送到一半断开, 不处理残缺的请求
+                response = daemon.dispatch(line)
+                if response is not None: self.wfile.write(response)
+        except OSError as e: logger.debug(f"[RevocationAndLogger] 缓存守护进程的客户端连接异常断开: {e}")
+        finally: daemon.connected(self.request, False)
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class SidecarDaemon:
+    def __init__(self, socket_path):
+        self.socket_path = os.path.abspath(socket_path)
+        self.config = None
+        self.ops = {}
+        self.group_names = {}
+        self._setup_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._counters = {"clients": 0, "connections": 0, "requests": 0, "errors": 0}
+        self._pending_release = collections.deque()
+        self._connections = {}  # 客户端套接字 -> 处理线程
+        self._server = None
+        self._lock_file = None
+        self.scheduler = None
+
+    def count(self, name, amount=1):
+        with self._lock: self._counters[name] += amount
+
+    def connected(self, sock, alive):
+        with self._lock:
+            if alive: self._connections[sock] = threading.current_thread(); self._counters["connections"] += 1
+            else: self._connections.pop(sock, None)
+            self._counters["clients"] = len(self._connections)
+
+    def hello(self, config, paths):
+        # 第一个客户端的配置和目录用于初始化; 返回守护进程实际使用的目录, 以及是否有搜索索引
+        with self._setup_lock:
+            if self.config is None: self.setup(config, paths)
+            elif os.path.abspath(paths["log_dir"]) != self.log_dir:
+                logger.warning(f"[RevocationAndLogger] 客户端的聊天记录目录 {paths['log_dir']} 与守护进程的 {self.log_dir} 不同, 使用守护进程的目录")
+        return {"pid": os.getpid(), "log_dir": self.log_dir, "tmp_dir": self.tmp_dir, "search": self.search_index is not None}
+
+    def setup(self, config, paths):
+        self.log_dir = os.path.abspath(paths["log_dir"]); self.tmp_dir = os.path.abspath(paths["tmp_dir"])
+        last_spoken_dir = os.path.join(self.log_dir, "last_spoken")
+        for path in (self.log_dir, last_spoken_dir, self.tmp_dir): os.makedirs(path, exist_ok=True)
+        self.claims = ClaimSet(config.get("sidecar_dedupe_ttl", 3600))
+        self.media_store = MediaStore(self.tmp_dir) if config.get("media_dedup", True) else None
+        mode = config.get("media_retention", "link")
+        if mode == "reference": logger.info("[RevocationAndLogger] 缓存守护进程不支持 reference 媒体保留模式 (原文件属于各个客户端), 使用 link"); mode = "link"
+        self.media_retainer = MediaRetainer(self.tmp_dir, mode, self.media_store)
+        self.msg_cache = RevokeCache(
+            max_entries=config.get("cache_max_entries", 10000),
+            max_bytes=config.get("cache_max_mb", 512) * 1024 * 1024,
+            on_evict=self.on_cache_evict,
+        )
+        self.storage = create_storage(config, self.log_dir, last_spoken_dir, sanitize_filename, lambda group_id: self.group_names.get(group_id) or group_id)
+        self.search_index = None
+        if config.get("search_enabled", True):
+            try: self.search_index = SearchIndex(os.path.join(self.log_dir, config.get("search_index_file", "search.db")),
+                                                 batch_size=config.get("sqlite_batch_size", 200), flush_interval=config.get("log_flush_interval", 2))
+            except Exception as e: logger.error(f"[RevocationAndLogger] 缓存守护进程初始化搜索索引失败 (需要 SQLite FTS5), 搜索功能不可用: {e}")
+        activity_dir = os.path.join(self.log_dir, "activity")
+        self.activity = ActivityIndex(lambda group_id: os.path.join(activity_dir, f"{sanitize_filename(group_id)}.json"), days=config.get("activity_days", 30))
+        self.ops = {
+            "claim": self.claims.claim,
+            "names.set": self.group_names.__setitem__,
+            "cache.put": self.msg_cache.put,
+            "cache.find": lambda keys: list(self.msg_cache.find(keys)),
+            "cache.pop": self.msg_cache.pop,
+            "cache.contains": self.msg_cache.__contains__,
+            "cache.keys": self.msg_cache.keys,
+            "cache.stats": self.msg_cache.stats,
+            "media.retain": self.media_retainer.retain,
+            "media.release": self._pending_release.append,
+            "media.stats": self.media_retainer.stats,
+            "store.stats": lambda: self.media_store.stats() if self.media_store else None,
+            "storage.append_log": lambda record: self.storage.append_log(GroupLogRecord(*record)),
+            "storage.update_last_spoken": self.storage.update_last_spoken,
+            "storage.render_last_spoken": self.storage.render_last_spoken,
+            "storage.query_last_spoken": self.storage.query_last_spoken,
+            "storage.query_logs": self.storage.query_logs,
+            "storage.stats": self.storage.stats,
+            "activity.record": self.activity.record,
+            "activity.summary": self.activity.summary,
+            "activity.stats": self.activity.stats,
+            "stats": self.stats,
+        }
+        if self.search_index:
+            self.ops.update({"search.add": lambda record: self.search_index.add(GroupLogRecord(*record)),
+                             "search.search": self.search_index.search, "search.stats": self.search_index.stats})
+
+        cleanup_interval = config.get("cleanup_interval", 60); jitter = config.get("scheduler_jitter", 0.1)
+        self.max_tmp_age = max(config.get("tmp_max_age", 86400), self._max_ttl(config) + config.get("tmp_sweep_interval", 3600))
+        jobs = [("cache_expire", self.msg_cache.expire, cleanup_interval, "skip"),
+                ("tmp_release", self.release_tmp_files, cleanup_interval, "skip"),
+                ("claim_prune", self.claims.prune, cleanup_interval, "skip"),
+                ("log_flush", self.flush_logs, config.get("log_flush_interval", 2), "delay"),
+                ("log_archive", self.storage.maintain, cleanup_interval, "skip"),
+                ("snapshot", self.storage.snapshot, config.get("last_spoken_snapshot_interval", 10) or cleanup_interval, "delay"),
+                ("activity_snapshot", self.activity.snapshot, config.get("activity_snapshot_interval", 300), "delay")]
+        if config.get("tmp_sweep_interval", 3600) > 0: jobs.append(("tmp_sweep", self.sweep_tmp_dir, config.get("tmp_sweep_interval", 3600), "skip"))
+        self.scheduler = Scheduler(name="RevocationAndLogger-sidecar-scheduler")
+        for name, fn, interval, overrun in jobs: self.scheduler.add(name, fn, interval, jitter=jitter, overrun=overrun, delay=min(1, interval))
+        self.config = config
+        logger.info(f"[RevocationAndLogger] 缓存守护进程已初始化: 聊天记录 {self.log_dir}, tmp {self.tmp_dir}, 存储 {self.storage.name}")
+
+    @staticmethod
+    def _max_ttl(config):
+        # 与插件的 tmp 清理一致: 文件至少保留到最长的缓存时间之后
+        try: return CachePolicy(config.get("cache_policy") or {}, config.get("message_expire_time", 120)).max_ttl
+        except (TypeError, ValueError, AttributeError): return float(config.get("message_expire_time", 120))
+
+    def on_cache_evict(self, row):
+        if row[TMP_PATH]: self._pending_release.append(row[TMP_PATH])
+
+    def dispatch(self, line):
+        # 返回要写回客户端的一行; 不需要回复的请求返回 None, 出错时只记日志
+        self.count("requests")
+        try:
+            request = json.loads(line); op = request["op"]; reply = request.get("reply", True); args = request.get("args", [])
+        except (ValueError, KeyError, TypeError) as e:
+            self.count("errors"); return _encode({"ok": False, "error": f"无法解析的请求: {e}"})
+        try:
+            if op == "hello": fn = self.hello
+            else:
+                fn = self.ops.get(op)
+                if fn is None: raise KeyError(f"未知的请求 '{op}'" if self.config is not None else "守护进程尚未初始化 (需要先发送 hello)")
+            result = fn(*args)
+        except Exception as e:
+            self.count("errors")
+            if not reply: logger.error(f"[RevocationAndLogger] 缓存守护进程处理 {op} 失败: {e}"); return None
+            return _encode({"ok": False, "error": f"{type(e).__name__}: {e}"})
+        return _encode({"ok": True, "result": result}) if reply else None
+
+    def flush_logs(self):
+        self.storage.flush_due()
+        if self.search_index: self.search_index.flush_due()
+
+    def release_tmp_files(self):
+        while self._pending_release: self.media_retainer.release(self._pending_release.popleft())
+
+    def sweep_tmp_dir(self):
+        referenced = {os.path.abspath(row[TMP_PATH]) for row in self.msg_cache.values() if row[TMP_PATH]}
+        removed = sweep_tmp(self.tmp_dir, referenced, self.max_tmp_age, self.media_store)
+        if removed: logger.info(f"[RevocationAndLogger] 缓存守护进程清理 tmp 目录中 {removed} 个超过 {self.max_tmp_age} 秒未被引用的文件")
+
+    def stats(self):
+        with self._lock: stats = dict(self._counters)
+        if self.config is not None:
+            stats.update({"pid": os.getpid(), "claims": self.claims.stats(), "cache": self.msg_cache.stats(), "media": self.media_retainer.stats(),
+                          "store": self.media_store.stats() if self.media_store else None,
+                          "jobs": self.scheduler.stats()})
+        return stats
+
+    def serve_forever(self):
+        # 同一个套接字只允许一个守护进程: 持有 <socket>.lock 的排他锁, 拿到锁后才删除上次遗留的套接字文件
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+        self._lock_file = open(f"{self.socket_path}.lock", 'w')
+        if fcntl is not None:
+            try: fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                logger.info(f"[RevocationAndLogger] 已有缓存守护进程在使用 {self.socket_path}, 退出"); self._lock_file.close(); return False
+        if os.path.exists(self.socket_path): os.remove(self.socket_path)
+        old_umask = os.umask(0o177)
+        try: self._server = _Server(self.socket_path, _Handler)
+        finally: os.umask(old_umask)
+        self._server.sidecar = self
+        logger.info(f"[RevocationAndLogger] 缓存守护进程启动 (PID {os.getpid()}), 监听 {self.socket_path}")
+        try: self._server.serve_forever()
+        finally: self.close()
+        return True
+
+    def shutdown(self):
+        # serve_forever 在另一个线程 (或信号处理函数) 中调用时才会返回
+        if self._server is not None: threading.Thread(target=self._server.shutdown, daemon=True).start()
+
+    def close(self):
+        # 先断开所有客户端并等待正在处理的请求结束, 再关闭存储; 客户端之后的请求会重连到新的守护进程
+        if self._server is not None: self._server.server_close()
+        with self._lock: connections = list(self._connections.items())
+        for sock, thread in connections:
+            try: sock.shutdown(socket.SHUT_RDWR)
+            except OSError: pass
+            thread.join(1)
+        try: os.remove(self.socket_path)
+        except OSError: pass
+        if self.config is not None:
+            self.scheduler.shutdown()
+            self.activity.snapshot(); self.storage.close()
+            if self.search_index: self.search_index.close()
+            self.release_tmp_files()
+            logger.info(f"[RevocationAndLogger] 缓存守护进程退出: {self.stats()}")
+        if self._lock_file is not None: self._lock_file.close()
+
+
+def start_daemon(socket_path, package):
+    # 在当前工作目录下以独立会话启动守护进程, 插件进程退出后继续运行
+    return subprocess.Popen([sys.executable, "-m", f"{package}.sidecar", "--socket", socket_path], cwd=os.getcwd(), start_new_session=True,
+                            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class SidecarClient:
+    # 一个进程一个连接, 请求串行发送; 连接断开时重连一次 (并重新发送 hello), 连不上时 1 秒内的请求直接失败
+    # autostart: 连接不上时调用, 用于启动 (或在守护进程退出后重新启动) 守护进程, 之后在 timeout 内等待套接字就绪;
+    # 同时启动的多个守护进程只有拿到锁的一个会运行; 启动后没能连上时 AUTOSTART_INTERVAL 秒内不再启动
+    def __init__(self, socket_path, config, paths, timeout=5, autostart=None):
+        self.socket_path = os.path.abspath(socket_path)
+        self._hello = [config, paths]
+        self.timeout = timeout
+        self._autostart = autostart
+        self._autostart_at = 0.0
+        self._sock = None
+        self._rfile = None
+        self._lock = threading.Lock()
+        self._retry_at = 0.0
+        self.server_info = None
+        self.generation = 0  # 每次 (重新) 连接加一, 守护进程可能已重启
+
+    def _open(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM); sock.settimeout(self.timeout)
+        try: sock.connect(self.socket_path)
+        except OSError: sock.close(); raise
+        return sock
+
+    def _connect(self):
+        if time.monotonic() < self._retry_at: raise SidecarError(f"缓存守护进程不可用 ({self.socket_path})")
+        try:
+            try: sock = self._open()
+            except (FileNotFoundError, ConnectionRefusedError):
+                if not self._autostart or time.monotonic() < self._autostart_at: raise
+                self._autostart(); self._autostart_at = time.monotonic() + AUTOSTART_INTERVAL; deadline = time.monotonic() + self.timeout
+                while True:
+                    try: sock = self._open(); break
+                    except (FileNotFoundError, ConnectionRefusedError):
+                        if time.monotonic() > deadline: raise
+                        time.sleep(0.05)
+            self._sock = sock; self._rfile = sock.makefile('rb')
+            sock.sendall(_encode({"op": "hello", "args": self._hello, "reply": True}))
+            self.server_info = self._read(); self.generation += 1; self._autostart_at = 0.0
+        except (OSError, ValueError, RuntimeError) as e:
+            self._close(); self._retry_at = time.monotonic() + 1
+            raise SidecarError(f"无法连接缓存守护进程 ({self.socket_path}): {e}") from e
+
+    def _read(self):
+        line = self._rfile.readline()
+        if not line: raise ConnectionResetError("缓存守护进程关闭了连接")
+        response = json.loads(line)
+        if not response.get("ok"): raise RuntimeError(f"缓存守护进程返回错误: {response.get('error')}")
+        return response.get("result")
+
+    def _close(self):
+        for f in (self._rfile, self._sock):
+            if f is not None:
+                try: f.close()
+                except OSError: pass
+        self._sock = self._rfile = None
+
+    def _request(self, op, args, reply):
+        # 连接或发送失败 (如守护进程重启后旧连接已断开) 时重连并重发一次; 请求发出后等回复失败则不重发:
+        # claim / cache.put / storage.append_log 等不是幂等的, 守护进程可能已经处理过
+        data = _encode({"op": op, "args": args, "reply": reply})
+        with self._lock:
+            for attempt in (0, 1):
+                try:
+                    if self._sock is None: self._connect()
+                    self._sock.sendall(data); break
+                except SidecarError: raise
+                except OSError as e:
+                    self._close()
+                    if attempt: raise SidecarError(f"与缓存守护进程通信失败 ({op}): {e}") from e
+            if not reply: return None
+            try: return self._read()
+            except (OSError, ValueError) as e:
+                self._close(); raise SidecarError(f"等待缓存守护进程回复失败 ({op}): {e}") from e
+
+    def connect(self):
+        with self._lock:
+            if self._sock is None: self._connect()
+        return self.server_info
+
+    def call(self, op, *args):
+        return self._request(op, args, True)
+
+    def send(self, op, *args):
+        self._request(op, args, False)
+
+    def claim(self, msg_id):
+        return self.call("claim", msg_id)
+
+    def close(self):
+        with self._lock: self._close()
+
+
+class LocalFallback:
+    # 守护进程不可用时使用的本进程内实现, 第一次需要时才用 factory 创建; 守护进程恢复后不再写入, 但仍可查询和清理
+    def __init__(self, factory):
+        self._factory = factory
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._value is None: self._value = self._factory()
+            return self._value
+
+    def peek(self):
+        return self._value
+
+
+class RemoteRevokeCache:
+    # 共享撤回缓存: 与 RevokeCache 相同的接口, 条目保存在守护进程中
+    # 媒体消息先写入不带文件的占位条目 (其他进程撤回时至少能通知类型), 本进程保留 Future;
+    # 后台缓存完成后 (插件调用 update_size) 带 tmp 路径重新写入, 失败时插件调用 pop 删除
+    # 守护进程不可用期间的消息缓存在 fallback (本进程内的 RevokeCache) 中, 查找时一并查找
+    def __init__(self, client, ctype_fn, fallback):
+        self._client = client
+        self._ctype = ctype_fn  # 类型名 -> ContextType
+        self._fallback = fallback
+        self._pending = {}  # primary key -> (keys, CachedMessage, expire_at)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _pack(value, tmp_path=None):
+        return [value.msg_id, value.ctype.name, value.content, value.from_user_id, value.actual_user_id, value.actual_user_nickname, value.create_time, tmp_path]
+
+    def _unpack(self, row):
+        return CachedMessage(row[0], self._ctype(row[1]), *row[2:]) if row else None
+
+    def put(self, keys, value, expire_at, size=0):
+        keys = [k for k in dict.fromkeys(keys) if k]
+        if not keys: return
+        try:
+            if isinstance(value.tmp_path, Future):
+                with self._lock: self._pending[keys[0]] = (keys, value, expire_at)
+                self._client.send("cache.put", keys, self._pack(value), expire_at, 0); return
+            self._client.send("cache.put", keys, self._pack(value, value.tmp_path), expire_at, size)
+        except SidecarError:
+            with self._lock: self._pending.pop(keys[0], None)
+            self._fallback.get().put(keys, value, expire_at, size)
+
+    def update_size(self, key, size):
+        with self._lock: pending = self._pending.pop(key, None)
+        if pending is None:
+            local = self._fallback.peek()
+            if local is not None: local.update_size(key, size)
+            return
+        keys, value, expire_at = pending; future = value.tmp_path
+        tmp_path = future.result() if future.done() and not future.cancelled() and future.exception() is None else None
+        if not tmp_path: return
+        try: self._client.send("cache.put", keys, self._pack(value, tmp_path), expire_at, size)
+        except SidecarError:
+            value = CachedMessage(value.msg_id, value.ctype, value.content, value.from_user_id, value.actual_user_id, value.actual_user_nickname, value.create_time, tmp_path)
+            self._fallback.get().put(keys, value, expire_at, size)
+
+    def _drop_pending(self, pending):
+        # 丢弃占位时后台缓存可能还没完成: 能取消就取消, 否则完成后释放守护进程中的引用
+        future = pending[1].tmp_path
+        if future.cancel(): return
+        MediaPrefetcher.when_ready(future, self._release)
+
+    def _release(self, tmp_path):
+        try: self._client.send("media.release", tmp_path)
+        except SidecarError: pass  # 守护进程重启后不再有这个引用, 文件由它的 tmp 清理任务删除
+
+    def get(self, key, now=None):
+        return self.find([key], now)[1]
+
+    def find(self, keys, now=None):
+        # 本进程正在缓存的媒体消息优先, 撤回时可以等待下载完成; 然后是守护进程不可用期间缓存在本进程的消息
+        with self._lock:
+            for key in keys:
+                for pending_keys, value, _ in self._pending.values():
+                    if key in pending_keys: return key, value
+        local = self._fallback.peek()
+        if local is not None:
+            key, value = local.find(keys, now)
+            if value is not None: return key, value
+        try: key, row = self._client.call("cache.find", list(keys))
+        except SidecarError: return None, None
+        return key, self._unpack(row)
+
+    def pop(self, key):
+        with self._lock: pending = self._pending.pop(key, None)
+        local = self._fallback.peek(); value = local.pop(key) if local is not None else None
+        try: row = self._client.call("cache.pop", key)
+        except SidecarError: row = None
+        if pending is not None: self._drop_pending(pending); return pending[1]
+        return value if value is not None else self._unpack(row)
+
+    def expire(self, now=None):
+        # 守护进程自己清理过期条目, 这里只清理本地没有完成的占位和本进程内的缓存
+        now = time.time() if now is None else now
+        with self._lock:
+            expired = [self._pending.pop(key) for key, (_, _, expire_at) in list(self._pending.items()) if expire_at <= now]
+        for pending in expired: self._drop_pending(pending)
+        local = self._fallback.peek()
+        return len(expired) + (local.expire(now) if local is not None else 0)
+
+    def keys(self):
+        local = self._fallback.peek(); keys = local.keys() if local is not None else []
+        try: return keys + self._client.call("cache.keys")
+        except SidecarError:
+            if local is None: raise
+            return keys
+
+    def values(self):
+        local = self._fallback.peek()
+        return local.values() if local is not None else []  # 守护进程中的条目由守护进程清理 tmp
+
+    def __len__(self):
+        return self.stats()["entries"]
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._pending: return True
+        local = self._fallback.peek()
+        if local is not None and key in local: return True
+        try: return self._client.call("cache.contains", key)
+        except SidecarError: return False
+
+    def stats(self):
+        with self._lock: pending = len(self._pending)
+        local = self._fallback.peek(); local_stats = local.stats() if local is not None else None
+        try: stats = self._client.call("cache.stats")
+        except SidecarError:
+            if local_stats is None: raise
+            stats = dict.fromkeys(local_stats, 0)
+        if local_stats is not None:
+            for name in ("entries", "bytes", "hits", "misses"): stats[name] += local_stats[name]
+            stats["local"] = local_stats["entries"]
+        return {**stats, "pending": pending}
+
+
+class RemoteMediaRetainer:
+    # 媒体文件由守护进程保留到共享的 tmp 目录 (按内容去重), 返回的始终是 tmp 路径
+    # 守护进程不可用时由 fallback (本进程内的 MediaRetainer, 不去重) 保留, 这些文件也由本进程释放
+    mode = "sidecar"
+    size_of = staticmethod(MediaRetainer.size_of)
+
+    def __init__(self, client, fallback):
+        self._client = client
+        self._fallback = fallback
+        self._local = set()  # fallback 保留的 tmp 路径
+        self._lock = threading.Lock()
+
+    def retain(self, file_path):
+        try: return self._client.call("media.retain", os.path.abspath(file_path))
+        except SidecarError:
+            tmp_path = self._fallback.get().retain(file_path)
+            if tmp_path:
+                with self._lock: self._local.add(tmp_path)
+            return tmp_path
+
+    def materialize(self, value):
+        return value
+
+    def release(self, value):
+        if not value: return
+        with self._lock:
+            local = value in self._local; self._local.discard(value)
+        if local: self._fallback.get().release(value); return
+        try: self._client.send("media.release", value)
+        except SidecarError: pass  # 守护进程重启后不再有这个引用, 文件由它的 tmp 清理任务删除
+
+    def stats(self):
+        local = self._fallback.peek()
+        try: stats = self._client.call("media.stats")
+        except SidecarError:
+            if local is None: raise
+            return local.stats()
+        if local is not None:
+            for name, value in local.stats().items():
+                if name != "mode": stats[name] += value
+        return stats
+
+
+class RemoteStorage:
+    # 聊天记录与最后发言由守护进程写入; 群名在本进程解析, 每个群第一次写入前告诉守护进程 (用于文件头)
+    # 刷新、分区归档、快照和关闭都由守护进程的调度线程负责
+    # 守护进程不可用时写入 fallback (本进程内的存储, 同一个目录), 它的刷新、快照和关闭由本进程负责, 分区归档仍只由守护进程做
+    name = "sidecar"
+
+    def __init__(self, client, group_name_fn, fallback):
+        self._client = client
+        self._group_name = group_name_fn
+        self._fallback = fallback
+        self._named = set()
+        self._generation = 0
+
+    def _call(self, op, *args):
+        try: return self._client.call(op, *args)
+        except SidecarError: return getattr(self._fallback.get(), op.split(".", 1)[1])(*args)
+
+    def append_log(self, record):
+        try:
+            if self._generation != self._client.generation: self._named.clear(); self._generation = self._client.generation
+            if record.group_id not in self._named:
+                self._client.send("names.set", record.group_id, self._group_name(record.group_id)); self._named.add(record.group_id)
+            self._client.send("storage.append_log", list(record))
+        except SidecarError: self._fallback.get().append_log(record)
+
+    def update_last_spoken(self, group_id, nickname, timestamp_str):
+        try: self._client.send("storage.update_last_spoken", group_id, nickname, timestamp_str)
+        except SidecarError: self._fallback.get().update_last_spoken(group_id, nickname, timestamp_str)
+
+    def render_last_spoken(self, group_id):
+        return self._call("storage.render_last_spoken", group_id)
+
+    def query_last_spoken(self, group_id, before=None, offset=0, limit=None, newest_first=False):
+        total, rows = self._call("storage.query_last_spoken", group_id, before, offset, limit, newest_first)
+        return total, [tuple(row) for row in rows]
+
+    def query_logs(self, group_id, since=None, until=None, sender=None, limit=100):
+        return [tuple(row) for row in self._call("storage.query_logs", group_id, since, until, sender, limit)]
+
+    def flush_due(self):
+        local = self._fallback.peek()
+        if local is not None: local.flush_due()
+
+    def maintain(self):
+        pass
+
+    def snapshot(self):
+        local = self._fallback.peek()
+        return local.snapshot() if local is not None else 0
+
+    def close(self):
+        local = self._fallback.peek()
+        if local is not None: local.close()
+
+    def stats(self):
+        return self._call("storage.stats")
+
+
+class RemoteSearchIndex:
+    # 守护进程不可用期间的记录不进索引 (聊天记录里仍有), 可以之后用 search_index.py 批量导入补上
+    def __init__(self, client):
+        self._client = client
+
+    def add(self, record):
+        try: self._client.send("search.add", list(record))
+        except SidecarError: pass
+
+    def search(self, group_id, keywords=(), sender=None, since=None, until=None, offset=0, limit=10):
+        total, rows = self._client.call("search.search", group_id, list(keywords), sender, since, until, offset, limit)
+        return total, [tuple(row) for row in rows]
+
+    def flush_due(self):
+        pass
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return self._client.call("search.stats")
+
+
+class RemoteActivity:
+    # 守护进程不可用期间的消息不计入群活跃统计 (统计文件只由守护进程写, 本进程写会覆盖它的数据)
+    def __init__(self, client, days=30):
+        self._client = client
+        self.days = max(1, int(days))
+
+    def record(self, group_id, hour, member=None, kind=None):
+        try: self._client.send("activity.record", group_id, hour, member, kind)
+        except SidecarError: pass
+
+    def summary(self, group_id, now_hour, top=10):
+        return self._client.call("activity.summary", group_id, now_hour, top)
+
+    def snapshot(self):
+        return 0
+
+    def stats(self):
+        return self._client.call("activity.stats")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RevocationAndLogger 多进程共用的缓存/记录守护进程")
+    parser.add_argument("--socket", default=os.path.join("tmp", "revocation_sidecar.sock"), help="Unix 域套接字路径, 与插件配置的 sidecar_socket 一致")
+    args = parser.parse_args()
+    daemon = SidecarDaemon(args.socket)
+    for signum in (signal.SIGTERM, signal.SIGINT): signal.signal(signum, lambda *_: daemon.shutdown())
+    daemon.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
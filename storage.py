@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from common.log import logger
+
+from .log_archive import LogArchive
+from .log_writer import GroupLogWriter
+from .last_spoken import LastSpokenIndex
+from .striped_lock import StripedLock
+
+
+def sanitize_filename(name):
+    if not name: return f"unknown_{str(uuid.uuid4())[:8]}"
+    name = re.sub(r'[\\/*?:"<>|]+', '_', name)
+    name = name.strip('. ')
+    name = re.sub(r'[\s_]+', '_', name)
+    if not name: return f"unknown_{str(uuid.uuid4())[:8]}"
+    return name
+
+
+class TextFileStorage:
+    # 默认存储: chat_logs/<群聊ID>.txt 与 chat_logs/last_spoken/<群聊ID>-最后发言.txt
+    # 开启 log_rotation 后聊天记录改为 chat_logs/<群聊ID>/<日期>.txt 分区, 见 LogArchive
+    name = "text"
+
+    def __init__(self, log_dir, last_spoken_dir, sanitize_fn, group_name_fn, config):
+        self.log_dir = log_dir
+        self.last_spoken_dir = last_spoken_dir
+        self._sanitize = sanitize_fn
+        self._group_name = group_name_fn
+        self.log_writer = GroupLogWriter(
+            max_open_files=config.get("log_max_open_files", 64),
+            flush_lines=config.get("log_flush_lines", 50),
+            flush_interval=config.get("log_flush_interval", 2),
+        )
+        self.last_spoken = LastSpokenIndex(self.last_spoken_file_path)
+        self._group_locks = StripedLock()
+        self.archive = None
+        rotation = str(config.get("log_rotation", "none")).strip().lower()
+        if rotation in LogArchive.KEY_LENGTH:
+            self.archive = LogArchive(
+                log_dir, sanitize_fn, self.log_writer, rotation,
+                compression=str(config.get("log_compression", "gzip")).strip().lower(),
+                retention_days=config.get("log_retention_days", 0),
+                retention_mb=config.get("log_retention_mb", 0),
+                interval=config.get("log_archive_interval", 600),
+            )
+        elif rotation != "none":
+            logger.warning(f"[RevocationAndLogger] 未知的聊天记录分区方式 '{rotation}', 不分区")
+
+    def log_file_path(self, group_id):
+        return os.path.join(self.log_dir, f"{self._sanitize(group_id)}.txt")
+
+    def last_spoken_file_path(self, group_id):
+        return os.path.join(self.last_spoken_dir, f"{self._sanitize(group_id)}-最后发言.txt")
+
+    def append_log(self, record):
+        # 同一群聊的文件头与记录在分段锁内写入, 多线程同时写新群聊时文件头一定在第一行
+        with self._group_locks(record.group_id):
+            if self.archive is None:
+                log_file_path = self.log_file_path(record.group_id); need_header = self.log_writer.claim_header(log_file_path)
+            else: log_file_path, need_header = self.archive.register(record.group_id, record.timestamp_str)
+            header_content = ""
+            if need_header:
+                try:
+                    group_name = self._group_name(record.group_id)
+                    header_content += f"# 群聊名称: {group_name if group_name else '未能获取'}\n"
+                    header_content += f"# 群聊 ID: {record.group_id}\n"
+                    header_content += f"# 文件创建时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+                    header_content += "---\n"
+                except Exception as header_e:
+                    logger.error(f"[RevocationAndLogger] 获取群名或生成文件头失败 (GroupID: {record.group_id}): {header_e}")
+                    header_content = ""
+            self.log_writer.write(log_file_path, f"{header_content}{record.timestamp_str} 【{record.sender_nickname}】{record.content}\n")
+
+    def update_last_spoken(self, group_id, nickname, timestamp_str):
+        self.last_spoken.update(group_id, nickname, timestamp_str)
+
+    def render_last_spoken(self, group_id):
+        return self.last_spoken.render(group_id)
+
+    def query_last_spoken(self, group_id, before=None, offset=0, limit=None, newest_first=False):
+        return self.last_spoken.query(group_id, before, offset, limit, newest_first)
+
+    def query_logs(self, group_id, since=None, until=None, sender=None, limit=100):
+        # 文本存储只能顺序扫描; 时间格式 YYYY-MM-DD HH:MM 可以直接按字符串比较
+        # 分区存储时先按 manifest 跳过时间范围外的分区
+        self.log_writer.flush()
+        results = []
+        if self.archive is None: paths = [self.log_file_path(group_id)]
+        else: paths = self.archive.partition_files(group_id, since, until)
+        for path in paths:
+            try:
+                with (LogArchive.open_text(path) if self.archive else open(path, 'r', encoding='utf-8')) as f:
+                    for line in f:
+                        ts = line[:16]; start = line.find('【', 16); end = line.find('】', start + 1)
+                        if start != 17 or end < 0: continue
+                        if (since and ts < since) or (until and ts > until): continue
+                        if sender and line[start + 1:end] != sender: continue
+                        results.append((ts, line[start + 1:end], line[end + 1:].rstrip('\n')))
+                        if len(results) >= limit: return results
+            except FileNotFoundError: pass
+        return results
+
+    def flush_due(self):
+        self.log_writer.flush_due()
+
+    def maintain(self):
+        if self.archive is not None: self.archive.maybe_run()
+
+    def snapshot(self):
+        os.makedirs(self.last_spoken_dir, exist_ok=True)
+        return self.last_spoken.snapshot()
+
+    def close(self):
+        self.log_writer.close()
+        self.snapshot()
+
+    def stats(self):
+        stats = {"engine": self.name, **self.log_writer.stats(), **{f"last_spoken_{k}": v for k, v in self.last_spoken.stats().items()}}
+        if self.archive is not None: stats.update({f"archive_{k}": v for k, v in self.archive.stats().items()})
+        return stats
+
+
+class SQLiteStorage:
+    # 可选存储: 同样的记录写入本地 SQLite (WAL 模式), 批量事务提交
+    name = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS groups (
+            group_id TEXT PRIMARY KEY,
+            group_name TEXT,
+            created_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS chat_log (
+            id INTEGER PRIMARY KEY,
+            group_id TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            sender TEXT NOT NULL,
+            content TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_chat_log_group_ts ON chat_log (group_id, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_chat_log_group_sender ON chat_log (group_id, sender);
+        CREATE TABLE IF NOT EXISTS last_spoken (
+            group_id TEXT NOT NULL,
+            sender TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            UNIQUE (group_id, sender)
+        );
+        CREATE INDEX IF NOT EXISTS idx_last_spoken_group_ts ON last_spoken (group_id, timestamp);
+    """
+
+    def __init__(self, db_path, group_name_fn, config):
+        self.db_path = db_path
+        self._group_name = group_name_fn
+        self.batch_size = max(1, int(config.get("sqlite_batch_size", 200)))
+        self.flush_interval = max(0.0, float(config.get("log_flush_interval", 2)))
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+        self._pending_logs = []
+        self._pending_spoken = {}  # (group_id, sender) -> timestamp, 同一批次内只保留最新值
+        self._pending_since = None
+        self._known_groups = set()
+        self._commits = 0
+
+    def append_log(self, record):
+        if record.group_id not in self._known_groups: self._register_group(record.group_id)
+        with self._lock:
+            self._pending_logs.append((record.group_id, record.timestamp_str, record.sender_nickname, record.content))
+            self._maybe_commit()
+
+    def _register_group(self, group_id):
+        self._known_groups.add(group_id)
+        try: group_name = self._group_name(group_id)
+        except Exception as e:
+            logger.error(f"[RevocationAndLogger] 获取群名失败 (GroupID: {group_id}): {e}"); group_name = None
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO groups (group_id, group_name, created_at) VALUES (?, ?, ?)",
+                               (group_id, group_name, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+    def update_last_spoken(self, group_id, nickname, timestamp_str):
+        with self._lock:
+            self._pending_spoken[(group_id, nickname)] = timestamp_str
+            self._maybe_commit()
+
+    def _maybe_commit(self):
+        if self._pending_since is None: self._pending_since = time.monotonic()
+        if len(self._pending_logs) + len(self._pending_spoken) >= self.batch_size or time.monotonic() - self._pending_since >= self.flush_interval:
+            self._commit()
+
+    def _commit(self):
+        if not self._pending_logs and not self._pending_spoken: return
+        try:
+            self._conn.execute("BEGIN")
+            if self._pending_logs:
+                self._conn.executemany("INSERT INTO chat_log (group_id, timestamp, sender, content) VALUES (?, ?, ?, ?)", self._pending_logs)
+            if self._pending_spoken:
+                self._conn.executemany(
+                    "INSERT INTO last_spoken (group_id, sender, timestamp) VALUES (?, ?, ?) "
+                    "ON CONFLICT (group_id, sender) DO UPDATE SET timestamp = excluded.timestamp",
+                    [(gid, sender, ts) for (gid, sender), ts in self._pending_spoken.items()])
+            self._conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            # 提交失败时保留待写入数据, 下次提交时重试
+            logger.error(f"[RevocationAndLogger] SQLite 批量写入失败: {e}")
+            try: self._conn.execute("ROLLBACK")
+            except sqlite3.Error: pass
+            return
+        self._pending_logs = []; self._pending_spoken = {}; self._pending_since = None; self._commits += 1
+
+    def render_last_spoken(self, group_id):
+        with self._lock:
+            self._commit()
+            rows = self._conn.execute("SELECT sender, timestamp FROM last_spoken WHERE group_id = ? ORDER BY rowid", (group_id,)).fetchall()
+        if not rows: return None
+        return ''.join(f"【{sender}】{ts}\n" for sender, ts in rows)
+
+    def query_last_spoken(self, group_id, before=None, offset=0, limit=None, newest_first=False):
+        where = "WHERE group_id = ?"; params = [group_id]
+        if before: where += " AND timestamp < ?"; params.append(before)
+        sql = f"SELECT sender, timestamp FROM last_spoken {where} ORDER BY timestamp {'DESC' if newest_first else 'ASC'}, sender {'DESC' if newest_first else 'ASC'} LIMIT ? OFFSET ?"
+        with self._lock:
+            self._commit()
+            total = self._conn.execute(f"SELECT COUNT(*) FROM last_spoken {where}", params).fetchone()[0]
+            rows = self._conn.execute(sql, params + [-1 if limit is None else int(limit), int(offset)]).fetchall()
+        return total, rows
+
+    def query_logs(self, group_id, since=None, until=None, sender=None, limit=100):
+        sql = "SELECT timestamp, sender, content FROM chat_log WHERE group_id = ?"; params = [group_id]
+        if since: sql += " AND timestamp >= ?"; params.append(since)
+        if until: sql += " AND timestamp <= ?"; params.append(until)
+        if sender: sql += " AND sender = ?"; params.append(sender)
+        sql += " ORDER BY timestamp, id LIMIT ?"; params.append(int(limit))
+        with self._lock:
+            self._commit()
+            return self._conn.execute(sql, params).fetchall()
+
+    def flush_due(self):
+        with self._lock:
+            if self._pending_since is not None and time.monotonic() - self._pending_since >= self.flush_interval: self._commit()
+
+    def snapshot(self):
+        with self._lock: self._commit()
+        return 0
+
+    def maintain(self):
+        pass
+
+    def close(self):
+        with self._lock:
+            self._commit()
+            try: self._conn.close()
+            except sqlite3.Error as e: logger.warning(f"[RevocationAndLogger] 关闭 SQLite 连接失败: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {"engine": self.name, "pending_logs": len(self._pending_logs), "pending_last_spoken": len(self._pending_spoken), "commits": self._commits}
+
+
+def create_storage(config, log_dir, last_spoken_dir, sanitize_fn, group_name_fn):
+    engine = str(config.get("storage_engine", "text")).strip().lower()
+    if engine == "sqlite":
+        db_path = os.path.join(log_dir, config.get("sqlite_file", "chat_logs.db"))
+        try:
+            storage = SQLiteStorage(db_path, group_name_fn, config)
+            logger.info(f"[RevocationAndLogger] 使用 SQLite 存储: {db_path}")
+            return storage
+        except sqlite3.Error as e:
+            logger.error(f"[RevocationAndLogger] 初始化 SQLite 存储失败, 改用文本存储: {e}")
+    elif engine != "text":
+        logger.warning(f"[RevocationAndLogger] 未知的存储类型 '{engine}', 使用文本存储")
+    return TextFileStorage(log_dir, last_spoken_dir, sanitize_fn, group_name_fn, config)
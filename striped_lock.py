@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from contextlib import contextmanager
+
+
+class StripedLock:
+    # 固定数量的锁按 key 的哈希分配: 同一个 key (群聊ID/文件路径) 始终用同一把锁, 不同 key 大多落在不同的锁上互不阻塞
+    # 锁的数量不随群聊数量增长; 使用 RLock, 持有时可以再次进入 (如 append_log 持锁后再调用 write)
+    def __init__(self, stripes=64):
+        self._locks = [threading.RLock() for _ in range(max(1, int(stripes)))]
+
+    def __call__(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+    def __len__(self):
+        return len(self._locks)
+
+    @contextmanager
+    def all(self):
+        # 按固定顺序取得全部锁 (关闭时使用); 其他地方同时最多阻塞等待一把, 不会死锁
+        acquired = []
+        try:
+            for lock in self._locks: lock.acquire(); acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired): lock.release()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import queue
+import threading
+import traceback
+
+from common.log import logger
+
+_STOP = object()
+
+
+class ShardedWriterQueue:
+    # 按 key (群聊ID) 分片到固定的工作线程, 同一个 key 的任务始终按提交顺序执行
+    def __init__(self, workers=2, queue_size=10000, put_timeout=0.05, name="RevocationAndLogger-writer"):
+        self.workers = max(1, int(workers))
+        self.put_timeout = max(0.0, float(put_timeout))
+        self._queues = [queue.Queue(maxsize=max(1, int(queue_size))) for _ in range(self.workers)]
+        self._enqueued = [0] * self.workers
+        self._processed = [0] * self.workers
+        self._dropped = [0] * self.workers
+        self._errors = [0] * self.workers
+        self._max_depth = [0] * self.workers
+        self._counter_lock = threading.Lock()
+        self._shard_locks = [threading.Lock() for _ in range(self.workers)]  # 停止检查和入队在同一把锁内, 与 shutdown 互斥
+        self._stopped = False
+        self._stop_timeout = None
+        self._threads = []
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, args=(i,), name=f"{name}-{i}", daemon=True)
+            t.start(); self._threads.append(t)
+
+    def shard_of(self, key):
+        return hash(key) % self.workers
+
+    def submit(self, key, fn, *args):
+        idx = self.shard_of(key); q = self._queues[idx]
+        with self._shard_locks[idx]:
+            stopped = self._stopped
+            if not stopped:
+                try:
+                    if self.put_timeout > 0: q.put((fn, args), timeout=self.put_timeout)
+                    else: q.put_nowait((fn, args))
+                except queue.Full:
+                    with self._counter_lock: self._dropped[idx] += 1
+                    return False
+        if stopped:
+            # 停止后在调用线程里同步执行; 先等该分片的工作线程做完停止前入队的任务, 同一个 key 仍按提交顺序执行
+            worker = self._threads[idx]
+            if worker is not threading.current_thread(): worker.join(self._stop_timeout)
+            fn(*args); return True
+        with self._counter_lock:
+            self._enqueued[idx] += 1
+            depth = q.qsize()
+            if depth > self._max_depth[idx]: self._max_depth[idx] = depth
+        return True
+
+    def _run(self, idx):
+        q = self._queues[idx]
+        while True:
+            item = q.get()
+            try:
+                if item is _STOP: return
+                fn, args = item
+                try: fn(*args)
+                except Exception as e:
+                    self._errors[idx] += 1
+                    logger.error(f"[RevocationAndLogger] 后台写入任务失败: {e}")
+                    logger.error(f"[RevocationAndLogger] 错误详情: {traceback.format_exc()}")
+                self._processed[idx] += 1
+            finally: q.task_done()
+
+    def flush(self):
+        for q in self._queues: q.join()
+
+    def shutdown(self, timeout=10):
+        # 持有所有分片的锁切换为同步执行, 之后的任务不会排到停止标记后面而被遗漏
+        for lock in self._shard_locks: lock.acquire()
+        try:
+            if self._stopped: return
+            self._stopped = True; self._stop_timeout = timeout
+        finally:
+            for lock in self._shard_locks: lock.release()
+        for q in self._queues: q.put(_STOP)
+        for t in self._threads: t.join(timeout)
+
+    def stats(self):
+        with self._counter_lock:
+            return {
+                "workers": self.workers,
+                "depth": sum(q.qsize() for q in self._queues),
+                "max_depth": max(self._max_depth),
+                "enqueued": sum(self._enqueued),
+                "processed": sum(self._processed),
+                "dropped": sum(self._dropped),
+                "errors": sum(self._errors),
+            }